@@ -0,0 +1,138 @@
+"""
+Screen Recorder - command line
+
+Drives RecordingSession without Tk, e.g. for scripted or batch captures.
+Options start from DEFAULT_OPTIONS, then --options (a JSON object with the
+same keys), then the flags given.
+
+Usage:
+    python -m recorder [gui]
+    python -m recorder record [--seconds S] [--count N] [--output FILE] [--pause-at S ...] [--pause-for S]
+                              [--quality Q] [--region X,Y,W,H] [--testsrc [WxH]] [--system-audio] [--mic]
+                              [--synthetic-audio] [--sys-volume V] [--mic-volume V] [--adaptive]
+                              [--save-dir DIR] [--options FILE] [--trace]
+
+record runs until --seconds of recorded time (pauses excluded), or until
+Ctrl+C, then finalizes and prints a JSON summary per recording. With
+--trace, each recording also gets a Chrome trace (recording_X.trace.json).
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from . import trace
+
+def gui():
+    import tkinter as tk
+    from .app import ScreenRecorderApp
+    root = tk.Tk()
+    ScreenRecorderApp(root)
+    root.mainloop()
+
+def _record_until(session, seconds, wake):
+    """Keep the session ticking until it has recorded seconds (None: until Ctrl+C); wake.set() ticks at once."""
+    while seconds is None or session.elapsed() < seconds:
+        wake.wait(1.0 if seconds is None else min(1.0, max(0.0, seconds - session.elapsed())))
+        wake.clear()
+        session.tick()
+
+def record(session, outputs, seconds=None, pause_at=(), pause_for=1.0, wake=None):
+    """Record once per output, back to back. Returns a summary per recording.
+
+    wake is the Event the session's on_crash sets.
+    """
+    wake = wake or threading.Event()
+    results = []
+    for output in outputs:
+        if not session.start():
+            results.append({'output': output, 'status': "failed", 'error': "capture did not start"})
+            continue
+        try:
+            for at in sorted(t for t in pause_at if seconds is None or t < seconds):
+                _record_until(session, at, wake)
+                session.pause()
+                time.sleep(pause_for)
+                session.resume()
+            _record_until(session, seconds, wake)
+        except KeyboardInterrupt:
+            outputs = []
+        recorded = session.elapsed()
+        job = session.stop(output)
+        session.wait()
+        if job is None:
+            results.append({'output': output, 'status': "failed", 'error': "nothing was captured"})
+            break
+        result = {'output': job.output, 'status': job.status, 'error': job.error and str(job.error),
+                  'recorded_s': round(recorded, 2), 'timings': job.timings}
+        if job.trace_since is not None:
+            result['trace'] = trace.trace_path(job.output)
+        results.append(result)
+        if not outputs:
+            break
+    return results
+
+def session_options(args):
+    options = {}
+    if args.options:
+        with open(args.options) as f:
+            options.update(json.load(f))
+    flags = {
+        'quality': args.quality, 'system_audio': args.system_audio, 'mic_audio': args.mic,
+        'synthetic_audio': args.synthetic_audio, 'sys_volume': args.sys_volume, 'mic_volume': args.mic_volume,
+        'adaptive': args.adaptive, 'save_dir': args.save_dir, 'trace': args.trace,
+    }
+    if args.region:
+        flags['region'] = tuple(int(v) for v in args.region.split(","))
+    if args.testsrc:
+        flags.update(source="testsrc", test_size=args.testsrc)
+    options.update({k: v for k, v in flags.items() if v is not None})
+    return options
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m recorder")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("gui", help="the Tk app (default)")
+    rec = sub.add_parser("record", help="record without a UI")
+    rec.add_argument("--seconds", type=float, help="recorded time per recording (default: until Ctrl+C)")
+    rec.add_argument("--count", type=int, default=1, help="recordings to make back to back")
+    rec.add_argument("--output", help="output file (numbered with --count > 1; default: save dir)")
+    rec.add_argument("--pause-at", type=float, action="append", default=[], help="pause after this much recorded time (repeatable)")
+    rec.add_argument("--pause-for", type=float, default=1.0)
+    rec.add_argument("--quality", choices=["Low", "Medium", "High", "Very High"])
+    rec.add_argument("--region", help="X,Y,W,H")
+    rec.add_argument("--testsrc", nargs="?", const="1280x720", metavar="WxH", help="lavfi test pattern instead of the desktop")
+    rec.add_argument("--system-audio", action="store_true", default=None)
+    rec.add_argument("--mic", action="store_true", default=None)
+    rec.add_argument("--synthetic-audio", action="store_true", default=None, help="sine-tone audio backends")
+    rec.add_argument("--sys-volume", type=float)
+    rec.add_argument("--mic-volume", type=float)
+    rec.add_argument("--adaptive", action="store_true", default=None)
+    rec.add_argument("--save-dir")
+    rec.add_argument("--options", help="JSON file of RecordingSession options")
+    rec.add_argument("--trace", action="store_true", default=None, help="write a Chrome trace next to each recording")
+    args = parser.parse_args(argv)
+
+    if args.command in (None, "gui"):
+        gui()
+        return
+    from .session import RecordingSession
+    wake = threading.Event()
+    session = RecordingSession(session_options(args), on_crash=wake.set)
+    outputs = [None] * args.count
+    if args.output:
+        root, ext = os.path.splitext(args.output)
+        outputs = [args.output] if args.count == 1 else [f"{root}_{i:03d}{ext}" for i in range(args.count)]
+    try:
+        results = record(session, outputs, args.seconds, args.pause_at, args.pause_for, wake)
+    finally:
+        session.close()
+    print(json.dumps(results, indent=2))
+    if any(r['status'] != "done" for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
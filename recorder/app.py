@@ -1,21 +1,17 @@
 import tkinter as tk
 from tkinter import ttk, filedialog
-import subprocess
 import threading
-import keyboard
 import os
-import time
-import psutil
-from datetime import datetime
-import tempfile
+import queue
 import atexit
 import ctypes
-import shutil
 
-from .audio import AudioRecorder
+from . import trace
+from .commands import CommandDispatcher
+from .hotkeys import HotkeyHelpDialog
 from .region import RegionSelector
-from .video import HotkeyHelpDialog, VIDEO_ENCODER, ENCODER_LABEL
-from .tray import setup_tray
+from .session import RecordingSession
+from .video import cached_encoder, get_encoder
 
 class ScreenRecorderApp:
     def __init__(self, root):
@@ -24,38 +20,46 @@ class ScreenRecorderApp:
         root.minsize(420, 300)
         root.resizable(False, False)
 
-        self.ffmpeg = None
-        self.paused = False
         self.region = None
         self.tray_icon = None
-        self.video_segments = []
-        self.temp_dir = tempfile.mkdtemp(prefix="screen_recorder_video_")
-        self.audio_recorder = AudioRecorder()
-        
-        self.timer_running = False
-        self.start_time = 0 
-        self.total_session_duration = 0 
+        self.audio_dropouts = 0
+        self.timer_after = None
+        # Worker-thread job updates are queued and picked up on the Tk thread
+        self.finalize_updates = queue.Queue()
+        # Hotkey and tray presses come in on their own threads and run here, on the Tk thread
+        self.commands = CommandDispatcher(root.after)
+        # The recording engine; the UI only turns its state into options and shows progress.
+        # A crashed capture is restarted by a tick on the Tk thread, right away
+        self.commands.register("capture_crashed", lambda: self.session.tick(), debounce_s=0)
+        self.session = RecordingSession(on_slow=self.encoder_falling_behind, on_finalize=self.finalize_updates.put,
+                                        on_crash=lambda: self.commands.press("capture_crashed", "supervisor"))
 
         self.video_mode = tk.StringVar(value="fullscreen")
         self.quality = tk.StringVar(value="Medium")
+        self.adaptive_quality = tk.BooleanVar(value=False)
+        self.replay_mode = tk.BooleanVar(value=False)
         self.system_audio = tk.BooleanVar()
         self.mic_audio = tk.BooleanVar()
         self.selected_mic = tk.StringVar()
         self.sys_vol = tk.IntVar(value=100)
         self.mic_vol = tk.IntVar(value=100)
 
-        self.save_dir = os.path.join(os.path.expanduser("~"), "Videos", "Screen Recordings")
+        self.save_dir = self.session.options['save_dir']
         os.makedirs(self.save_dir, exist_ok=True)
 
         if os.name == 'nt':
             ctypes.windll.user32.ShowWindow(ctypes.windll.kernel32.GetConsoleWindow(), 0)
 
         self.build_ui()
+        self.show_encoder()
         self.update_visibility()
         self.register_hotkeys()
         self.root.protocol("WM_DELETE_WINDOW", self.hide_to_tray)
-        self.setup_tray()
-        atexit.register(self.cleanup_temp_files)
+        # pystray/PIL load after the window is up
+        self.root.after(100, self.setup_tray)
+        self.poll_finalize_updates()
+        self.commands.start()
+        atexit.register(self.session.cleanup_temp_files)
 
     def build_ui(self):
         self.main = ttk.Frame(self.root, padding=15)
@@ -69,14 +73,20 @@ class ScreenRecorderApp:
         
         # Help button on the right
         ttk.Button(header_frame, text="Hotkeys (F1)", command=self.show_hotkey_help, width=12).pack(side="left")
-        ttk.Label(self.main, text=f"Encoder: {ENCODER_LABEL}", foreground="gray").grid(row=row, column=0, sticky="w", pady=(0, 12)); row += 1
+        self.encoder_label = ttk.Label(self.main, text="Encoder: detecting...", foreground="gray")
+        self.encoder_label.grid(row=row, column=0, sticky="w", pady=(0, 12)); row += 1
         ttk.Label(self.main, text="Video Mode").grid(row=row, column=0, sticky="w"); row += 1
         ttk.Radiobutton(self.main, text="Full Screen", variable=self.video_mode, value="fullscreen", command=self.update_visibility).grid(row=row, column=0, sticky="w"); row += 1
         ttk.Radiobutton(self.main, text="Region", variable=self.video_mode, value="region", command=self.update_visibility).grid(row=row, column=0, sticky="w"); row += 1
         self.region_btn = ttk.Button(self.main, text="Select Region", command=self.select_region)
         self.region_btn.grid(row=row, column=0, sticky="w", pady=(4, 12)); row += 1
         ttk.Label(self.main, text="Quality").grid(row=row, column=0, sticky="w"); row += 1
-        ttk.Combobox(self.main, textvariable=self.quality, values=["Low", "Medium", "High", "Very High"], state="readonly", width=20).grid(row=row, column=0, sticky="w", pady=(0, 12)); row += 1
+        quality_box = ttk.Combobox(self.main, textvariable=self.quality, values=["Low", "Medium", "High", "Very High"], state="readonly", width=20)
+        quality_box.grid(row=row, column=0, sticky="w"); row += 1
+        quality_box.bind("<<ComboboxSelected>>", lambda e: self.ensure_calibration())
+        ttk.Checkbutton(self.main, text="Adaptive (lower fps/preset/size under CPU load)", variable=self.adaptive_quality).grid(row=row, column=0, sticky="w"); row += 1
+        ttk.Checkbutton(self.main, text="Instant replay (Alt+R saves the last 30 s)", variable=self.replay_mode,
+                        command=self.toggle_replay).grid(row=row, column=0, sticky="w", pady=(0, 12)); row += 1
         ttk.Label(self.main, text="Audio").grid(row=row, column=0, sticky="w"); row += 1
         ttk.Checkbutton(self.main, text="System Audio", variable=self.system_audio, command=self.update_visibility).grid(row=row, column=0, sticky="w"); row += 1
         self.sys_frame = self.add_volume_row(self.main, self.sys_vol, "System audio level (recording only)")
@@ -104,6 +114,21 @@ class ScreenRecorderApp:
         self.pause_btn.pack(side="left", padx=2)
         self.stop_btn = ttk.Button(self.recording_controls, text="Stop", command=self.toggle)
         self.stop_btn.pack(side="left", padx=2)
+        row += 1
+        self.finalize_label = ttk.Label(self.main, text="", foreground="gray")
+        self.finalize_label.grid(row=row, column=0, sticky="w", pady=(8, 0))
+
+    def show_encoder(self):
+        """Show the encoder label; detect it in the background on a cold cache."""
+        encoder = cached_encoder()
+        if encoder:
+            self.encoder_label.config(text=f"Encoder: {encoder[1]}")
+            self.ensure_calibration()
+            return
+        if not hasattr(self, "_encoder_thread"):
+            self._encoder_thread = threading.Thread(target=get_encoder, daemon=True)
+            self._encoder_thread.start()
+        self.root.after(100, self.show_encoder)
 
     def add_volume_row(self, parent, var, label_text):
         frame = ttk.Frame(parent)
@@ -129,117 +154,137 @@ class ScreenRecorderApp:
     def lock_ui(self, lock):
         state = "disabled" if lock else "normal"
         for child in self.main.winfo_children():
-            if child != self.control_container:
+            if child not in (self.control_container, self.finalize_label):
                 try: child.configure(state=state)
                 except: pass
 
     def update_timer(self):
-        if self.timer_running and not self.paused:
-            current_elapsed = time.time() - self.start_time
-            display_time = int(self.total_session_duration + current_elapsed)
-            m, s = divmod(display_time, 60); h, m = divmod(m, 60)
+        # Start and resume call this too; one chain only, or the session ticks (and the governor samples) too often
+        if self.timer_after: self.root.after_cancel(self.timer_after)
+        self.timer_after = None
+        if self.session.recording and not self.session.paused:
+            m, s = divmod(int(self.session.elapsed()), 60); h, m = divmod(m, 60)
             self.timer_label.config(text=f"{h:02d}:{m:02d}:{s:02d}")
-            self.root.after(1000, self.update_timer)
+            self.show_audio_health()
+            self.session.tick()
+            self.timer_after = self.root.after(1000, self.update_timer)
 
-    def start_video_segment(self):
-        fps, bitrate = {"Low": ("30", "1500k"), "Medium": ("60", "4500k"), "High": ("60", "8000k"), "Very High": ("60", "12000k")}[self.quality.get()]
-        segment_file = os.path.join(self.temp_dir, f"video_segment_{len(self.video_segments):04d}.mp4")
-        cmd = ["ffmpeg", "-y", "-f", "gdigrab", "-framerate", fps]
-        if self.video_mode.get() == "region" and self.region:
-            x, y, w, h = self.region
-            cmd += ["-offset_x", str(x), "-offset_y", str(y), "-video_size", f"{w}x{h}"]
-        cmd += ["-i", "desktop", "-an", "-c:v", VIDEO_ENCODER, "-b:v", bitrate, "-pix_fmt", "yuv420p", segment_file]
-        try:
-            time.sleep(0.2)
-            startupinfo = None
-            
-            if os.name == 'nt':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-            self.ffmpeg = subprocess.Popen(cmd, stdin=subprocess.PIPE, creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0, startupinfo= startupinfo)
-            return segment_file
-        except: return None
+    def show_audio_health(self):
+        """Poll the live audio and encoder stats into the tray tooltip; log new dropouts."""
+        stats = self.session.audio_recorder.metrics_snapshot()
+        dropouts = sum(s['overflows'] + s['underflows'] for s in stats.values())
+        if dropouts != self.audio_dropouts:
+            self.audio_dropouts = dropouts
+            print(f"[AUDIO] Dropouts: {dropouts}, drift: " + ", ".join(f"{n}={s['drift_ms']:.0f}ms" for n, s in stats.items()))
+        progress = self.session.capture.progress
+        if self.tray_icon and progress.get('speed') is not None:
+            self.tray_icon.title = (f"Screen Recorder - {progress['fps'] or 0:.0f} fps, {progress['speed']:.2f}x, "
+                                    f"{progress['drop_frames']} dropped, {dropouts} audio dropouts")
+
+    def encoder_falling_behind(self, stats):
+        """ProgressReader alert (reader thread): the encoder runs slower than real time."""
+        print(f"[VIDEO] Encoder falling behind: {stats['speed']:.2f}x at {stats['fps'] or 0:.0f} fps, "
+              f"{stats['drop_frames']} dropped - try a lower quality setting")
+        if self.tray_icon: self.tray_icon.notify("Encoder can't keep up - try a lower quality setting", "Screen Recorder")
+
+    def session_options(self):
+        """The UI state as RecordingSession options."""
+        return {
+            'quality': self.quality.get(),
+            'region': self.region if self.video_mode.get() == "region" else None,
+            'screen_size': f"{self.root.winfo_screenwidth()}x{self.root.winfo_screenheight()}",
+            'system_audio': self.system_audio.get(),
+            'mic_audio': self.mic_audio.get(),
+            'sys_volume': self.sys_vol.get()/100.0,
+            'mic_volume': self.mic_vol.get()/100.0,
+            'adaptive': self.adaptive_quality.get(),
+            'save_dir': self.save_dir,
+        }
+
+    def ensure_calibration(self):
+        self.session.options.update(self.session_options())
+        self.session.ensure_calibration()
+
+    def toggle_replay(self):
+        self.start_replay() if self.replay_mode.get() else self.session.stop_replay()
 
-    def stop_video_segment(self):
-        if self.ffmpeg:
-            try:
-                self.ffmpeg.stdin.write(b"q"); self.ffmpeg.stdin.flush()
-                self.ffmpeg.wait(timeout=3)
-            except: self.ffmpeg.kill()
-            finally: self.ffmpeg = None
+    def start_replay(self):
+        self.session.options.update(self.session_options())
+        if not self.session.start_replay():
+            self.replay_mode.set(False)
 
+    @trace.traced()
+    def save_replay(self):
+        """Hotkey: save the replay window as its own recording."""
+        self.session.options.update(self.session_options())
+        self.session.save_replay()
+
+    @trace.traced()
     def toggle(self):
-        if self.timer_running or self.paused:
-            self.timer_running = False
-            self.stop_video_segment()
-            self.audio_recorder.stop()
-            self.combine_and_save_segments()
+        if self.session.recording:
+            self.session.stop()
             self.recording_controls.pack_forget()
             self.start_btn.pack(side="left")
+            self.pause_btn.config(text="Pause")
             self.lock_ui(False); self.show_window()
-            self.video_segments = []; self.total_session_duration = 0; self.paused = False
+            if self.replay_mode.get(): self.start_replay()
         else:
-            self.video_segments = []; self.total_session_duration = 0
-            self.start_time = time.time(); self.timer_running = True; self.paused = False
-            self.audio_recorder.start_recording(self.system_audio.get(), self.mic_audio.get())
-            sf = self.start_video_segment()
-            if sf:
-                self.video_segments.append(sf)
+            self.session.options.update(self.session_options())
+            self.audio_dropouts = 0
+            if self.tray_icon: self.tray_icon.title = "Screen Recorder"
+            if self.session.start():
                 self.start_btn.pack_forget(); self.recording_controls.pack(side="left")
                 self.timer_label.config(text="00:00:00", foreground="red")
                 self.lock_ui(True); self.update_timer(); self.root.withdraw()
+            elif self.replay_mode.get():
+                self.start_replay()
 
+    @trace.traced()
     def pause(self):
-        if not self.paused:
-            self.total_session_duration += (time.time() - self.start_time)
-            self.paused = True; self.audio_recorder.pause(); self.stop_video_segment()
-            self.pause_btn.config(text="Resume"); self.timer_label.config(foreground="orange")
-        else:
-            self.paused = False; self.start_time = time.time()
-            self.audio_recorder.resume()
-            sf = self.start_video_segment()
-            if sf: self.video_segments.append(sf)
+        if not self.session.paused:
+            if self.session.pause():
+                self.pause_btn.config(text="Resume"); self.timer_label.config(foreground="orange")
+        elif self.session.resume():
             self.pause_btn.config(text="Pause"); self.timer_label.config(foreground="red"); self.update_timer()
 
-    def combine_and_save_segments(self):
-        if not self.video_segments: return
+    def poll_finalize_updates(self):
+        job = None
         try:
-            output = os.path.join(self.save_dir, f"recording_{datetime.now():%Y%m%d_%H%M%S}.mp4")
-            list_file = os.path.join(self.temp_dir, "video_list.txt")
-            with open(list_file, "w") as f:
-                for s in self.video_segments:
-                    if os.path.exists(s): f.write(f"file '{s.replace(os.sep, '/')}'")
-            
-            temp_v = os.path.join(self.temp_dir, "combined_v.mp4")
-            subprocess.run(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_file, "-c", "copy", temp_v], creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
-            
-            temp_a = self.audio_recorder.combine_audio_segments(os.path.join(self.temp_dir, "combined_a.wav"), self.sys_vol.get()/100.0, self.mic_vol.get()/100.0)
-            
-            cmd = ["ffmpeg", "-y", "-i", temp_v]
-            if temp_a and os.path.exists(temp_a): 
-                cmd += [ "-i", temp_a, "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac", "-b:a", "192k", "-async", "1", "-shortest"]
-            else: 
-                cmd += ["-c", "copy"]
-            cmd.append(output)
-            
-            subprocess.run(cmd, creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
-            self.cleanup_temp_files()
-        except Exception as e: print(f"Merge error: {e}")
+            while True: job = self.finalize_updates.get_nowait()
+        except queue.Empty:
+            pass
+        if job: self.show_finalize_status(job)
+        self.root.after(250, self.poll_finalize_updates)
+
+    def show_finalize_status(self, job):
+        name = os.path.basename(job.output)
+        if job.status == "queued":
+            text = f"Queued: {name}"
+        elif job.status == "running":
+            text = f"Finalizing {name}... {int(job.progress * 100)}%"
+        elif job.status == "done" and os.path.isfile(job.output):
+            text = f"Saved: {name}"
+        else:
+            text = f"Failed to save {name}: {job.error or 'no output file'}"
+        pending = self.session.finalizer.pending
+        if pending > 1:
+            text += f" ({pending - 1} more queued)"
+        self.finalize_label.config(text=text)
             
-    def cleanup_temp_files(self):
-        self.audio_recorder.cleanup()
-        if os.path.exists(self.temp_dir):
-            shutil.rmtree(self.temp_dir, ignore_errors=True)
-            self.temp_dir = tempfile.mkdtemp(prefix="screen_recorder_video_")
-    
     def show_hotkey_help(self):
         HotkeyHelpDialog.toggle(self.root)
 
     def register_hotkeys(self):
-        keyboard.add_hotkey("alt+s", self.toggle)
-        keyboard.add_hotkey("alt+p", self.pause)
-        keyboard.add_hotkey("f1", self.show_hotkey_help)
+        import keyboard
+        c = self.commands
+        c.register("toggle", self.toggle)
+        c.register("pause", self.pause, valid=lambda: self.session.recording)
+        c.register("save_replay", self.save_replay, valid=lambda: self.session.replay is not None)
+        c.register("help", self.show_hotkey_help)
+        c.register("show", self.show_window)
+        c.register("exit", self.exit_app)
+        for key, name in (("alt+s", "toggle"), ("alt+p", "pause"), ("alt+r", "save_replay"), ("f1", "help")):
+            keyboard.add_hotkey(key, c.press, args=(name,))
 
     def detect_mics(self):
         import sounddevice as sd
@@ -265,19 +310,21 @@ class ScreenRecorderApp:
 
     def select_region(self):
         sel = RegionSelector(self.root); self.root.wait_window(sel); self.region = sel.region
+        self.ensure_calibration()
 
     def select_save_folder(self):
         folder = filedialog.askdirectory()
         if folder: self.save_dir = folder; self.save_label.config(text=folder)
 
     def setup_tray(self):
+        from .tray import setup_tray
         self.tray_icon = setup_tray(self)
 
     def hide_to_tray(self): self.root.withdraw()
     def show_window(self): self.root.deiconify(); self.root.lift()
     
     def exit_app(self):
-        if self.timer_running or self.paused: self.toggle()
-        self.cleanup_temp_files()
+        if self.session.recording: self.toggle()
+        self.session.close()
         if self.tray_icon: self.tray_icon.stop()
         self.root.destroy()
@@ -1,40 +1,53 @@
-import subprocess
 import threading
 import tempfile
 import os
+import queue
+import shutil
 import time
 import wave
-import numpy as np
-from pydub import AudioSegment
-import atexit
-import sounddevice as sd
-
-try:
-    import pyaudiowpatch as pyaudio
-    WASAPI_AVAILABLE = True
-except ImportError:
-    try:
-        import pyaudio
-        WASAPI_AVAILABLE = False
-    except ImportError:
-        pyaudio = None
-        WASAPI_AVAILABLE = False
+import contextlib
+
+from . import trace
+from .metrics import StreamMetrics
+
+# numpy, sounddevice, PyAudio and pydub are imported on first use so that
+# starting the app does not pay for the audio stack
+_pyaudio = None
 
 SYSTEM_AUDIO_DELAY_MS = 240
+# Windows amplifies loopback audio relative to the mic, so system audio is
+# mixed at 70% of the user's slider level
+SYSTEM_VOLUME_REDUCTION = 0.7
+# Above this much segment data, finalize mixes out-of-core instead of in memory
+STREAMING_FINALIZE_BYTES = 512 * 1024 * 1024
+MIC_RING_SECONDS = 2
+MIC_WRITE_BLOCK_FRAMES = 4096
+# Retry delay after a loopback stream error, doubled per consecutive failure up to the cap
+STREAM_RETRY_S = 0.5
+STREAM_RETRY_MAX_S = 8.0
+
+def import_pyaudio():
+    """Return (pyaudio module or None, WASAPI loopback available), importing on first call."""
+    global _pyaudio
+    if _pyaudio is None:
+        try:
+            import pyaudiowpatch as pyaudio
+            _pyaudio = (pyaudio, True)
+        except ImportError:
+            try:
+                import pyaudio
+                _pyaudio = (pyaudio, False)
+            except ImportError:
+                _pyaudio = (None, False)
+    return _pyaudio
 
-def get_wasapi_loopback_device():
-    """Get the default WASAPI loopback device (what's playing on speakers)."""
+def get_wasapi_loopback_device(p):
+    """Get the default WASAPI loopback device (what's playing on speakers) from PyAudio instance p."""
     try:
-        if not WASAPI_AVAILABLE:
-            return None
-        
-        p = pyaudio.PyAudio()
-        
         # Try to get the default WASAPI loopback device
         try:
             wasapi_info = p.get_default_wasapi_loopback()
             print(f"[SUCCESS] Found WASAPI loopback device: {wasapi_info['name']}")
-            p.terminate()
             return wasapi_info
         except Exception as e:
             print(f"[ERROR] Could not get WASAPI loopback device: {e}")
@@ -45,105 +58,369 @@ def get_wasapi_loopback_device():
                 dev_info = p.get_device_info_by_index(i)
                 if dev_info.get('isLoopback', False) or 'loopback' in dev_info.get('name', '').lower():
                     print(f"[SUCCESS] Found loopback device: {dev_info['name']}")
-                    p.terminate()
                     return dev_info
             
-            p.terminate()
             return None
             
     except Exception as e:
         print(f"[ERROR] WASAPI detection failed: {e}")
         return None
 
-class FFmpegProcessManager:
-    def __init__(self):
-        self.processes = []
-        atexit.register(self.cleanup_all)
+class WavSegmentWriter:
+    """Stream PCM chunks to a WAV file through a bounded queue.
+
+    Chunks are written by a background thread as they arrive, so memory stays
+    flat for the whole segment. The header is fixed up on close().
+    """
+
+    def __init__(self, filename, channels, sample_width, frame_rate, max_chunks=64):
+        self.filename = filename
+        self.frames_written = 0
+        self.error = None
+        self._frame_size = channels * sample_width
+        self._wf = wave.open(filename, 'wb')
+        self._wf.setnchannels(channels)
+        self._wf.setsampwidth(sample_width)
+        self._wf.setframerate(frame_rate)
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        """Queue a chunk for writing; blocks only if the writer falls max_chunks behind."""
+        self._queue.put(data)
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self._wf.writeframesraw(data)
+                self.frames_written += len(data) // self._frame_size
+            except Exception as e:
+                print(f"[WAV WRITER] Write error on {self.filename}: {e}")
+                self.error = e
+
+    def close(self):
+        """Flush pending chunks, patch the WAV header and return the frame count."""
+        self._queue.put(None)
+        self._thread.join()
+        self._wf.close()
+        return self.frames_written
+
+class RingBuffer:
+    """Preallocated single-producer/single-consumer ring of float32 frames.
+
+    write() is called from the sounddevice callback and only copies into the
+    preallocated array; frames that do not fit are dropped and counted.
+    """
+
+    def __init__(self, capacity, channels):
+        import numpy as np
+        self.capacity = capacity
+        self.channels = channels
+        self._buf = np.zeros((capacity, channels), dtype=np.float32)
+        self._write_pos = 0
+        self._read_pos = 0
+        self._data_ready = threading.Event()
+        self.overflows = 0
+        self.dropped_frames = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return self._write_pos - self._read_pos
+
+    def reset(self):
+        self._write_pos = 0
+        self._read_pos = 0
+        self._data_ready.clear()
+
+    def write(self, frames):
+        """Copy frames into the ring. Returns the number of frames stored."""
+        n = len(frames)
+        free = self.capacity - (self._write_pos - self._read_pos)
+        if n > free:
+            self.overflows += 1
+            self.dropped_frames += n - free
+            n = free
+        if n:
+            start = self._write_pos % self.capacity
+            first = min(n, self.capacity - start)
+            self._buf[start:start + first] = frames[:first]
+            if n > first:
+                self._buf[:n - first] = frames[first:n]
+            self._write_pos += n
+            fill = self._write_pos - self._read_pos
+            if fill > self.high_water:
+                self.high_water = fill
+        self._data_ready.set()
+        return n
+
+    def read_into(self, out):
+        """Move up to len(out) frames into out. Returns the number of frames copied."""
+        n = min(len(out), self._write_pos - self._read_pos)
+        if n:
+            start = self._read_pos % self.capacity
+            first = min(n, self.capacity - start)
+            out[:first] = self._buf[start:start + first]
+            if n > first:
+                out[first:n] = self._buf[:n - first]
+            self._read_pos += n
+        return n
+
+    def wait(self, timeout):
+        """Block until new frames are written or timeout expires."""
+        ready = self._data_ready.wait(timeout)
+        self._data_ready.clear()
+        return ready
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'fill': len(self),
+            'high_water': self.high_water,
+            'overflows': self.overflows,
+            'dropped_frames': self.dropped_frames,
+        }
+
+class PcmWindow:
+    """The last seconds of one stream's PCM in a preallocated circular buffer.
+
+    Takes the same write() calls as WavSegmentWriter (and writeframesraw()
+    like a wave writer). New data overwrites the oldest, so memory stays
+    fixed however long the stream runs. save() cuts a span of
+    time.perf_counter() time out of the window as a WAV.
+    """
+
+    pending = 0
+
+    def __init__(self, seconds, channels, sample_width, frame_rate):
+        self.format = (channels, sample_width, frame_rate)
+        self._frame_size = channels * sample_width
+        self._buf = bytearray(int(seconds * frame_rate) * self._frame_size)
+        self._written = 0
+        self.last_write = None
+        self._lock = threading.Lock()
+
+    @property
+    def frames_written(self):
+        return self._written // self._frame_size
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        size = len(self._buf)
+        with self._lock:
+            skipped = max(0, len(data) - size)
+            data = data[skipped:]
+            start = (self._written + skipped) % size
+            first = min(len(data), size - start)
+            self._buf[start:start + first] = data[:first]
+            self._buf[:len(data) - first] = data[first:]
+            self._written += skipped + len(data)
+            self.last_write = time.perf_counter()
+
+    writeframesraw = write
+
+    def close(self):
+        return self.frames_written
+
+    def save(self, path, start, end):
+        """Write the frames captured between start and end to a WAV, with silence where the window has none."""
+        channels, sample_width, rate = self.format
+        fs = self._frame_size
+        with self._lock:
+            pos = self._written % len(self._buf)
+            data = bytes(self._buf[pos:] + self._buf[:pos]) if self._written >= len(self._buf) else bytes(self._buf[:pos])
+            last = self.last_write
+        frames = len(data) // fs
+        want = max(0, round((end - start) * rate))
+        # Index of the frame captured at start; the newest frame arrived at last
+        first = frames + round((start - last) * rate) if last else frames
+        lo, hi = max(0, first), min(frames, first + want)
+        head = min(want, max(0, -first))
+        body = max(0, hi - lo)
+        with wave.open(path, 'wb') as wav_file:
+            wav_file.setnchannels(channels)
+            wav_file.setsampwidth(sample_width)
+            wav_file.setframerate(rate)
+            wav_file.writeframes(bytes(head * fs) + data[lo * fs:lo * fs + body * fs] + bytes((want - head - body) * fs))
+        return path
+
+class AudioTake:
+    """Finished system and mic segments of one recording, ready to be mixed."""
+
+    def __init__(self, temp_dir, system_segments, mic_segments, sample_rate, metrics=None):
+        self.temp_dir = temp_dir
+        self.metrics = metrics
+        self.system_segments = system_segments
+        self.mic_segments = mic_segments
+        self.sample_rate = sample_rate
     
-    def start_process(self, cmd, description=""):
-        try:
-            process = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-            )
-            self.processes.append({'process': process, 'description': description})
-            return process
-        except Exception:
-            return None
+    def _valid_segments(self, segments):
+        return [s for s in segments if os.path.exists(s) and os.path.getsize(s) > 0]
     
-    def stop_process(self, process):
-        if process and process.poll() is None:
-            try:
-                process.stdin.write(b"q")
-                process.stdin.flush()
-                process.wait(timeout=3)
-            except:
-                try:
-                    process.terminate()
-                except:
-                    pass
-            finally:
-                self.processes = [p for p in self.processes if p['process'] != process]
+    def _mix_tracks(self, sys_volume, mic_volume):
+        from . import mixer
+        tracks = []
+        system_segments = self._valid_segments(self.system_segments)
+        mic_segments = self._valid_segments(self.mic_segments)
+        if system_segments:
+            tracks.append(mixer.Track(
+                system_segments,
+                gain=max(sys_volume * SYSTEM_VOLUME_REDUCTION, 0.01),
+                lead_in_ms=SYSTEM_AUDIO_DELAY_MS
+            ))
+        if mic_segments:
+            tracks.append(mixer.Track(mic_segments, gain=max(mic_volume, 0.01)))
+        return tracks
     
-    def cleanup_all(self):
-        for item in self.processes[:]:
-            self.stop_process(item['process'])
-    def __init__(self):
-        self.processes = []
-        atexit.register(self.cleanup_all)
+    def has_audio(self):
+        return bool(self._valid_segments(self.system_segments) or self._valid_segments(self.mic_segments))
     
-    def start_process(self, cmd, description=""):
+    def metrics_snapshot(self):
+        """Capture telemetry as it was when the take was detached."""
+        return self.metrics
+    
+    @trace.traced()
+    def combine_audio_segments(self, output_path, sys_volume=1.0, mic_volume=1.0, streaming=None):
+        """Mix system and mic audio segments into one normalized WAV using the NumPy mixer.
+
+        streaming=None picks the out-of-core mixer automatically once the segments
+        exceed STREAMING_FINALIZE_BYTES; True/False forces either mode.
+        """
         try:
-            process = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-            )
-            self.processes.append({'process': process, 'description': description})
-            return process
-        except Exception:
-            return None
+            from . import mixer
+            tracks = self._mix_tracks(sys_volume, mic_volume)
+            
+            if streaming is None:
+                total_bytes = sum(os.path.getsize(p) for t in tracks for p in t.paths)
+                streaming = total_bytes > STREAMING_FINALIZE_BYTES
+            mix = mixer.mix_to_wav_streaming if streaming else mixer.mix_to_wav
+            
+            if tracks and mix(output_path, tracks, self.sample_rate):
+                print(f"Combined audio saved to: {output_path}")
+                return output_path
+                
+        except Exception as e:
+            print(f"Error combining audio segments: {e}")
+        
+        return None
     
-    def stop_process(self, process):
-        if process and process.poll() is None:
-            try:
-                process.stdin.write(b"q")
-                process.stdin.flush()
-                process.wait(timeout=3)
-            except:
-                try:
-                    process.terminate()
-                except:
-                    pass
-            finally:
-                self.processes = [p for p in self.processes if p['process'] != process]
+    @trace.traced()
+    def mix_peak(self, sys_volume=1.0, mic_volume=1.0):
+        """Peak of the mix before normalization, 0.0 without audio."""
+        from . import mixer
+        tracks = self._mix_tracks(sys_volume, mic_volume)
+        return mixer.stream_peak(tracks, self.sample_rate) if tracks else 0.0
+    
+    def mix_gain(self, sys_volume=1.0, mic_volume=1.0):
+        """Normalization gain of the mix (the first of the two streaming passes)."""
+        from . import mixer
+        return mixer.normalization_gain(self.mix_peak(sys_volume, mic_volume))
+    
+    def mix_frames(self):
+        """Length of the mix in frames at self.sample_rate, lead-ins included."""
+        from . import mixer
+        return max((mixer.track_length(t, self.sample_rate) for t in self._mix_tracks(1.0, 1.0)), default=0)
+    
+    def slice(self, start, stop=None):
+        """The segments start:stop of both tracks as a take sharing this temp dir."""
+        return AudioTake(self.temp_dir, self.system_segments[start:stop], self.mic_segments[start:stop], self.sample_rate)
     
-    def cleanup_all(self):
-        for item in self.processes[:]:
-            self.stop_process(item['process'])
+    @trace.traced()
+    def stream_audio_segments(self, write, sys_volume=1.0, mic_volume=1.0, progress=None, gain=None):
+        """Mix the segments as raw s16le stereo at self.sample_rate into write().
+
+        Used to pipe audio straight into the mux ffmpeg. progress, if given, is
+        called with the fraction written after each block; gain from mix_gain()
+        saves the peak pass. Returns frames written.
+        """
+        from . import mixer
+        tracks = self._mix_tracks(sys_volume, mic_volume)
+        if not tracks:
+            return 0
+        return mixer.stream_pcm(write, tracks, self.sample_rate, progress=progress, gain=gain)
+    
+    def cleanup(self):
+        if os.path.exists(self.temp_dir): shutil.rmtree(self.temp_dir, ignore_errors=True)
 
 class AudioRecorder:
-    def __init__(self):
-        self.is_recording = False
-        self.is_paused = False
+    def __init__(self, pyaudio_backend=None, sounddevice_backend=None):
+        # Recording/paused state; every change notifies _state so the capture
+        # threads block instead of polling
+        self._state = threading.Condition()
+        self._recording = False
+        self._paused = False
+        self.transition_time = time.perf_counter()
+        self.state_wakeups = 0
         self.system_audio_thread = None
         self.mic_audio_thread = None
-        self.system_audio_process = None
         self.temp_dir = tempfile.mkdtemp(prefix="screen_recorder_audio_")
         self.system_segments = []
         self.mic_segments = []
+        # (system, mic) enabled for the current recording
+        self.streams = (False, False)
         self.sample_rate = 48000
-        self.ffmpeg_manager = FFmpegProcessManager()
+        self.mic_ring = None
+        # Replay mode: streams go to PcmWindows of this many seconds instead of WAV segments
+        self.replay_seconds = None
+        self.replay_windows = {}
+        self.metrics = {'system': StreamMetrics('system'), 'mic': StreamMetrics('mic')}
+        # PyAudio host, loopback device and stream live as long as the recorder;
+        # the backends replace pyaudiowpatch / sounddevice (e.g. synthetic ones)
+        self._pyaudio_backend = pyaudio_backend
+        self._sounddevice_backend = sounddevice_backend
+        self._pa = None
+        self._loopback_device = None
+        self._loopback_stream = None
+        # Seconds from a transition to the first captured block / to the stream stopping
+        self.first_sample_latencies = {'system': [], 'mic': []}
+        self.stop_latencies = {'system': [], 'mic': []}
+    
+    @property
+    def is_recording(self): return self._recording
+    
+    @property
+    def is_paused(self): return self._paused
+    
+    def _set_state(self, recording, paused):
+        """Switch state and wake the capture threads. Returns the shared transition timestamp."""
+        with self._state:
+            self._recording, self._paused = recording, paused
+            self.transition_time = time.perf_counter()
+            self._state.notify_all()
+            return self.transition_time
+    
+    def _wait_state(self, predicate):
+        with self._state:
+            while not predicate():
+                self._state.wait()
+                self.state_wakeups += 1
+    
+    def _wait_until_active(self):
+        """Block until recording and not paused. Returns False once recording has stopped."""
+        self._wait_state(lambda: not self._recording or not self._paused)
+        return self._recording
+    
+    def _wait_until_halted(self):
+        """Block until paused or stopped."""
+        self._wait_state(lambda: self._paused or not self._recording)
         
-    def start_recording(self, system_audio_enabled, mic_audio_enabled):
-        """Start recording audio streams."""
-        self.is_recording = True
-        self.is_paused = False
+    @trace.traced()
+    def start_recording(self, system_audio_enabled, mic_audio_enabled, replay_seconds=None):
+        """Start recording audio streams; with replay_seconds only that much is kept, in memory."""
+        self.metrics = {'system': StreamMetrics('system'), 'mic': StreamMetrics('mic')}
+        self.streams = (system_audio_enabled, mic_audio_enabled)
+        self.replay_seconds = replay_seconds
+        self.replay_windows = {}
+        self._set_state(True, False)
         
         print(f"\n[AUDIO START] System: {system_audio_enabled}, Mic: {mic_audio_enabled}")
         
@@ -158,92 +435,188 @@ class AudioRecorder:
             self.mic_audio_thread = threading.Thread(target=self._record_mic_audio, daemon=True)
             self.mic_audio_thread.start()
             print("[DEBUG] Mic audio thread started")
+    
+    def _audio_host(self):
+        """Return (pyaudio module, PyAudio instance), creating the instance once."""
+        if self._pyaudio_backend is not None:
+            pyaudio, wasapi_available = self._pyaudio_backend, True
+        else:
+            pyaudio, wasapi_available = import_pyaudio()
+        if not wasapi_available:
+            return pyaudio, None
+        if self._pa is None:
+            self._pa = pyaudio.PyAudio()
+        return pyaudio, self._pa
+    
+    @trace.traced()
+    def get_loopback_device(self):
+        """The loopback device, looked up once and cached until invalidate_audio_device()."""
+        if self._loopback_device is None:
+            _, p = self._audio_host()
+            if p is not None:
+                self._loopback_device = get_wasapi_loopback_device(p)
+        return self._loopback_device
+    
+    def invalidate_audio_device(self):
+        """Drop the cached stream, device and PyAudio host, e.g. after a device change."""
+        self._close_loopback_stream()
+        self._loopback_device = None
+        if self._pa is not None:
+            try: self._pa.terminate()
+            except Exception: pass
+            self._pa = None
+    
+    @trace.traced()
+    def _open_loopback_stream(self, channels, chunk_size):
+        """Start the cached loopback stream, opening it only if there is none yet."""
+        stream = self._loopback_stream
+        if stream is not None:
+            if not stream.is_active():
+                stream.start_stream()
+            return stream
+        pyaudio, p = self._audio_host()
+        device_info = self.get_loopback_device()
+        print(f"[SYSTEM AUDIO] Using device: {device_info['name']}")
+        print(f"[SYSTEM AUDIO] Sample rate: {device_info['defaultSampleRate']}")
+        self._loopback_stream = p.open(
+            format=pyaudio.paInt16,
+            channels=channels,
+            rate=int(device_info['defaultSampleRate']),
+            input=True,
+            input_device_index=device_info['index'],
+            frames_per_buffer=chunk_size
+        )
+        print("[SYSTEM AUDIO] Stream opened")
+        return self._loopback_stream
+    
+    def _close_loopback_stream(self):
+        stream, self._loopback_stream = self._loopback_stream, None
+        if stream is not None:
+            try:
+                if stream.is_active(): stream.stop_stream()
+                stream.close()
+            except Exception: pass
             
     def _record_system_audio(self):
         """Capture system audio using WASAPI loopback."""
         print("[SYSTEM AUDIO] Thread started")
         
         try:
-            if not WASAPI_AVAILABLE or pyaudio is None:
+            pyaudio, p = self._audio_host()
+            if p is None:
                 print("[ERROR] pyaudiowpatch not available - cannot capture system audio")
                 print("[INSTALL] Run: pip install pyaudiowpatch")
                 return
             
-            device_info = get_wasapi_loopback_device()
-            
-            if not device_info:
+            if not self.get_loopback_device():
                 print("[ERROR] No WASAPI loopback device found")
                 return
             
-            p = pyaudio.PyAudio()
-            print(f"[SYSTEM AUDIO] Using device: {device_info['name']}")
-            print(f"[SYSTEM AUDIO] Sample rate: {device_info['defaultSampleRate']}")
-            
             channels = 2
             chunk_size = 1024
+            # Consecutive stream errors; only the first of a streak is logged
+            failures = 0
             
-            while self.is_recording:
-                if not self.is_paused:
-                    segment_idx = len(self.system_segments)
-                    output_file = os.path.join(self.temp_dir, f"system_audio_{segment_idx:04d}.wav")
+            while self._wait_until_active():
+                segment_idx = len(self.system_segments)
+                output_file = os.path.join(self.temp_dir, f"system_audio_{segment_idx:04d}.wav")
+                
+                print(f"[SYSTEM AUDIO] Starting segment {segment_idx}")
+                
+                try:
+                    # Reuses the stream left open by the previous segment
+                    stream = self._open_loopback_stream(channels, chunk_size)
+                    device_info = self._loopback_device
                     
-                    print(f"[SYSTEM AUDIO] Starting segment {segment_idx}")
+                    print("[SYSTEM AUDIO] Recording...")
                     
-                    audio_data = []
+                    # Captured chunks go straight to disk via the segment writer
+                    writer = (self._replay_window if self.replay_seconds else WavSegmentWriter)(
+                        output_file,
+                        channels,
+                        self._pa.get_sample_size(pyaudio.paInt16),
+                        int(device_info['defaultSampleRate'])
+                    )
+                    chunks = 0
+                    metrics = self.metrics['system']
+                    rate = int(device_info['defaultSampleRate'])
+                    frame_size = channels * self._pa.get_sample_size(pyaudio.paInt16)
+                    # read() with exception_on_overflow=False reports nothing, so overruns
+                    # are inferred: a stall between reads longer than the host buffer
+                    # overflowed it, a read blocking for over two chunks was under-fed
+                    host_buffer_s = stream.get_input_latency() or 4 * chunk_size / rate
+                    metrics.active(rate)
+                    read_done = None
                     
                     try:
-                        # Open WASAPI loopback stream
-                        stream = p.open(
-                            format=pyaudio.paInt16,
-                            channels=channels,
-                            rate=int(device_info['defaultSampleRate']),
-                            input=True,
-                            input_device_index=device_info['index'],
-                            frames_per_buffer=chunk_size
-                        )
-                        
-                        print(f"[SYSTEM AUDIO] Stream opened, recording...")
-                        
                         # Capture audio while not paused
                         while not self.is_paused and self.is_recording:
+                            read_start = time.perf_counter()
                             try:
                                 data = stream.read(chunk_size, exception_on_overflow=False)
-                                audio_data.append(data)
                             except Exception as e:
+                                # Most likely the device went away: rediscover on the next segment
                                 print(f"[SYSTEM AUDIO] Read error: {e}")
+                                metrics.errors += 1
+                                self.invalidate_audio_device()
                                 break
+                            now = time.perf_counter()
+                            if read_done is not None and read_start - read_done > host_buffer_s:
+                                metrics.overflows += 1
+                            if now - read_start > 2 * chunk_size / rate:
+                                metrics.underflows += 1
+                            if not chunks:
+                                self.first_sample_latencies['system'].append(now - self.transition_time)
+                                trace.instant("first audio", stream="system")
+                            writer.write(data)
+                            metrics.chunk(len(data) // frame_size, now - read_start, writer.pending)
+                            read_done = now
+                            chunks += 1
+                    finally:
+                        metrics.idle()
+                        # Paused: keep the stream open for resume
+                        if self._loopback_stream is not None and self._loopback_stream.is_active():
+                            self._loopback_stream.stop_stream()
+                        if self.is_paused or not self.is_recording:
+                            self.stop_latencies['system'].append(time.perf_counter() - self.transition_time)
+                        writer.close()
+                    
+                    print(f"[SYSTEM AUDIO] Stopped segment {segment_idx}, chunks: {chunks}")
+                    if chunks and failures:
+                        print(f"[SYSTEM AUDIO] Stream recovered after {failures} failed attempt(s)")
+                        failures = 0
+                    if self.replay_seconds:
+                        continue
+                    
+                    file_size = os.path.getsize(output_file)
+                    if chunks:
+                        print(f"[SYSTEM AUDIO] Saved {output_file}: {file_size} bytes")
+                    else:
+                        print("[SYSTEM AUDIO] No data captured")
+                    
+                    if file_size > 1000:
+                        self.system_segments.append(output_file)
+                    else:
+                        if chunks:
+                            print("[SYSTEM AUDIO] Segment too small, skipping")
+                        os.remove(output_file)
                         
-                        stream.stop_stream()
-                        stream.close()
-                        
-                        print(f"[SYSTEM AUDIO] Stopped segment {segment_idx}, chunks: {len(audio_data)}")
-                        
-                        # Save captured audio to WAV file
-                        if audio_data:
-                            with wave.open(output_file, 'wb') as wf:
-                                wf.setnchannels(channels)
-                                wf.setsampwidth(p.get_sample_size(pyaudio.paInt16))
-                                wf.setframerate(int(device_info['defaultSampleRate']))
-                                wf.writeframes(b''.join(audio_data))
-                            
-                            file_size = os.path.getsize(output_file)
-                            print(f"[SYSTEM AUDIO] Saved {output_file}: {file_size} bytes")
-                            
-                            if file_size > 1000:
-                                self.system_segments.append(output_file)
-                            else:
-                                print(f"[SYSTEM AUDIO] Segment too small, skipping")
-                        else:
-                            print(f"[SYSTEM AUDIO] No data captured")
-                            
-                    except Exception as e:
-                        print(f"[SYSTEM AUDIO] Stream error: {e}")
-                        import traceback
-                        traceback.print_exc()
-                
-                time.sleep(0.05)
+                except Exception as e:
+                    if not failures:
+                        print(f"[SYSTEM AUDIO] Stream error: {e} (retrying until it recovers)")
+                    failures += 1
+                    self.metrics['system'].errors += 1
+                    self.invalidate_audio_device()
+                    if not self.get_loopback_device():
+                        print("[ERROR] No WASAPI loopback device found")
+                        return
+                    # Back off so a device that keeps failing is not reopened in a tight
+                    # loop; pausing or stopping cuts the wait short
+                    backoff = min(STREAM_RETRY_S * 2 ** (failures - 1), STREAM_RETRY_MAX_S)
+                    with self._state:
+                        self._state.wait_for(lambda: self._paused or not self._recording, backoff)
             
-            p.terminate()
+            self._close_loopback_stream()
             print("[SYSTEM AUDIO] Thread ended")
             
         except Exception as e:
@@ -256,77 +629,221 @@ class AudioRecorder:
         print("[MIC AUDIO] Thread started")
         
         try:
-            while self.is_recording:
+            if self._sounddevice_backend is not None:
+                sd = self._sounddevice_backend
+            else:
+                import sounddevice as sd
+            channels = 2
+            if self.mic_ring is None:
+                self.mic_ring = RingBuffer(self.sample_rate * MIC_RING_SECONDS, channels)
+            ring = self.mic_ring
+            
+            first_block = [False]
+            
+            def callback(indata, frames, time_info, status):
+                # Runs on the PortAudio thread: no printing or allocation here
+                started = time.perf_counter()
+                metrics = self.metrics['mic']
+                if status:
+                    if status.input_overflow: metrics.overflows += 1
+                    if status.input_underflow: metrics.underflows += 1
                 if not self.is_paused:
+                    if first_block[0]:
+                        first_block[0] = False
+                        self.first_sample_latencies['mic'].append(started - self.transition_time)
+                        # Once per segment, and a no-op unless tracing
+                        trace.instant("first audio", stream="mic")
+                    ring.write(indata)
+                    metrics.chunk(frames, time.perf_counter() - started, len(ring))
+            
+            # One input stream for the whole recording: paused with stop(), resumed with start()
+            stream = None
+            try:
+                while self._wait_until_active():
                     segment_idx = len(self.mic_segments)
                     output_file = os.path.join(self.temp_dir, f"mic_audio_{segment_idx:04d}.wav")
                     
                     print(f"[MIC AUDIO] Starting segment {segment_idx}")
                     
-                    audio_data = []
-                    
-                    def callback(indata, frames, time_info, status):
-                        if status:
-                            print(f"[MIC AUDIO] Status: {status}")
-                        if not self.is_paused:
-                            audio_data.append(indata.copy())
+                    ring.reset()
+                    stream_done = threading.Event()
+                    result = {'frames': 0}
+                    writer = threading.Thread(
+                        target=self._write_mic_segment,
+                        args=(ring, output_file, stream_done, result),
+                        daemon=True
+                    )
+                    writer.start()
                     
                     try:
-                        with sd.InputStream(channels=2, samplerate=self.sample_rate, callback=callback):
-                            print(f"[MIC AUDIO] Recording...")
-                            while not self.is_paused and self.is_recording:
-                                time.sleep(0.05)
-                        
-                        print(f"[MIC AUDIO] Stopped segment {segment_idx}, chunks: {len(audio_data)}")
-                        
-                        if audio_data:
-                            self._save_mic_audio_data(audio_data, output_file)
-                            file_size = os.path.getsize(output_file)
-                            print(f"[MIC AUDIO] Saved {output_file}: {file_size} bytes")
-                            self.mic_segments.append(output_file)
-                        else:
-                            print(f"[MIC AUDIO] No data captured")
-                            
+                        with trace.span("open mic stream", reused=stream is not None):
+                            if stream is None:
+                                stream = sd.InputStream(channels=channels, samplerate=self.sample_rate, callback=callback)
+                            first_block[0] = True
+                            self.metrics['mic'].active(self.sample_rate)
+                            stream.start()
+                        print("[MIC AUDIO] Recording...")
+                        self._wait_until_halted()
+                        stream.stop()
+                        self.metrics['mic'].idle()
+                        self.stop_latencies['mic'].append(time.perf_counter() - self.transition_time)
                     except Exception as e:
                         print(f"[MIC AUDIO] Stream error: {e}")
-                        
-                time.sleep(0.05)
+                        self.metrics['mic'].errors += 1
+                        self.metrics['mic'].idle()
+                        if stream is not None:
+                            try: stream.close()
+                            except Exception: pass
+                            stream = None
+                        time.sleep(0.5)
+                    finally:
+                        stream_done.set()
+                        writer.join()
+                    
+                    print(f"[MIC AUDIO] Stopped segment {segment_idx}, frames: {result['frames']}, buffer: {self.mic_buffer_stats()}")
+                    if self.replay_seconds:
+                        continue
+                    
+                    if result['frames']:
+                        file_size = os.path.getsize(output_file)
+                        print(f"[MIC AUDIO] Saved {output_file}: {file_size} bytes")
+                        self.mic_segments.append(output_file)
+                    else:
+                        print("[MIC AUDIO] No data captured")
+                        if os.path.exists(output_file):
+                            os.remove(output_file)
+            finally:
+                if stream is not None:
+                    stream.close()
                 
             print("[MIC AUDIO] Thread ended")
             
         except Exception as e:
             print(f"[MIC AUDIO] Fatal error: {e}")
             
-    def _save_mic_audio_data(self, audio_data, filename):
-        if audio_data:
-            audio_array = np.concatenate(audio_data, axis=0)
-            with wave.open(filename, 'wb') as wav_file:
-                wav_file.setnchannels(2)
+    def _write_mic_segment(self, ring, filename, stream_done, result):
+        """Drain the mic ring into an int16 WAV until the stream is closed and the ring is empty."""
+        import numpy as np
+        block = np.empty((MIC_WRITE_BLOCK_FRAMES, ring.channels), dtype=np.float32)
+        pcm = np.empty((MIC_WRITE_BLOCK_FRAMES, ring.channels), dtype=np.int16)
+        try:
+            if self.replay_seconds:
+                wav_file = contextlib.nullcontext(self._replay_window(filename, ring.channels, 2, self.sample_rate))
+            else:
+                wav_file = wave.open(filename, 'wb')
+                wav_file.setnchannels(ring.channels)
                 wav_file.setsampwidth(2)
                 wav_file.setframerate(self.sample_rate)
-                wav_file.writeframes((audio_array * 32767).astype(np.int16).tobytes())
+            with wav_file as wav_file:
+                while True:
+                    finished = stream_done.is_set()
+                    n = ring.read_into(block)
+                    if n:
+                        samples = block[:n]
+                        np.multiply(samples, 32767, out=samples)
+                        np.clip(samples, -32768, 32767, out=samples)
+                        pcm[:n] = samples
+                        wav_file.writeframesraw(pcm[:n])
+                        result['frames'] += n
+                    elif finished:
+                        break
+                    else:
+                        ring.wait(0.1)
+        except Exception as e:
+            print(f"[MIC AUDIO] Write error: {e}")
+    
+    def mic_buffer_stats(self):
+        """Ring buffer and PortAudio overflow counters for the mic stream."""
+        stats = self.mic_ring.stats() if self.mic_ring is not None else {}
+        stats['input_overflows'] = self.metrics['mic'].overflows
+        return stats
+    
+    def metrics_snapshot(self):
+        """Live telemetry of both streams; safe to poll from the UI thread."""
+        snapshot = {name: m.snapshot() for name, m in self.metrics.items()}
+        if self.mic_ring is not None:
+            snapshot['mic']['ring'] = self.mic_ring.stats()
+        return snapshot
+    
+    @trace.traced()
+    def pause(self):
+        """Pause every stream. Returns the transition timestamp (time.perf_counter())."""
+        return self._set_state(self._recording, True)
     
-    def pause(self): self.is_paused = True
-    def resume(self): self.is_paused = False
+    @trace.traced()
+    def resume(self):
+        """Resume every stream. Returns the transition timestamp (time.perf_counter())."""
+        return self._set_state(self._recording, False)
     
+    @trace.traced()
     def stop(self):
-        self.is_recording = False
-        self.is_paused = True
-        if self.system_audio_process:
-            self.ffmpeg_manager.stop_process(self.system_audio_process)
-        if self.system_audio_thread: self.system_audio_thread.join(timeout=1)
-        if self.mic_audio_thread: self.mic_audio_thread.join(timeout=1)
-    
-    def combine_audio_segments(self, output_path, sys_volume=1.0, mic_volume=1.0):
-        """Combine system and mic audio segments by padding shorter tracks with silence."""
+        self._set_state(False, True)
+        # Wait for the last segment to be written so detach_take() sees it
+        if self.system_audio_thread: self.system_audio_thread.join(timeout=5)
+        if self.mic_audio_thread: self.mic_audio_thread.join(timeout=5)
+    
+    def closed_periods(self):
+        """How many pause-to-pause periods have their segments closed on every enabled stream.
+
+        A segment is only appended to its list once its file is complete, so
+        period i is done when each enabled stream has an i-th segment.
+        """
+        lists = [l for l, on in zip((self.system_segments, self.mic_segments), self.streams) if on]
+        return min(len(l) for l in lists) if lists else 0
+    
+    def _replay_window(self, filename, channels, sample_width, frame_rate):
+        """The stream's PcmWindow, kept across pauses while its format stays the same."""
+        name = os.path.basename(filename).split("_")[0]
+        window = self.replay_windows.get(name)
+        if window is None or window.format != (channels, sample_width, frame_rate):
+            window = self.replay_windows[name] = PcmWindow(self.replay_seconds, channels, sample_width, frame_rate)
+        return window
+    
+    @trace.traced()
+    def replay_take(self, start, end, temp_dir):
+        """The replay windows' audio between time.perf_counter() times start and end, as an AudioTake in temp_dir."""
+        tracks = {}
+        for name, window in list(self.replay_windows.items()):
+            tracks[name] = [window.save(os.path.join(temp_dir, f"{name}_audio_replay.wav"), start, end)]
+        return AudioTake(temp_dir, tracks.get('system', []), tracks.get('mic', []), self.sample_rate)
+    
+    def current_take(self):
+        """The segments recorded so far, as an AudioTake sharing this recorder's temp dir."""
+        return AudioTake(self.temp_dir, self.system_segments, self.mic_segments, self.sample_rate)
+    
+    @trace.traced()
+    def detach_take(self):
+        """Hand the finished segments over to an AudioTake and start a fresh temp dir.
+
+        The take owns its files from then on, so a new recording can start
+        while the previous one is still being finalized.
+        """
+        take = AudioTake(self.temp_dir, list(self.system_segments), list(self.mic_segments), self.sample_rate, self.metrics_snapshot())
+        self.system_segments = []; self.mic_segments = []
+        self.temp_dir = tempfile.mkdtemp(prefix="screen_recorder_audio_")
+        return take
+    
+    def has_audio(self):
+        return self.current_take().has_audio()
+    
+    def combine_audio_segments(self, output_path, sys_volume=1.0, mic_volume=1.0, streaming=None):
+        return self.current_take().combine_audio_segments(output_path, sys_volume, mic_volume, streaming)
+    
+    def mix_gain(self, sys_volume=1.0, mic_volume=1.0):
+        return self.current_take().mix_gain(sys_volume, mic_volume)
+    
+    def stream_audio_segments(self, write, sys_volume=1.0, mic_volume=1.0, progress=None, gain=None):
+        return self.current_take().stream_audio_segments(write, sys_volume, mic_volume, progress, gain)
+    
+    @trace.traced()
+    def _combine_audio_segments_pydub(self, output_path, sys_volume=1.0, mic_volume=1.0):
+        """Original pydub implementation, kept as the reference for recorder.bench."""
+        import numpy as np
+        from pydub import AudioSegment
         try:
             system_combined = None
             mic_combined = None
             
-            # Reduce system audio volume by 30% when both are present (to match mic level)
-            # This compensates for Windows amplifying system audio relative to mic
-            system_volume_reduction = 0.7  # 70% of original volume
-            
             if self.system_segments:
                 for segment in self.system_segments:
                     if os.path.exists(segment) and os.path.getsize(segment) > 0:
@@ -334,7 +851,7 @@ class AudioRecorder:
                         audio = AudioSegment.silent(duration=SYSTEM_AUDIO_DELAY_MS) + audio
                         
                         # Apply both user's volume slider AND the system reduction
-                        combined_sys_vol = sys_volume * system_volume_reduction
+                        combined_sys_vol = sys_volume * SYSTEM_VOLUME_REDUCTION
                         if combined_sys_vol != 1.0:
                             gain = 20 * np.log10(max(combined_sys_vol, 0.01))
                             audio = audio.apply_gain(gain)
@@ -396,8 +913,7 @@ class AudioRecorder:
         return None
     
     def cleanup(self):
-        import shutil
-        self.ffmpeg_manager.cleanup_all()
+        self.invalidate_audio_device()
         if os.path.exists(self.temp_dir): shutil.rmtree(self.temp_dir, ignore_errors=True)
         self.system_segments = []; self.mic_segments = []
         self.temp_dir = tempfile.mkdtemp(prefix="screen_recorder_audio_")
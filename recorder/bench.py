@@ -0,0 +1,1241 @@
+"""
+Screen Recorder - Benchmarks
+
+Usage:
+    python -m recorder.bench mix [--segments N] [--seconds S]
+    python -m recorder.bench finalize-stream [--gb G] [--segments N] [--memory-cap-mb M]
+    python -m recorder.bench mux [--segments N] [--seconds S]
+    python -m recorder.bench concat [--segments N] [--seconds S]
+    python -m recorder.bench finalize-plans [--segments N] [--seconds S] [--size WxH]
+    python -m recorder.bench incremental [--periods N ...] [--seconds S]
+    python -m recorder.bench resume [--cycles N] [--fps F] [--size WxH] [--max-resume-ms M] [--max-gap-s S]
+    python -m recorder.bench startup [--module M] [--top N] [--runs R]
+    python -m recorder.bench audio-start [--cycles N] [--host-latency S] [--open-latency S] [--max-latency-ms M]
+    python -m recorder.bench governor [--seconds S] [--fps F] [--size WxH]
+    python -m recorder.bench pipeline [--suite quick|full] [--scenario NAME ...] [--fps F] [--size WxH] [--output FILE] [--rolling S]
+    python -m recorder.bench recover [--seconds S] [--fps F] [--size WxH] [--rolling S]
+    python -m recorder.bench replay [--seconds S] [--window S] [--part S] [--saves N] [--fps F] [--size WxH]
+    python -m recorder.bench supervisor [--seconds S] [--kills N] [--size WxH] [--children N]
+    python -m recorder.bench trace [--seconds S] [--size WxH] [--calls N]
+    python -m recorder.bench hotkeys [--seconds S] [--pressers N] [--size WxH] [--seed N] [--direct]
+"""
+
+import argparse
+import heapq
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+import psutil
+
+from . import finalize, metrics, recover
+from .audio import AudioRecorder
+from .incremental import IncrementalEncoder
+from .replay import ReplayBuffer
+from .synthetic import SyntheticPyAudio, SyntheticSoundDevice
+from .video import ROLLING_SEGMENT_S, VideoCapture
+from .video import testsrc_input_args as lavfi_input_args
+
+# Video a killed capture may lose: its open fragment (a second), and a progress report's worth
+CRASH_LOSS_S = 1.5
+# Audio and video of a finished file may differ by this much (a couple of AAC frames)
+AV_SLACK_S = 0.1
+
+def write_synthetic_wav(path, seconds, sample_rate=48000, freq=440.0, channels=2):
+    """Write a sine tone with a little noise by repeating a one-second block."""
+    total = int(seconds * sample_rate)
+    rng = np.random.default_rng(int(freq))
+    t = np.arange(sample_rate) / sample_rate
+    tone = 8000 * np.sin(2 * np.pi * freq * t) + rng.normal(0, 300, sample_rate)
+    block = np.repeat(tone[:, None], channels, axis=1).astype(np.int16)
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        for start in range(0, total, sample_rate):
+            wf.writeframesraw(block[:min(sample_rate, total - start)])
+    return path
+
+def make_segments(recorder, segments, seconds, system=True, mic=True):
+    """Populate recorder's segment lists with synthetic WAVs in its temp dir."""
+    for i in range(segments):
+        if system:
+            recorder.system_segments.append(write_synthetic_wav(
+                os.path.join(recorder.temp_dir, f"system_audio_{i:04d}.wav"), seconds, freq=440.0))
+        if mic:
+            recorder.mic_segments.append(write_synthetic_wav(
+                os.path.join(recorder.temp_dir, f"mic_audio_{i:04d}.wav"), seconds, freq=220.0))
+
+def make_synthetic_video(path, seconds, size="640x360", fps=30):
+    """Encode a lavfi testsrc clip quickly, standing in for a captured segment."""
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", f"testsrc=size={size}:rate={fps}",
+         "-t", str(seconds), "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", path],
+        check=True, creationflags=finalize.NO_WINDOW
+    )
+    return path
+
+def count_video_frames(path):
+    """Number of video packets in path: one framecrc line each, without decoding."""
+    proc = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"],
+        capture_output=True, text=True, creationflags=finalize.NO_WINDOW
+    )
+    return sum(1 for line in proc.stdout.splitlines() if line and not line.startswith("#"))
+
+def video_timestamps(path):
+    """Presentation times (s) of path's video packets, in file order."""
+    proc = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"],
+        capture_output=True, text=True, creationflags=finalize.NO_WINDOW
+    )
+    tb, times = 1.0, []
+    for line in proc.stdout.splitlines():
+        if line.startswith("#tb 0:"):
+            num, den = line.split(":")[1].strip().split("/")
+            tb = int(num) / int(den)
+        elif line and not line.startswith("#"):
+            times.append(int(line.split(",")[2]) * tb)
+    return times
+
+def count_audio_seconds(path, sample_rate=48000):
+    """Length of path's audio from its AAC packet count (1024 samples each)."""
+    proc = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path, "-map", "0:a:0", "-c", "copy", "-f", "framecrc", "-"],
+        capture_output=True, text=True, creationflags=finalize.NO_WINDOW
+    )
+    return sum(1 for line in proc.stdout.splitlines() if line and not line.startswith("#")) * 1024 / sample_rate
+
+def count_decoded_audio_frames(path):
+    """Audio frames path decodes to, edit lists applied."""
+    proc = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path, "-map", "0:a:0", "-c:a", "pcm_s16le", "-f", "framecrc", "-"],
+        capture_output=True, text=True, creationflags=finalize.NO_WINDOW
+    )
+    channels = 2
+    return sum(int(line.split(",")[4]) for line in proc.stdout.splitlines() if line and not line.startswith("#")) // (2 * channels)
+
+def dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+class PeakRSS:
+    """Samples this process's RSS on a background thread and keeps the maximum.
+
+    With children=True the RSS of child processes (the ffmpeg instances) is
+    added in, giving the footprint of the whole pipeline.
+    """
+
+    def __init__(self, interval=0.02, children=False):
+        self.interval = interval
+        self.children = children
+        self.peak = 0
+        self._proc = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _rss(self):
+        rss = self._proc.memory_info().rss
+        if self.children:
+            for child in self._proc.children(recursive=True):
+                try: rss += child.memory_info().rss
+                except psutil.Error: pass
+        return rss
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+def _measure(fn, *args, **kwargs):
+    tracemalloc.start()
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak, rss.peak
+
+def bench_mix(segments, seconds):
+    """Compare the NumPy mixer against the original pydub implementation."""
+    recorder = AudioRecorder()
+    try:
+        make_segments(recorder, segments, seconds)
+        results = {'segments': segments, 'seconds_per_segment': seconds}
+        for name, fn in (("pydub", recorder._combine_audio_segments_pydub),
+                         ("numpy", recorder.combine_audio_segments)):
+            out = os.path.join(recorder.temp_dir, f"combined_{name}.wav")
+            path, elapsed, peak, rss = _measure(fn, out, 0.8, 1.0)
+            results[name] = {
+                'ok': path is not None,
+                'wall_s': round(elapsed, 3),
+                'peak_alloc_mb': round(peak / 2**20, 1),
+                'peak_rss_mb': round(rss / 2**20, 1),
+            }
+        if results['numpy']['wall_s']:
+            results['speedup'] = round(results['pydub']['wall_s'] / results['numpy']['wall_s'], 2)
+        return results
+    finally:
+        shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+
+def bench_finalize_stream(gigabytes, segments, memory_cap_mb=None):
+    """Mix several GB of synthetic segments out-of-core and check peak RSS stays bounded."""
+    recorder = AudioRecorder()
+    try:
+        # Split the data evenly over system and mic segments at 48 kHz stereo int16
+        seconds = gigabytes * 2**30 / (2 * segments * 48000 * 4)
+        make_segments(recorder, segments, seconds)
+        input_bytes = sum(os.path.getsize(p) for p in recorder.system_segments + recorder.mic_segments)
+        baseline = psutil.Process().memory_info().rss
+        out = os.path.join(recorder.temp_dir, "combined_stream.wav")
+        path, elapsed, peak, rss = _measure(recorder.combine_audio_segments, out, 0.8, 1.0, streaming=True)
+        results = {
+            'input_gb': round(input_bytes / 2**30, 2),
+            'segments': segments,
+            'ok': path is not None,
+            'wall_s': round(elapsed, 3),
+            'peak_alloc_mb': round(peak / 2**20, 1),
+            'peak_rss_mb': round(rss / 2**20, 1),
+            'rss_growth_mb': round((rss - baseline) / 2**20, 1),
+        }
+        if memory_cap_mb is not None:
+            results['memory_cap_mb'] = memory_cap_mb
+            results['within_cap'] = results['ok'] and results['rss_growth_mb'] <= memory_cap_mb
+        return results
+    finally:
+        shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+
+def bench_mux(segments, seconds):
+    """Stop-to-file time of the final mux: combined_a.wav round trip vs. piped PCM."""
+    recorder = AudioRecorder()
+    try:
+        make_segments(recorder, segments, seconds)
+        video = make_synthetic_video(os.path.join(recorder.temp_dir, "combined_v.mp4"), segments * seconds)
+        results = {'segments': segments, 'seconds_per_segment': seconds}
+        for name, pipe_audio in (("wav", False), ("pipe", True)):
+            work = os.path.join(recorder.temp_dir, name)
+            os.makedirs(work)
+            output = os.path.join(work, "recording.mp4")
+            _, elapsed, _, rss = _measure(finalize.mux, ["-i", video], output, recorder, 0.8, 1.0, work, pipe_audio=pipe_audio)
+            results[name] = {
+                'ok': os.path.exists(output),
+                'wall_s': round(elapsed, 3),
+                'temp_mb': round((dir_bytes(work) - os.path.getsize(output)) / 2**20, 1),
+                'peak_rss_mb': round(rss / 2**20, 1),
+            }
+        if results['pipe']['wall_s']:
+            results['speedup'] = round(results['wav']['wall_s'] / results['pipe']['wall_s'], 2)
+        return results
+    finally:
+        shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+
+def _two_pass_finalize(segments, output, recorder, work):
+    temp_v = finalize.concat_video(segments, os.path.join(work, "video_list.txt"), os.path.join(work, "combined_v.mp4"))
+    return finalize.mux(["-i", temp_v], output, recorder, 0.8, 1.0, work)
+
+def bench_concat(segments, seconds):
+    """Old concat-then-mux finalize vs. the single-pass finalize_recording."""
+    recorder = AudioRecorder()
+    try:
+        make_segments(recorder, segments, seconds)
+        videos = [make_synthetic_video(os.path.join(recorder.temp_dir, f"video_segment_{i:04d}.mp4"), seconds)
+                  for i in range(segments)]
+        results = {'segments': segments, 'seconds_per_segment': seconds}
+        for name in ("two_pass", "single_pass"):
+            work = os.path.join(recorder.temp_dir, name)
+            os.makedirs(work)
+            output = os.path.join(work, "recording.mp4")
+            if name == "two_pass":
+                _, elapsed, _, _ = _measure(_two_pass_finalize, videos, output, recorder, work)
+            else:
+                _, elapsed, _, _ = _measure(finalize.finalize_recording, videos, output, recorder, 0.8, 1.0, work)
+            results[name] = {
+                'ok': os.path.exists(output),
+                'wall_s': round(elapsed, 3),
+                'temp_mb': round((dir_bytes(work) - os.path.getsize(output)) / 2**20, 1),
+            }
+        if results['single_pass']['wall_s']:
+            results['speedup'] = round(results['two_pass']['wall_s'] / results['single_pass']['wall_s'], 2)
+        return results
+    finally:
+        shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+
+def bench_finalize_plans(segments, seconds, size):
+    """finalize_recording's single-pass plan vs. the parallel video concat + audio encode plan.
+
+    Reports each plan's stage spans and critical path, plus the serial sum of
+    the stage durations to show how much of it the graph overlapped.
+    """
+    recorder = AudioRecorder()
+    try:
+        make_segments(recorder, segments, seconds)
+        videos = [make_synthetic_video(os.path.join(recorder.temp_dir, f"video_segment_{i:04d}.mp4"), seconds, size)
+                  for i in range(segments)]
+        results = {'segments': segments, 'seconds_per_segment': seconds, 'size': size}
+        for name, parallel_video in (("single_pass", False), ("parallel_video", True)):
+            work = os.path.join(recorder.temp_dir, name)
+            os.makedirs(work)
+            output = os.path.join(work, "recording.mp4")
+            timings, elapsed, _, rss = _measure(finalize.finalize_recording, videos, output, recorder, 0.8, 1.0, work,
+                                                parallel_video=parallel_video)
+            results[name] = dict(
+                timings, ok=os.path.exists(output), wall_s=round(elapsed, 3), peak_rss_mb=round(rss / 2**20, 1),
+                serial_s=round(sum(t['duration_s'] for t in timings['stages'].values()), 3),
+            )
+        results['fastest'] = min(("single_pass", "parallel_video"), key=lambda n: results[n]['wall_s'])
+        return results
+    finally:
+        shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+
+def bench_incremental(period_counts, seconds):
+    """Stop-to-file time vs. session length: whole-take finalize vs. IncrementalEncoder.
+
+    Each session is a number of pause-to-pause periods of synthetic audio over
+    one persistent video segment. The incremental run hands the encoder every
+    period but the last while "recording" and is timed from the last one closing.
+    The incremental file's audio must decode to the whole-take length within
+    one AAC frame.
+    """
+    results = {'seconds_per_period': seconds, 'sessions': []}
+    for periods in period_counts:
+        recorder = AudioRecorder()
+        try:
+            recorder.streams = (True, True)
+            make_segments(recorder, periods, seconds)
+            system, mic = list(recorder.system_segments), list(recorder.mic_segments)
+            # Longer than the audio with its lead-ins, so -shortest does not cut the audio being compared
+            video = make_synthetic_video(os.path.join(recorder.temp_dir, "video_segment_0000.mp4"), periods * (seconds + 0.5) + 1)
+            row = {'periods': periods}
+            for name in ("whole_take", "incremental"):
+                work = os.path.join(recorder.temp_dir, name)
+                os.makedirs(work)
+                output = os.path.join(work, "recording.mp4")
+                encoder = None
+                if name == "incremental":
+                    recorder.system_segments, recorder.mic_segments = system[:-1], mic[:-1]
+                    started = time.perf_counter()
+                    encoder = IncrementalEncoder(recorder, work, 1.0, 1.0)
+                    while len(encoder.chunks) < periods - 1 and not encoder.failed:
+                        time.sleep(0.05)
+                    row['background_s'] = round(time.perf_counter() - started, 3)
+                    recorder.system_segments, recorder.mic_segments = system, mic
+                    encoder.stop()
+                timings = finalize.finalize_recording([video], output, recorder.current_take(), 1.0, 1.0, work, incremental=encoder)
+                row[name] = {'ok': os.path.exists(output), 'stop_to_file_s': timings['total_s'], 'critical_path': timings['critical_path'],
+                             'audio_frames': count_decoded_audio_frames(output)}
+                if encoder:
+                    row[name].update(chunks=len(encoder.chunks), reencoded=encoder.reencoded)
+            # Chunk joins must not add priming or padding: same length as one encode, within a frame
+            row['audio_delta_frames'] = row['incremental']['audio_frames'] - row['whole_take']['audio_frames']
+            results['sessions'].append(row)
+        finally:
+            shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+    results['passed'] = all(r['whole_take']['ok'] and r['incremental']['ok'] and abs(r['audio_delta_frames']) <= finalize.AAC_FRAME
+                            for r in results['sessions'])
+    return results
+
+def bench_resume(cycles, fps, size, max_resume_ms, max_gap_s, hold=1.0):
+    """Resume latency of a new segment per resume vs. the persistent suspended capture.
+
+    Passes if the persistent capture resumes within max_resume_ms and its
+    finalized video runs on without a jump of more than max_gap_s: every
+    pause closed at the right offset, its length that of the recorded spans
+    (first frame to stop, less the pauses).
+    The gap offsets come from ffmpeg's progress, so the encoder has to keep
+    up with fps at size.
+    """
+    results = {'cycles': cycles, 'fps': fps, 'size': size, 'max_resume_ms': max_resume_ms, 'max_gap_s': max_gap_s}
+    recorder = AudioRecorder()
+    try:
+        for name, persistent in (("segments", False), ("persistent", True)):
+            work = os.path.join(recorder.temp_dir, name)
+            os.makedirs(work)
+            capture = VideoCapture(persistent=persistent)
+            capture.reset()
+            segments, readers = [], []
+
+            def start():
+                path = os.path.join(work, f"video_segment_{len(segments):04d}.mp4")
+                segments.append(capture.start(lavfi_input_args(str(fps), size), path, str(fps), "2000k"))
+                readers.append(capture.reader)
+
+            started = time.perf_counter()
+            start()
+            latencies, paused = [], 0.0
+            for _ in range(cycles):
+                time.sleep(hold)
+                pausing = time.perf_counter()
+                if not capture.pause():
+                    capture.stop()
+                time.sleep(hold / 2)
+                began = time.perf_counter()
+                if not capture.resume():
+                    # Same path as RecordingSession.resume()
+                    start()
+                latencies.append(time.perf_counter() - began)
+                paused += time.perf_counter() - pausing
+            time.sleep(hold)
+            capture.stop()
+            # Frames are captured from the first one until ffmpeg has quit on stop()
+            recorded = time.perf_counter() - (readers[0].first_frame_at or started) - paused
+            output = os.path.join(work, "recording.mp4")
+            timings = finalize.finalize_recording(segments, output, recorder, 1.0, 1.0, work, video_gaps=capture.gaps)
+            times = sorted(video_timestamps(output))
+            results[name] = {
+                'ok': os.path.exists(output),
+                'segments': len(segments),
+                'resume_ms_mean': round(1000 * sum(latencies) / len(latencies), 2) if latencies else 0,
+                'resume_ms_max': round(1000 * max(latencies), 2) if latencies else 0,
+                'finalize_s': round(timings['total_s'], 3),
+                'video_s': round(times[-1] - times[0] + 1 / fps, 2) if times else 0,
+                'recorded_s': round(recorded, 2),
+                'max_jump_s': round(max((b - a for a, b in zip(times, times[1:])), default=0), 3),
+            }
+        persistent = results['persistent']
+        results['passed'] = (results['segments']['ok'] and persistent['ok'] and persistent['resume_ms_max'] <= max_resume_ms
+                             and persistent['max_jump_s'] <= max_gap_s
+                             and abs(persistent['video_s'] - persistent['recorded_s']) <= max_gap_s)
+        return results
+    finally:
+        shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+
+def parse_importtime(stderr):
+    """Parse -X importtime output into {module: (self_us, cumulative_us, depth)}."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+def bench_startup(module, top, runs):
+    """Cold import cost of the app, per top-level module, via python -X importtime."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    walls, modules = [], {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              capture_output=True, text=True, cwd=root, creationflags=finalize.NO_WINDOW)
+        walls.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            return {'module': module, 'ok': False, 'error': proc.stderr.strip().splitlines()[-1]}
+        modules = parse_importtime(proc.stderr)
+    # A package's first import carries the cumulative cost of everything it pulls in
+    packages = {}
+    for name, (_, cum, _) in modules.items():
+        package = name.split(".")[0]
+        packages[package] = max(packages.get(package, 0), cum)
+    heaviest = sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    return {
+        'module': module,
+        'ok': True,
+        'runs': runs,
+        'wall_ms_min': round(1000 * min(walls), 1),
+        'import_ms': round(modules.get(module, (0, 0, 0))[1] / 1000, 1),
+        'modules_loaded': len(modules),
+        'heaviest_ms': {name: round(us / 1000, 1) for name, us in heaviest},
+    }
+
+def _latency_stats(seconds):
+    ms = [1000 * t for t in seconds]
+    return {'mean': round(sum(ms) / len(ms), 2), 'max': round(max(ms), 2)} if ms else None
+
+def bench_audio_start(cycles, host_latency, open_latency, max_latency_ms, hold=0.5):
+    """Start/pause/resume reaction of both audio streams, against the synthetic backends.
+
+    Resume latency is transition to first captured block, pause latency is
+    transition to the stream being stopped. While paused the capture threads
+    must not wake at all. A final cycle fails a read to exercise device-change
+    recovery; it is reported separately since it reopens the host on purpose.
+    """
+    backend = SyntheticPyAudio(host_latency=host_latency, open_latency=open_latency)
+    sd_backend = SyntheticSoundDevice()
+    recorder = AudioRecorder(pyaudio_backend=backend, sounddevice_backend=sd_backend)
+    first, stopped = recorder.first_sample_latencies, recorder.stop_latencies
+    idle_wakeups = idle_callbacks = 0
+    try:
+        recorder.start_recording(True, True)
+        for _ in range(cycles):
+            time.sleep(hold)
+            recorder.pause()
+            time.sleep(0.1)
+            wakeups, callbacks = recorder.state_wakeups, sd_backend.callbacks
+            time.sleep(hold)
+            idle_wakeups += recorder.state_wakeups - wakeups
+            idle_callbacks += sd_backend.callbacks - callbacks
+            recorder.resume()
+        time.sleep(hold)
+        measured = {name: len(first[name]) for name in first}
+        recorder.pause()
+        time.sleep(0.1)
+        backend.fail_reads = 1
+        recorder.resume()
+        time.sleep(hold)
+        recorder.stop()
+        results = {'cycles': cycles}
+        for name in ("system", "mic"):
+            results[name] = {
+                'start_ms': round(1000 * first[name][0], 2) if first[name] else None,
+                'resume_ms': _latency_stats(first[name][1:measured[name]]),
+                'pause_ms': _latency_stats(stopped[name][:-1]),
+                'stop_ms': round(1000 * stopped[name][-1], 2) if stopped[name] else None,
+                'segments': len(recorder.system_segments if name == "system" else recorder.mic_segments),
+            }
+        results['system']['device_change_ms'] = round(1000 * first['system'][-1], 2) if len(first['system']) > measured['system'] else None
+        results['idle_wakeups'] = idle_wakeups
+        results['idle_callbacks'] = idle_callbacks
+        results['hosts_created'] = backend.hosts_created
+        results['device_lookups'] = backend.device_lookups
+        results['streams_opened'] = {'system': backend.streams_opened, 'mic': sd_backend.streams_opened}
+        reactions = [results[n][k]['max'] for n in ("system", "mic") for k in ("resume_ms", "pause_ms") if results[n][k]]
+        results['passed'] = idle_wakeups == 0 and idle_callbacks == 0 and len(reactions) == 4 and max(reactions) <= max_latency_ms
+        return results
+    finally:
+        recorder.invalidate_audio_device()
+        shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+
+# name: (duration_s, pause cycles, audio on)
+PIPELINE_SCENARIOS = {
+    "1-pause": (60, 1, True),
+    "50-pauses": (60, 50, True),
+    "no-audio": (60, 1, False),
+    "10min": (600, 1, True),
+    "3h": (3 * 3600, 1, True),
+}
+# Share of a scenario's frames the capture may drop or miss before the scenario fails
+PIPELINE_MAX_DROP = 0.01
+PIPELINE_SUITES = {
+    "quick": ["1-pause", "50-pauses", "no-audio"],
+    "full": ["1-pause", "50-pauses", "no-audio", "10min", "3h"],
+}
+
+def _record_live(recorder, capture, work, seconds, pauses, audio, fps, size, pause_hold):
+    """Run the app's capture flow against lavfi testsrc and the synthetic audio backends."""
+    segments = []
+
+    def start_video_segment():
+        path = capture.start(lavfi_input_args(str(fps), size), os.path.join(work, f"video_segment_{len(segments):04d}.mp4"),
+                             str(fps), "2000k")
+        if path:
+            segments.append(path)
+
+    capture.reset()
+    recorder.start_recording(audio, audio)
+    start_video_segment()
+    stretch = seconds / (pauses + 1)
+    for _ in range(pauses):
+        time.sleep(stretch)
+        recorder.pause()
+        if not capture.pause(): capture.stop()
+        time.sleep(pause_hold)
+        recorder.resume()
+        if not capture.resume(): start_video_segment()
+    time.sleep(stretch)
+    return segments
+
+def _record_prebuilt(recorder, work, seconds, pauses, audio, fps):
+    """Lay out the files a capture of this length leaves behind, rendered offline."""
+    segments = [make_synthetic_video(os.path.join(work, "video_segment_0000.mp4"), seconds, fps=fps)]
+    if audio:
+        make_segments(recorder, pauses + 1, seconds / (pauses + 1))
+    return segments
+
+def bench_pipeline(names, fps, size, live_limit, pause_hold, rolling=None):
+    """Capture -> stop -> finalize for each scenario, through the same objects the app uses.
+
+    Scenarios up to live_limit seconds are captured in real time from lavfi
+    testsrc with synthetic audio; longer ones are rendered offline, so only
+    their finalize is representative. stop_to_file_s covers stopping the
+    capture and audio streams and the finalize job, like pressing Stop.
+    Passes when every scenario wrote a file with video in it, no audio was
+    dropped, and neither the frames ffmpeg dropped nor those missing from
+    the file came to more than PIPELINE_MAX_DROP of duration * fps.
+    """
+    results = {'fps': fps, 'size': size, 'rolling_s': rolling, 'scenarios': {}}
+    for name in names:
+        seconds, pauses, audio = PIPELINE_SCENARIOS[name]
+        live = seconds <= live_limit
+        recorder = AudioRecorder(pyaudio_backend=SyntheticPyAudio(), sounddevice_backend=SyntheticSoundDevice())
+        capture = VideoCapture(segment_seconds=rolling)
+        work = os.path.join(recorder.temp_dir, "video")
+        os.makedirs(work)
+        audio_dir = recorder.temp_dir
+        output = os.path.join(os.path.dirname(audio_dir), f"bench_{os.path.basename(audio_dir)}.mp4")
+        worker = finalize.FinalizeWorker()
+        try:
+            with PeakRSS(interval=0.1, children=True) as capture_rss:
+                if live:
+                    segments = _record_live(recorder, capture, work, seconds, pauses, audio, fps, size, pause_hold)
+                else:
+                    segments = _record_prebuilt(recorder, work, seconds, pauses, audio, fps)
+            with PeakRSS(interval=0.05, children=True) as finalize_rss:
+                stop_started = time.perf_counter()
+                capture.stop()
+                recorder.stop()
+                temp_bytes = dir_bytes(audio_dir)
+                # Same hand-off as RecordingSession.finalize()
+                take = recorder.detach_take()
+                job = worker.submit(finalize.FinalizeJob(segments, take, output, work, 1.0, 1.0,
+                                                         video_gaps=capture.gaps, video_stats=capture.segment_stats))
+                worker.wait()
+                stop_to_file = time.perf_counter() - stop_started
+            expected = int(seconds * fps)
+            frames = count_video_frames(output) if os.path.exists(output) else 0
+            mic = recorder.mic_buffer_stats()
+            results['scenarios'][name] = {
+                'mode': "live" if live else "prebuilt",
+                'duration_s': seconds,
+                'pauses': pauses,
+                'audio': audio,
+                'ok': job.status == "done" and os.path.exists(output),
+                'stop_to_file_s': round(stop_to_file, 3),
+                'timings': job.timings,
+                'peak_rss_mb': {'capture': round(capture_rss.peak / 2**20, 1), 'finalize': round(finalize_rss.peak / 2**20, 1)},
+                'temp_mb': round(temp_bytes / 2**20, 1),
+                'output_mb': round(os.path.getsize(output) / 2**20, 1) if os.path.exists(output) else 0,
+                'video_frames': frames,
+                'dropped_video_frames': max(0, expected - frames),
+                'encoder': {
+                    'min_speed': min((st['min_speed'] for st in capture.segment_stats if st['min_speed'] is not None), default=None),
+                    'drop_frames': sum(st.get('drop_frames', 0) for st in capture.segment_stats),
+                    'dup_frames': sum(st.get('dup_frames', 0) for st in capture.segment_stats),
+                    'slow_alerts': sum(st['slow_alerts'] for st in capture.segment_stats),
+                },
+                'dropped_audio_frames': mic.get('dropped_frames', 0),
+                'audio_input_overflows': mic['input_overflows'],
+                'audio_metrics': {
+                    stream: {k: m[k] for k in ('samples', 'overflows', 'underflows', 'errors', 'queue_high_water', 'drift_ms')}
+                    for stream, m in (take.metrics or {}).items()
+                },
+            }
+        finally:
+            capture.stop()
+            recorder.invalidate_audio_device()
+            shutil.rmtree(audio_dir, ignore_errors=True)
+            for path in (output, metrics.sidecar_path(output)):
+                if os.path.exists(path): os.remove(path)
+    results['passed'] = all(r['ok'] and r['video_frames'] > 0 and r['dropped_audio_frames'] == 0
+                            and max(r['encoder']['drop_frames'], r['dropped_video_frames']) <= PIPELINE_MAX_DROP * r['duration_s'] * fps
+                            for r in results['scenarios'].values())
+    return results
+
+def _snapshot_session(recorder, capture, segments, work, crash_dir):
+    """Copy the temp dirs of a running recording, as a crash would leave them, with a manifest."""
+    video_dir, audio_dir = os.path.join(crash_dir, "video"), os.path.join(crash_dir, "audio")
+    shutil.copytree(work, video_dir)
+    shutil.copytree(recorder.temp_dir, audio_dir, ignore=shutil.ignore_patterns("video"))
+    recover.write_manifest(video_dir, created=time.time(), audio_dir=audio_dir, sample_rate=recorder.sample_rate,
+                           sys_volume=1.0, mic_volume=1.0, save_dir=crash_dir, gaps=capture.gaps,
+                           video_segments=[os.path.join(video_dir, os.path.basename(s)) for s in segments])
+    return video_dir
+
+def _failing_finalize():
+    """Finalize a recording whose capture file ffmpeg cannot read: the job must fail and keep its files."""
+    recorder = AudioRecorder(pyaudio_backend=SyntheticPyAudio(), sounddevice_backend=SyntheticSoundDevice())
+    work = os.path.join(recorder.temp_dir, "video")
+    os.makedirs(work)
+    segment = os.path.join(work, "segment_0000.mp4")
+    with open(segment, "wb") as f:
+        f.write(os.urandom(64 * 1024))
+    make_segments(recorder, 1, 2)
+    output = os.path.join(tempfile.mkdtemp(prefix="screen_recorder_bench_"), "failed.mp4")
+    take = recorder.detach_take()
+    worker = finalize.FinalizeWorker()
+    try:
+        job = worker.submit(finalize.FinalizeJob([segment], take, output, work, 1.0, 1.0))
+        worker.wait()
+        result = {
+            'status': job.status,
+            'error': job.error and str(job.error),
+            'files_kept': os.path.exists(segment) and all(os.path.exists(p) for p in take.system_segments + take.mic_segments),
+        }
+        result['passed'] = job.status == "failed" and result['files_kept']
+        return result
+    finally:
+        take.cleanup()
+        recorder.cleanup()
+        shutil.rmtree(os.path.dirname(output), ignore_errors=True)
+
+def bench_recover(seconds, fps, size, rolling):
+    """Crash mid-recording and recover, with plain vs. rolling fragmented capture files.
+
+    The temp dirs are copied while ffmpeg and the WAV writers are still
+    writing (one pause in), which is what a crash leaves on disk, and
+    recover() runs on the copy. lost_s is the video ffmpeg had encoded at
+    the crash but that is missing from the recovered file. A finalize whose
+    mux fails must report failure and leave its files for recovery.
+    Passes when the rolling capture is recovered with at most CRASH_LOSS_S
+    lost and the failed finalize kept its files; plain capture files are
+    the baseline and usually cannot be recovered.
+    """
+    results = {'seconds': seconds, 'fps': fps, 'size': size, 'modes': {}}
+    for name, segment_seconds in (("plain", None), ("rolling", rolling)):
+        recorder = AudioRecorder(pyaudio_backend=SyntheticPyAudio(), sounddevice_backend=SyntheticSoundDevice())
+        capture = VideoCapture(segment_seconds=segment_seconds)
+        work = os.path.join(recorder.temp_dir, "video")
+        os.makedirs(work)
+        crash_dir = tempfile.mkdtemp(prefix="screen_recorder_crash_")
+        try:
+            segments = _record_live(recorder, capture, work, seconds, 1, True, fps, size, pause_hold=0.5)
+            encoded = capture.progress.get('frame', 0)
+            video_dir = _snapshot_session(recorder, capture, segments, work, crash_dir)
+            capture.stop()
+            recorder.stop()
+            started = time.perf_counter()
+            output = recover.recover(video_dir)
+            frames = count_video_frames(output) if output else 0
+            results['modes'][name] = {
+                'recovered': bool(output),
+                'recover_s': round(time.perf_counter() - started, 3),
+                'frames_at_crash': encoded,
+                'video_frames': frames,
+                'lost_s': round(max(0, encoded - frames) / fps, 2),
+            }
+        finally:
+            capture.stop()
+            recorder.invalidate_audio_device()
+            shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+            shutil.rmtree(crash_dir, ignore_errors=True)
+    results['failing_finalize'] = _failing_finalize()
+    rolling = results['modes']['rolling']
+    results['passed'] = (rolling['recovered'] and rolling['video_frames'] > 0 and rolling['lost_s'] <= CRASH_LOSS_S
+                         and results['failing_finalize']['passed'])
+    return results
+
+def bench_replay(seconds, window, part, saves, fps, size):
+    """Run instant replay (lavfi + synthetic audio) and save the window a few times.
+
+    Samples the replay temp dir and the process RSS (with ffmpeg) once a
+    second; once the window has filled, neither should grow. Each save is
+    finalized right away and its video and audio lengths reported. Passes
+    when each save holds the window (less the open part while it fills, at
+    most a part more) with audio as long as its video, and the temp dir
+    stays within two parts.
+    """
+    results = {'seconds': seconds, 'window': window, 'part': part, 'fps': fps, 'size': size, 'samples': [], 'saves': []}
+    bitrate_kbps = 4000
+    recorder = AudioRecorder(pyaudio_backend=SyntheticPyAudio(), sounddevice_backend=SyntheticSoundDevice())
+    buffer = ReplayBuffer(window, part)
+    save_at = [seconds * (i + 1) / (saves + 1) for i in range(saves)]
+    proc = psutil.Process()
+    try:
+        recorder.start_recording(True, True, replay_seconds=buffer.window_seconds)
+        buffer.start(lavfi_input_args(str(fps), size), str(fps), f"{bitrate_kbps}k")
+        started = time.perf_counter()
+        while (elapsed := time.perf_counter() - started) < seconds:
+            time.sleep(1)
+            rss = proc.memory_info().rss + sum(c.memory_info().rss for c in proc.children(recursive=True))
+            results['samples'].append({'t': round(elapsed), 'disk_bytes': dir_bytes(buffer.temp_dir), 'rss_mb': round(rss / 2**20, 1)})
+            if save_at and elapsed >= save_at[0]:
+                save_at.pop(0)
+                output = os.path.join(recorder.temp_dir, f"replay_{len(results['saves'])}.mp4")
+                job = buffer.save(recorder, output)
+                job.run()
+                results['saves'].append({
+                    'at_s': round(elapsed, 1),
+                    'video_s': round(count_video_frames(output) / fps, 2),
+                    'audio_s': round(count_audio_seconds(output, recorder.sample_rate), 2),
+                    'finalize_s': job.timings['total_s'],
+                })
+                job.cleanup()
+    finally:
+        buffer.stop()
+        recorder.stop()
+        recorder.invalidate_audio_device()
+        buffer.cleanup()
+        shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+    # Compare the second half, when the window has long been full
+    steady = results['samples'][len(results['samples']) // 2:]
+    if steady:
+        results['disk_spread_bytes'] = max(s['disk_bytes'] for s in steady) - min(s['disk_bytes'] for s in steady)
+        results['rss_growth_mb'] = round(steady[-1]['rss_mb'] - steady[0]['rss_mb'], 1)
+    results['passed'] = (len(results['saves']) == saves and results.get('disk_spread_bytes', 0) <= 2 * part * bitrate_kbps * 1000 / 8
+                         and all(min(window, s['at_s']) - part - 1 <= s['video_s'] <= window + part + 1
+                                 and abs(s['audio_s'] - s['video_s']) <= AV_SLACK_S for s in results['saves']))
+    return results
+
+def bench_supervisor(seconds, kills, size, children):
+    """Kill the capture ffmpeg mid-recording and let RecordingSession restart it; then time shutdown.
+
+    Records a lavfi source with synthetic audio through RecordingSession,
+    kill -9s the capture kills times and ticks once a second, and as soon as
+    on_crash reports a crash, like the app does. The output should hold what the capture encoded, less at most
+    a fragment per crash, with audio matching it. Then children long-running ffmpegs (half with no
+    stdin, so they cannot be asked to quit) are stopped with
+    supervisor.shutdown(). Passes when every kill was restarted, at most
+    CRASH_LOSS_S was lost per kill, audio matches video within AV_SLACK_S
+    and shutdown left nothing running within SHUTDOWN_S.
+    """
+    from .session import RecordingSession
+    from .supervisor import SHUTDOWN_S, supervisor
+    save_dir = tempfile.mkdtemp(prefix="screen_recorder_bench_")
+    wake = threading.Event()
+    session = RecordingSession({'source': "testsrc", 'test_size': size, 'quality': "Low", 'synthetic_audio': True,
+                                'system_audio': True, 'mic_audio': True, 'adaptive': False, 'save_dir': save_dir},
+                               on_crash=wake.set)
+    fps = int(session.quality_settings()[0])
+    kill_at = [seconds * (i + 1) / (kills + 1) for i in range(kills)]
+    results = {'seconds': seconds, 'size': size, 'fps': fps, 'kills': []}
+    try:
+        session.start()
+        started = time.perf_counter()
+        while (elapsed := time.perf_counter() - started) < seconds:
+            wake.wait(1)
+            wake.clear()
+            if kill_at and elapsed >= kill_at[0]:
+                kill_at.pop(0)
+                pid = session.capture.process.pid
+                session.capture.process.kill()
+                results['kills'].append({'at_s': round(elapsed, 1), 'pid': pid})
+            session.tick()
+        job = session.stop(os.path.join(save_dir, "supervised.mp4"))
+        session.wait()
+        stats = session.capture.segment_stats
+        encoded = sum(st.get('frame', 0) for st in stats)
+        frames = count_video_frames(job.output)
+        results.update({
+            'status': job.status,
+            'restarts': session.restarts,
+            'segments': len(stats),
+            'capture_alive_s': round(sum(st['process']['runtime_s'] for st in stats), 2),
+            'frames_encoded': encoded,
+            # At most the open fragment (a second) per crash
+            'lost_s': round(max(0, encoded - frames) / fps, 2),
+            'video_s': round(frames / fps, 2),
+            'audio_s': round(count_audio_seconds(job.output, session.audio_recorder.sample_rate), 2),
+            'capture': [st['process'] for st in stats],
+            'finalize': [c.summary() for c in job.children],
+        })
+        results['av_drift_s'] = round(results['audio_s'] - results['video_s'], 2)
+    finally:
+        session.close()
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+    for i in range(children):
+        supervisor.spawn(["ffmpeg", "-v", "error", "-re", "-f", "lavfi", "-i", "testsrc=size=320x240:rate=30", "-f", "null", "-"],
+                         "bench", stdin=subprocess.PIPE if i % 2 else subprocess.DEVNULL)
+    time.sleep(1)
+    stopping = time.perf_counter()
+    supervisor.shutdown()
+    results['shutdown'] = {
+        'children': children,
+        'shutdown_s': round(time.perf_counter() - stopping, 3),
+        'still_running': len(supervisor.snapshot()),
+        'exit_codes': [c.returncode for c in list(supervisor.history)[-children:]] if children else [],
+    }
+    results['passed'] = (results['status'] == "done" and results['restarts'] == len(results['kills'])
+                         and results['lost_s'] <= CRASH_LOSS_S * len(results['kills']) and abs(results['av_drift_s']) <= AV_SLACK_S
+                         and results['shutdown']['still_running'] == 0 and results['shutdown']['shutdown_s'] <= SHUTDOWN_S)
+    return results
+
+def bench_trace(seconds, size, calls):
+    """Tracing cost while off, and one traced recording (lavfi + synthetic audio) read back from its trace.
+
+    Simulated hotkey presses start and stop the recording, so the trace
+    gives hotkey-to-first-frame and stop-to-file the way the app would
+    see them.
+    """
+    from . import trace
+    from .session import RecordingSession
+
+    def noop():
+        pass
+
+    traced_noop = trace.traced("noop")(noop)
+    results = {'calls': calls}
+    was_enabled = trace.enabled()
+    trace.enable(False)
+    for name, fn in (("plain_ns", noop), ("traced_off_ns", traced_noop), ("span_off_ns", lambda: trace.span("noop").__enter__())):
+        started = time.perf_counter_ns()
+        for _ in range(calls): fn()
+        results[name] = round((time.perf_counter_ns() - started) / calls, 1)
+    trace.enable(True)
+    started = time.perf_counter_ns()
+    for _ in range(calls): traced_noop()
+    results['traced_on_ns'] = round((time.perf_counter_ns() - started) / calls, 1)
+
+    save_dir = tempfile.mkdtemp(prefix="screen_recorder_bench_")
+    session = RecordingSession({'source': "testsrc", 'test_size': size, 'quality': "Low", 'synthetic_audio': True,
+                                'system_audio': True, 'mic_audio': True, 'adaptive': False, 'save_dir': save_dir, 'trace': True})
+    try:
+        trace.input_event("hotkey", key="alt+s")
+        session.start()
+        time.sleep(seconds)
+        trace.input_event("hotkey", key="alt+s")
+        job = session.stop(os.path.join(save_dir, "traced.mp4"))
+        session.wait()
+        with open(trace.trace_path(job.output)) as f:
+            events = json.load(f)['traceEvents']
+    finally:
+        session.close()
+        shutil.rmtree(save_dir, ignore_errors=True)
+        trace.enable(was_enabled)
+
+    presses = [e['ts'] for e in events if e['name'] == "hotkey"]
+    first = lambda name: min((e['ts'] for e in events if e['name'] == name), default=None)
+    job_end = max(e['ts'] + e['dur'] for e in events if e['name'] == "finalize job")
+    totals = {}
+    for e in events:
+        if e['ph'] == "X": totals[e['name']] = totals.get(e['name'], 0) + e['dur']
+    results.update({
+        'status': job.status,
+        'events': len(events),
+        'threads': sum(1 for e in events if e['name'] == "thread_name"),
+        'processes': sum(1 for e in events if e['name'] == "process_name"),
+        'hotkey_to_first_frame_ms': round((first("first frame") - presses[0]) / 1000, 1),
+        'hotkey_to_first_audio_ms': round((first("first audio") - presses[0]) / 1000, 1),
+        'stop_to_file_ms': round((job_end - presses[-1]) / 1000, 1),
+        'top_spans_ms': {k: round(v / 1000, 1) for k, v in sorted(totals.items(), key=lambda kv: -kv[1])[:12]},
+    })
+    return results
+
+# A hotkey press has to return at once, whatever the Tk thread is doing (p99, ms)
+MAX_PRESS_MS = 10
+
+class _AfterLoop:
+    """Runs after() callbacks on one thread, standing in for the Tk mainloop.
+
+    Like Tkinter with a threaded Tcl, after() from another thread is handed
+    to the loop thread and blocks the caller until the loop gets to it,
+    that is until the callback running there has returned.
+    """
+
+    def __init__(self):
+        self._timers = []
+        self._calls = queue.Queue()
+        self._seq = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def after(self, ms, fn):
+        if threading.current_thread() is self._thread:
+            self._add(ms, fn)
+            return
+        handed = threading.Event()
+        self._calls.put((ms, fn, handed))
+        handed.wait()
+
+    def _add(self, ms, fn):
+        self._seq += 1
+        heapq.heappush(self._timers, (time.perf_counter() + ms / 1000, self._seq, fn))
+
+    def _run(self):
+        while True:
+            timeout = max(0.0, self._timers[0][0] - time.perf_counter()) if self._timers else None
+            try:
+                ms, fn, handed = self._calls.get(timeout=timeout)
+            except queue.Empty:
+                heapq.heappop(self._timers)[2]()
+                continue
+            if fn is None:
+                handed.set()
+                return
+            self._add(ms, fn)
+            handed.set()
+
+    def close(self):
+        self.after(0, None)
+        self._thread.join()
+
+def bench_hotkeys(seconds, pressers, size, seed, direct=False):
+    """Hammer Alt+S / Alt+P from several threads against a real RecordingSession (lavfi, no audio).
+
+    Presses go through the app's CommandDispatcher onto a single loop
+    thread, with random gaps and double taps, while a Start/Stop button is
+    clicked on the loop thread now and then. The loop blocks after() from
+    other threads the way a threaded Tcl does. Passes if no two commands
+    ever ran at once, at most one capture ffmpeg was alive at any time, no
+    command failed and 99% of presses returned within MAX_PRESS_MS.
+    press_max_ms is the longest a hook thread was held.
+    With direct, presses call the actions on the presser threads instead,
+    as the hotkeys did before the dispatcher.
+    """
+    import random
+    from .commands import CommandDispatcher
+    from .session import RecordingSession
+    from .supervisor import supervisor
+    save_dir = tempfile.mkdtemp(prefix="screen_recorder_bench_")
+    session = RecordingSession({'source': "testsrc", 'test_size': size, 'quality': "Low", 'adaptive': False, 'save_dir': save_dir})
+    loop = _AfterLoop()
+    dispatcher = CommandDispatcher(loop.after)
+    loop.after(0, dispatcher.start)
+    running = [0, 0]
+    press_ms = []
+    captures = [0]
+    done = threading.Event()
+
+    def exclusive(fn):
+        def run():
+            running[0] += 1; running[1] = max(running[1], running[0])
+            try: fn()
+            finally: running[0] -= 1
+        return run
+
+    def toggle():
+        session.stop() if session.recording else session.start()
+
+    def pause():
+        session.resume() if session.paused else session.pause()
+
+    dispatcher.register("toggle", exclusive(toggle))
+    dispatcher.register("pause", exclusive(pause), valid=lambda: session.recording)
+
+    def button(rng):
+        # The window's Start/Stop button runs on the Tk thread as well, outside the dispatcher
+        exclusive(toggle)()
+        if not done.is_set():
+            loop.after(int(rng.uniform(1000, 3000)), lambda: button(rng))
+
+    def presser(rng):
+        while not done.is_set():
+            name = rng.choice(("toggle", "pause", "pause"))
+            for _ in range(2 if rng.random() < 0.4 else 1):
+                started = time.perf_counter()
+                if direct:
+                    action, valid, _ = dispatcher.commands[name]
+                    try:
+                        if not valid or valid(): action()
+                    except Exception as e:
+                        dispatcher.counts['failed'] += 1
+                        print(f"[BENCH] {name} failed: {e}")
+                else:
+                    dispatcher.press(name)
+                press_ms.append((time.perf_counter() - started) * 1000)
+                time.sleep(rng.uniform(0.02, 0.15))
+            time.sleep(rng.uniform(0.05, 0.8))
+
+    def watch():
+        while not done.wait(0.02):
+            captures[0] = max(captures[0], sum(1 for c in supervisor.snapshot() if c['role'] == "capture"))
+
+    threads = [threading.Thread(target=presser, args=(random.Random(seed + i),), daemon=True) for i in range(pressers)]
+    threads.append(threading.Thread(target=watch, daemon=True))
+    try:
+        for t in threads: t.start()
+        loop.after(1000, lambda: button(random.Random(seed - 1)))
+        time.sleep(seconds)
+        done.set()
+        for t in threads: t.join()
+        # Let the queue run dry, then end the last recording
+        drained = threading.Event()
+        loop.after(0, drained.set)
+        drained.wait()
+        loop.after(0, lambda: session.stop())
+        session.wait()
+        jobs = len([f for f in os.listdir(save_dir) if f.endswith(".mp4")])
+    finally:
+        done.set()
+        loop.close()
+        session.close()
+        shutil.rmtree(save_dir, ignore_errors=True)
+    stats = dispatcher.stats()
+    press_ms.sort()
+    p99 = press_ms[int(len(press_ms) * 0.99)] if press_ms else 0.0
+    return {
+        'seconds': seconds, 'pressers': pressers, 'mode': "direct" if direct else "dispatcher",
+        'commands': stats,
+        'recordings_saved': jobs,
+        'press_p99_ms': round(p99, 3),
+        'press_max_ms': round(press_ms[-1], 3) if press_ms else None,
+        'max_concurrent_commands': running[1],
+        'max_capture_processes': captures[0],
+        'passed': running[1] <= 1 and captures[0] <= 1 and stats['failed'] == 0 and (direct or p99 <= MAX_PRESS_MS),
+    }
+
+def bench_governor(seconds, fps, size, adaptive=True):
+    """Capture a lavfi source the machine cannot encode in real time, with and without the governor.
+
+    Restarts follow RecordingSession.restart_video_segment(). Reports the
+    decisions taken and how far the capture fell behind (frames delivered vs.
+    segment wall time * fps).
+    """
+    from .governor import CaptureGovernor
+    from .video import get_encoder
+    results = {'seconds': seconds, 'fps': fps, 'size': size}
+    recorder = AudioRecorder()
+    try:
+        for name in ("fixed", "adaptive") if adaptive else ("fixed",):
+            work = os.path.join(recorder.temp_dir, name)
+            os.makedirs(work)
+            capture = VideoCapture()
+            capture.reset()
+            governor = CaptureGovernor(fps, get_encoder()[0]) if name == "adaptive" else None
+            segments = []
+
+            def start():
+                seg_fps, preset, scale = governor.settings if governor else (fps, None, None)
+                path = os.path.join(work, f"video_segment_{len(segments):04d}.mp4")
+                fps_by_segment[os.path.basename(path)] = seg_fps
+                segments.append(capture.start(lavfi_input_args(str(seg_fps), size), path, str(seg_fps), "4000k", preset, scale))
+
+            fps_by_segment = {}
+
+            def fps_of(stats):
+                return fps_by_segment[stats['segment']]
+
+            if governor: governor.start_take()
+            start()
+            began = time.perf_counter()
+            while time.perf_counter() - began < seconds:
+                time.sleep(1)
+                if governor and governor.tick(capture):
+                    capture.stop()
+                    start()
+                    governor.restarted()
+            capture.stop()
+            expected = sum(st['wall_s'] * fps_of(st) for st in capture.segment_stats)
+            frames = sum(st.get('frame', 0) for st in capture.segment_stats)
+            results[name] = {
+                'segments': len(segments),
+                'frames': frames,
+                'realtime_ratio': round(frames / expected, 3) if expected else None,
+                'drop_frames': sum(st.get('drop_frames', 0) for st in capture.segment_stats),
+                'final_settings': governor.settings if governor else (fps, None, 1.0),
+                'decisions': governor.decisions if governor else [],
+            }
+        return results
+    finally:
+        shutil.rmtree(recorder.temp_dir, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m recorder.bench")
+    sub = parser.add_subparsers(dest="command", required=True)
+    mix = sub.add_parser("mix", help="NumPy mixer vs. pydub finalize")
+    mix.add_argument("--segments", type=int, default=20)
+    mix.add_argument("--seconds", type=float, default=30)
+    stream = sub.add_parser("finalize-stream", help="out-of-core finalize of large synthetic sessions")
+    stream.add_argument("--gb", type=float, default=4)
+    stream.add_argument("--segments", type=int, default=8)
+    stream.add_argument("--memory-cap-mb", type=float, default=256)
+    mux = sub.add_parser("mux", help="combined_a.wav vs. piped audio into the final mux")
+    mux.add_argument("--segments", type=int, default=10)
+    mux.add_argument("--seconds", type=float, default=60)
+    concat = sub.add_parser("concat", help="two-pass vs. single-pass concat + mux")
+    concat.add_argument("--segments", type=int, default=10)
+    concat.add_argument("--seconds", type=float, default=30)
+    plans = sub.add_parser("finalize-plans", help="single-pass vs. parallel finalize graph, per-stage timings")
+    plans.add_argument("--segments", type=int, default=10)
+    plans.add_argument("--seconds", type=float, default=30)
+    plans.add_argument("--size", default="1280x720")
+    incremental = sub.add_parser("incremental", help="stop-to-file time vs. session length, with and without incremental finalize")
+    incremental.add_argument("--periods", type=int, nargs="+", default=[2, 10, 30])
+    incremental.add_argument("--seconds", type=float, default=20)
+    resume = sub.add_parser("resume", help="pause/resume latency, segmented vs. persistent capture")
+    resume.add_argument("--cycles", type=int, default=5)
+    resume.add_argument("--fps", type=int, default=30)
+    resume.add_argument("--size", default="640x360")
+    resume.add_argument("--max-resume-ms", type=float, default=50)
+    resume.add_argument("--max-gap-s", type=float, default=0.25)
+    startup = sub.add_parser("startup", help="per-module import cost at app start")
+    startup.add_argument("--module", default="recorder.app")
+    startup.add_argument("--top", type=int, default=15)
+    startup.add_argument("--runs", type=int, default=3)
+    audio_start = sub.add_parser("audio-start", help="audio start/pause/resume reaction and idle wakeups (synthetic backends)")
+    audio_start.add_argument("--cycles", type=int, default=5)
+    audio_start.add_argument("--host-latency", type=float, default=0.05)
+    audio_start.add_argument("--open-latency", type=float, default=0.05)
+    audio_start.add_argument("--max-latency-ms", type=float, default=50)
+    pipeline = sub.add_parser("pipeline", help="headless capture -> finalize scenarios (lavfi + synthetic audio)")
+    pipeline.add_argument("--suite", choices=sorted(PIPELINE_SUITES), default="quick")
+    pipeline.add_argument("--scenario", action="append", choices=sorted(PIPELINE_SCENARIOS), help="run only these (repeatable)")
+    pipeline.add_argument("--fps", type=int, default=30)
+    pipeline.add_argument("--size", default="1280x720")
+    pipeline.add_argument("--live-limit", type=float, default=600, help="longer scenarios are rendered offline")
+    pipeline.add_argument("--pause-hold", type=float, default=0.2)
+    pipeline.add_argument("--output", help="also write the JSON here")
+    pipeline.add_argument("--rolling", type=float, help="capture rolling fragmented MP4 parts of this many seconds")
+    recover_cmd = sub.add_parser("recover", help="crash mid-recording and recover, plain vs. rolling capture files")
+    recover_cmd.add_argument("--seconds", type=float, default=12)
+    recover_cmd.add_argument("--fps", type=int, default=30)
+    recover_cmd.add_argument("--size", default="1280x720")
+    recover_cmd.add_argument("--rolling", type=float, default=ROLLING_SEGMENT_S)
+    replay = sub.add_parser("replay", help="instant replay: constant disk/memory and saved window lengths")
+    replay.add_argument("--seconds", type=float, default=120)
+    replay.add_argument("--window", type=float, default=20)
+    replay.add_argument("--part", type=float, default=5)
+    replay.add_argument("--saves", type=int, default=3)
+    replay.add_argument("--fps", type=int, default=30)
+    replay.add_argument("--size", default="1280x720")
+    supervisor_cmd = sub.add_parser("supervisor", help="capture crash restart and bounded shutdown of ffmpeg children")
+    supervisor_cmd.add_argument("--seconds", type=float, default=20)
+    supervisor_cmd.add_argument("--kills", type=int, default=2)
+    supervisor_cmd.add_argument("--size", default="1280x720")
+    supervisor_cmd.add_argument("--children", type=int, default=4)
+    trace_cmd = sub.add_parser("trace", help="tracing overhead while off, and the spans of one traced recording")
+    trace_cmd.add_argument("--seconds", type=float, default=5)
+    trace_cmd.add_argument("--size", default="1280x720")
+    trace_cmd.add_argument("--calls", type=int, default=200000)
+    hotkeys = sub.add_parser("hotkeys", help="stress the hotkey dispatcher against a real session: latency, no overlapping captures")
+    hotkeys.add_argument("--seconds", type=float, default=20)
+    hotkeys.add_argument("--pressers", type=int, default=3)
+    hotkeys.add_argument("--size", default="320x240")
+    hotkeys.add_argument("--seed", type=int, default=1)
+    hotkeys.add_argument("--direct", action="store_true", help="baseline: run actions on the pressing threads")
+    governor = sub.add_parser("governor", help="fixed vs. adaptive capture settings on an overloaded encoder")
+    governor.add_argument("--seconds", type=float, default=40)
+    governor.add_argument("--fps", type=int, default=60)
+    governor.add_argument("--size", default="1920x1080")
+    args = parser.parse_args(argv)
+
+    if args.command == "mix":
+        results = bench_mix(args.segments, args.seconds)
+    elif args.command == "finalize-stream":
+        results = bench_finalize_stream(args.gb, args.segments, args.memory_cap_mb)
+    elif args.command == "mux":
+        results = bench_mux(args.segments, args.seconds)
+    elif args.command == "concat":
+        results = bench_concat(args.segments, args.seconds)
+    elif args.command == "finalize-plans":
+        results = bench_finalize_plans(args.segments, args.seconds, args.size)
+    elif args.command == "incremental":
+        results = bench_incremental(args.periods, args.seconds)
+    elif args.command == "resume":
+        results = bench_resume(args.cycles, args.fps, args.size, args.max_resume_ms, args.max_gap_s)
+    elif args.command == "startup":
+        results = bench_startup(args.module, args.top, args.runs)
+    elif args.command == "audio-start":
+        results = bench_audio_start(args.cycles, args.host_latency, args.open_latency, args.max_latency_ms)
+    elif args.command == "recover":
+        results = bench_recover(args.seconds, args.fps, args.size, args.rolling)
+    elif args.command == "replay":
+        results = bench_replay(args.seconds, args.window, args.part, args.saves, args.fps, args.size)
+    elif args.command == "supervisor":
+        results = bench_supervisor(args.seconds, args.kills, args.size, args.children)
+    elif args.command == "trace":
+        results = bench_trace(args.seconds, args.size, args.calls)
+    elif args.command == "hotkeys":
+        results = bench_hotkeys(args.seconds, args.pressers, args.size, args.seed, args.direct)
+    elif args.command == "governor":
+        results = bench_governor(args.seconds, args.fps, args.size)
+    elif args.command == "pipeline":
+        results = bench_pipeline(args.scenario or PIPELINE_SUITES[args.suite], args.fps, args.size, args.live_limit, args.pause_hold,
+                                 args.rolling)
+        if args.output:
+            with open(args.output, "w") as f: json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    if results.get('within_cap') is False or results.get('passed') is False:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
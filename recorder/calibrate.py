@@ -0,0 +1,176 @@
+"""
+Encoder calibration: time short encodes of a synthetic source at the capture
+size and fps, and pick the configuration with the best quality per CPU second
+that still encodes in real time. Results are cached per ffmpeg binary, size
+and fps, next to the detected encoder.
+
+Usage:
+    python -m recorder.calibrate [--size WxH] [--fps F] [--bitrate B] [--seconds S] [--force]
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from . import trace
+from .video import (CPU_ENCODER, HW_ENCODERS, NO_WINDOW, ffmpeg_fingerprint, load_cache,
+                    preset_args, probe_encoder, save_cache)
+
+CALIBRATION_SECONDS = 2
+# How often a running encode checks for cancel
+CANCEL_POLL_S = 0.1
+# (preset, tune) pairs tried per encoder; None keeps the encoder default
+CALIBRATION_CONFIGS = {
+    "libx264": [("veryfast", None), ("superfast", None), ("ultrafast", None),
+                ("veryfast", "zerolatency"), ("superfast", "zerolatency"), ("ultrafast", "zerolatency")],
+    "h264_nvenc": [(None, None), ("p4", "ll"), ("p2", "ll"), ("p1", "ull")],
+    "h264_qsv": [(None, None), ("faster", None), ("veryfast", None)],
+    "h264_amf": [(None, None), ("balanced", "lowlatency"), ("speed", "lowlatency")],
+}
+
+_BENCH = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s rtime=([\d.]+)s")
+_PSNR = re.compile(r"PSNR .*average:([\d.]+|inf)")
+
+def tune_args(encoder, tune):
+    if not tune:
+        return []
+    return ["-usage" if encoder == "h264_amf" else "-tune", tune]
+
+def available_encoders():
+    """libx264 plus every hardware encoder that passes a test encode."""
+    try:
+        listed = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True,
+                                creationflags=NO_WINDOW).stdout.lower()
+    except Exception:
+        return [CPU_ENCODER[0]]
+    return [e for e, _ in HW_ENCODERS if e in listed and probe_encoder(e)] + [CPU_ENCODER[0]]
+
+def source_args(size, fps, seconds):
+    return ["-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}", "-t", str(seconds)]
+
+def _run_ffmpeg(cmd, timeout, cancel=None):
+    """Run cmd and return its (exit code, stderr).
+
+    The process is killed after timeout seconds (TimeoutExpired) or as
+    soon as cancel is set (returns None), so a cancelled calibration does
+    not keep encoding.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, creationflags=NO_WINDOW)
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            stderr = proc.communicate(timeout=CANCEL_POLL_S)[1]
+            return proc.returncode, stderr
+        except subprocess.TimeoutExpired:
+            cancelled = cancel is not None and cancel.is_set()
+            if not cancelled and time.perf_counter() < deadline:
+                continue
+            proc.kill()
+            proc.communicate()
+            if cancelled:
+                return None
+            raise
+
+def measure_config(encoder, preset, tune, size, fps, bitrate, seconds, work_dir, cancel=None):
+    """Timed encode plus a PSNR pass against the source. Returns a result dict or None on failure or cancel."""
+    encoded = os.path.join(work_dir, "calibration.mp4")
+    cmd = (["ffmpeg", "-y", "-hide_banner", "-nostats", "-benchmark"] + source_args(size, fps, seconds)
+           + ["-c:v", encoder, "-b:v", bitrate, "-pix_fmt", "yuv420p"]
+           + preset_args(encoder, preset) + tune_args(encoder, tune) + [encoded])
+    try:
+        encode = _run_ffmpeg(cmd, seconds * 20, cancel)
+        bench = encode and _BENCH.search(encode[1])
+        if not encode or encode[0] != 0 or not bench:
+            return None
+        compare = _run_ffmpeg(["ffmpeg", "-hide_banner", "-nostats", "-i", encoded] + source_args(size, fps, seconds)
+                             + ["-lavfi", "[0:v][1:v]psnr", "-f", "null", "-"], seconds * 20, cancel)
+        if not compare:
+            return None
+    except subprocess.TimeoutExpired:
+        return None
+    utime, stime, rtime = (float(v) for v in bench.groups())
+    psnr = _PSNR.search(compare[1])
+    psnr = float(psnr.group(1)) if psnr and psnr.group(1) != "inf" else 100.0
+    cpu = max(utime + stime, 1e-3)
+    return {
+        'encoder': encoder, 'preset': preset, 'tune': tune,
+        'speed': round(seconds / max(rtime, 1e-3), 3),
+        'cpu_s': round(cpu, 3),
+        'psnr_db': round(psnr, 2),
+        'score': round(psnr / cpu, 3),
+    }
+
+def choose(results):
+    """Best quality per CPU second among real-time configs, else the fastest one."""
+    realtime = [r for r in results if r['speed'] >= 1.0]
+    if realtime:
+        return dict(max(realtime, key=lambda r: r['score']), realtime=True)
+    if results:
+        return dict(max(results, key=lambda r: r['speed']), realtime=False)
+    return None
+
+def cache_name(size, fps):
+    return f"calibration:{size}@{fps}"
+
+def cached_calibration(size, fps):
+    """The calibrated config for size and fps if one is cached for this ffmpeg, without running it."""
+    fingerprint = ffmpeg_fingerprint()
+    return load_cache(cache_name(size, fps), fingerprint) if fingerprint else None
+
+@trace.traced()
+def calibrate(size, fps, bitrate="4500k", seconds=CALIBRATION_SECONDS, cancel=None, force=False, encoders=None):
+    """Measure every config of every available encoder and cache the choice.
+
+    cancel is an optional threading.Event; setting it kills the running
+    encode, and a cancelled run returns None and caches nothing. Returns
+    the chosen config.
+    """
+    fingerprint = ffmpeg_fingerprint()
+    if not fingerprint:
+        return None
+    if not force:
+        cached = load_cache(cache_name(size, fps), fingerprint)
+        if cached:
+            return cached
+    work_dir = tempfile.mkdtemp(prefix="screen_recorder_calibrate_")
+    results = []
+    started = time.perf_counter()
+    try:
+        for encoder in encoders or available_encoders():
+            for preset, tune in CALIBRATION_CONFIGS.get(encoder, [(None, None)]):
+                if cancel is not None and cancel.is_set():
+                    print("[CALIBRATE] Cancelled")
+                    return None
+                result = measure_config(encoder, preset, tune, size, str(fps), bitrate, seconds, work_dir, cancel)
+                if cancel is not None and cancel.is_set():
+                    continue
+                print(f"[CALIBRATE] {encoder} preset={preset} tune={tune}: {result or 'failed'}")
+                if result:
+                    results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    chosen = choose(results)
+    if chosen:
+        chosen['measured'] = results
+        save_cache(cache_name(size, fps), fingerprint, chosen)
+        print(f"[CALIBRATE] {size}@{fps}: {chosen['encoder']} preset={chosen['preset']} tune={chosen['tune']} "
+              f"({chosen['speed']}x, {chosen['psnr_db']} dB) in {time.perf_counter() - started:.1f}s")
+    return chosen
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m recorder.calibrate")
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--fps", type=int, default=60)
+    parser.add_argument("--bitrate", default="4500k")
+    parser.add_argument("--seconds", type=float, default=CALIBRATION_SECONDS)
+    parser.add_argument("--force", action="store_true", help="ignore a cached result")
+    args = parser.parse_args(argv)
+    print(json.dumps(calibrate(args.size, args.fps, args.bitrate, args.seconds, force=args.force), indent=2))
+
+if __name__ == "__main__":
+    main()
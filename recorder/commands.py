@@ -0,0 +1,102 @@
+"""
+Hotkey and tray commands, run on the Tk thread one at a time.
+
+The keyboard hook and the tray icon call press(name) on their own threads.
+press() only appends the press to a list under a lock, so the hook returns
+at once and no Tk widget or session state is touched off the Tk thread.
+root.after is not called from those threads either: with a threaded Tcl
+that call waits for the Tk thread, so a hook would be held for as long as
+a Stop runs there. Instead a poller on the Tk thread, rescheduled with
+root.after every POLL_MS, runs the pending commands in order, one per
+after() callback and each to the end before the next, so a double-tapped
+Alt+S can never start two captures.
+
+Presses are filtered on the way:
+  - debounced: a press within the command's debounce_s of the last accepted
+    one is dropped (key repeat, double taps);
+  - coalesced: a press of a command that is still waiting to run is merged
+    into it;
+  - rejected: when its turn comes, a command whose valid() is False for the
+    current state (Pause while not recording) is skipped.
+
+Latency from press to the start of the action is kept in a histogram.
+"""
+
+import threading
+import time
+
+from . import trace
+from .metrics import Histogram
+
+# Press-to-action latency buckets; a press can wait behind a Stop that ends the capture
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+DEBOUNCE_S = 0.3
+POLL_MS = 20
+
+class CommandDispatcher:
+    """Queue of named commands drained on the thread that runs schedule's callbacks.
+
+    schedule(ms, fn) is root.after and is only called from that thread;
+    start() it there once.
+    """
+
+    def __init__(self, schedule, poll_ms=POLL_MS):
+        self.schedule = schedule
+        self.poll_ms = poll_ms
+        self.commands = {}
+        self.latency = Histogram(LATENCY_BUCKETS_MS)
+        self.counts = {'pressed': 0, 'debounced': 0, 'coalesced': 0, 'rejected': 0, 'run': 0, 'failed': 0}
+        self._pending = []
+        self._last_accepted = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, action, valid=None, debounce_s=DEBOUNCE_S):
+        """action() runs on the Tk thread; valid() too, right before it."""
+        self.commands[name] = (action, valid, debounce_s)
+
+    def press(self, name, source="hotkey"):
+        """Any thread: ask for name to run. Returns what became of the press."""
+        now = time.perf_counter()
+        trace.input_event(source, command=name)
+        with self._lock:
+            self.counts['pressed'] += 1
+            debounce_s = self.commands[name][2]
+            if now - self._last_accepted.get(name, float("-inf")) < debounce_s:
+                self.counts['debounced'] += 1
+                return "debounced"
+            self._last_accepted[name] = now
+            if any(pending == name for pending, _ in self._pending):
+                self.counts['coalesced'] += 1
+                return "coalesced"
+            self._pending.append((name, now))
+        return "queued"
+
+    def start(self):
+        """Start polling for presses; call on the thread that runs schedule's callbacks."""
+        self.schedule(self.poll_ms, self._poll)
+
+    def _poll(self):
+        # One command per callback, so Tk redraws and handles events in between
+        with self._lock:
+            pending = self._pending.pop(0) if self._pending else None
+        if pending:
+            self._run(*pending)
+        self.schedule(0 if pending else self.poll_ms, self._poll)
+
+    def _run(self, name, pressed_at):
+        action, valid, _ = self.commands[name]
+        if valid and not valid():
+            self.counts['rejected'] += 1
+            print(f"[HOTKEY] Ignored {name}: not available now")
+            return
+        self.latency.record((time.perf_counter() - pressed_at) * 1000)
+        self.counts['run'] += 1
+        try:
+            with trace.span(f"command {name}"):
+                action()
+        except Exception as e:
+            self.counts['failed'] += 1
+            print(f"[HOTKEY] {name} failed: {e}")
+
+    def stats(self):
+        return dict(self.counts, latency=self.latency.snapshot())
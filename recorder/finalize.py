@@ -0,0 +1,432 @@
+"""
+Finalize step: turn recorded video and audio segments into the output MP4.
+
+finalize_recording() runs the work as a small dependency graph of stages on a
+thread pool, so stages that do not depend on each other overlap, and reports
+when each stage ran and which chain of stages set the total time.
+"""
+
+import contextvars
+import glob
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+from . import trace
+from .metrics import write_sidecar
+from .supervisor import supervisor
+
+NO_WINDOW = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+# Samples per AAC frame; the encoder puts one frame of priming ahead of the audio
+AAC_FRAME = 1024
+
+def segment_parts(segment):
+    """[(path, duration_s or None)] of one capture: the file itself, or its rolling parts in order.
+
+    Rolling parts (a %05d pattern, see VideoCapture) each start at 0. Their
+    real start times come from the segment muxer's CSV list, and a duration
+    per part keeps a pause that fell on a part boundary in the timeline for
+    setts to close. The last part, or one a crash kept out of the list,
+    plays to its end.
+    """
+    if "%" not in segment:
+        return [(segment, None)]
+    base = segment.split("%")[0]
+    starts = {}
+    try:
+        with open(base.rstrip("_") + ".csv") as f:
+            for line in f:
+                name, start, _ = line.strip().rsplit(",", 2)
+                starts[name] = float(start)
+    except (OSError, ValueError):
+        pass
+    paths = sorted(glob.glob(glob.escape(base) + "[0-9]*" + os.path.splitext(segment)[1]))
+    names = [os.path.basename(p) for p in paths]
+    durations = [starts[b] - starts[a] if a in starts and b in starts else None for a, b in zip(names, names[1:])]
+    return list(zip(paths, durations + [None]))
+
+def write_concat_list(segments, list_file):
+    """Write an ffmpeg concat demuxer list of the segments (and rolling parts) that exist."""
+    with open(list_file, "w") as f:
+        for s in segments:
+            for path, duration in segment_parts(s):
+                if not os.path.exists(path): continue
+                f.write(f"file '{path.replace(os.sep, '/')}'\n")
+                if duration: f.write(f"duration {duration:.6f}\n")
+    return list_file
+
+def check_output(path):
+    """Return path if ffmpeg left a non-empty file there; raise FileNotFoundError otherwise."""
+    if not os.path.isfile(path) or os.path.getsize(path) == 0:
+        raise FileNotFoundError(f"ffmpeg wrote no output to {path}")
+    return path
+
+@trace.traced()
+def concat_video(segments, list_file, output, video_gaps=None):
+    """Stream-copy the segments into one file, closing video_gaps on the way."""
+    write_concat_list(segments, list_file)
+    supervisor.run(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_file, "-c", "copy"] + gap_bsf_args(video_gaps) + [output],
+                   "concat")
+    return check_output(output)
+
+def gap_bsf_args(gaps):
+    """setts bitstream filter that closes timeline gaps left by paused captures.
+
+    gaps are (offset_s, duration_s) pairs; every packet past the middle of a
+    gap is moved earlier by duration. No frame falls inside a gap, so an
+    offset that is off by up to half the gap still splits the packets right.
+    Works on a stream copy, so nothing is re-encoded.
+    """
+    if not gaps:
+        return []
+    shift = "+".join(f"gte(PTS*TB\\,{offset + duration / 2:.3f})*{duration:.3f}" for offset, duration in gaps)
+    return ["-bsf:v", f"setts=ts=TS-({shift})/TB"]
+
+def _audio_output_args():
+    return ["-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac", "-b:a", "192k", "-async", "1", "-shortest"]
+
+def _pipe_pcm(cmd, role, feed):
+    """Run cmd with the PCM that feed(write) produces streamed into its stdin.
+
+    Raises FFmpegError if ffmpeg fails; a pipe that broke because ffmpeg
+    exited early is reported through that error. A pipe ffmpeg closed and
+    then exited cleanly is -shortest ending the audio at the video.
+    """
+    child = supervisor.spawn(cmd, role, stdin=subprocess.PIPE)
+    pipe_error = None
+    try:
+        feed(child.process.stdin.write)
+    except (BrokenPipeError, OSError) as e:
+        pipe_error = e
+    finally:
+        try: child.process.stdin.close()
+        except OSError: pass
+        supervisor.wait(child)
+    supervisor.check(child)
+    if isinstance(pipe_error, BrokenPipeError):
+        print(f"[FINALIZE] Audio pipe closed early: {pipe_error}")
+    elif pipe_error:
+        raise pipe_error
+
+def _pcm_input_args(sample_rate):
+    return ["-f", "s16le", "-ar", str(sample_rate), "-ac", "2", "-i", "pipe:0"]
+
+def _mix_feed(audio, sys_volume, mic_volume, progress, gain):
+    return lambda write: audio.stream_audio_segments(write, sys_volume, mic_volume, progress, gain)
+
+@trace.traced()
+def encode_audio(audio, output, sys_volume, mic_volume, progress=None, gain=None):
+    """Mix and AAC-encode the audio on its own, for muxing by stream copy later."""
+    _pipe_pcm(["ffmpeg", "-y", "-loglevel", "error"] + _pcm_input_args(audio.sample_rate) + ["-c:a", "aac", "-b:a", "192k", output],
+              "audio_encode", _mix_feed(audio, sys_volume, mic_volume, progress, gain))
+    return check_output(output)
+
+def encode_adts(feed, output, sample_rate):
+    """AAC-encode the s16le stereo PCM of feed(write) as a raw ADTS stream, one packet per AAC frame."""
+    _pipe_pcm(["ffmpeg", "-y", "-loglevel", "error"] + _pcm_input_args(sample_rate) + ["-c:a", "aac", "-b:a", "192k", "-f", "adts", output],
+              "audio_encode", feed)
+    return check_output(output)
+
+def trim_adts(src, dst, skip, count=None):
+    """Copy ADTS frames skip to skip + count (to the end without count) of src to dst. Returns frames copied."""
+    copied = index = 0
+    with open(src, "rb") as f, open(dst, "wb") as out:
+        while count is None or copied < count:
+            header = f.read(7)
+            if len(header) < 7:
+                break
+            if header[0] != 0xFF or header[1] & 0xF0 != 0xF0:
+                raise ValueError(f"Not an ADTS stream: {src}")
+            frame = header + f.read((((header[3] & 3) << 11) | (header[4] << 3) | (header[5] >> 5)) - 7)
+            if index >= skip:
+                out.write(frame)
+                copied += 1
+            index += 1
+    return copied
+
+@trace.traced()
+def mux_copy(video, audio_file, output):
+    """Mux an already concatenated video with an encoded audio file, both stream-copied."""
+    supervisor.run(["ffmpeg", "-y", "-i", video, "-i", audio_file, "-map", "0:v:0", "-map", "1:a:0", "-c", "copy", "-shortest", output],
+                   "mux")
+    return check_output(output)
+
+@trace.traced()
+def mux_chunks(video_input, chunks, output, temp_dir, video_gaps=None, sample_rate=48000):
+    """Stream-copy mux of the video input with the ADTS chunks played back to back.
+
+    The chunks are frame-exact pieces of one AAC stream (see
+    IncrementalEncoder), so they are joined byte for byte. Shifting the
+    audio back by one frame makes the mp4 muxer write an edit list that
+    skips the stream's priming frame, as it does when it encodes the audio.
+    """
+    audio_file = os.path.join(temp_dir, "audio_chunks.aac")
+    with open(audio_file, "wb") as out:
+        for chunk in chunks:
+            with open(chunk, "rb") as f: shutil.copyfileobj(f, out)
+    supervisor.run(["ffmpeg", "-y"] + video_input + ["-itsoffset", f"{-AAC_FRAME / sample_rate:.6f}", "-i", audio_file,
+                    "-map", "0:v:0", "-map", "1:a:0", "-c", "copy", "-bsf:a", "aac_adtstoasc", "-shortest"] + gap_bsf_args(video_gaps) + [output],
+                   "mux")
+    return check_output(output)
+
+@trace.traced()
+def mux(video_input, output, audio, sys_volume, mic_volume, temp_dir, pipe_audio=True, timings=None, video_gaps=None, progress=None, gain=None):
+    """Mux the video input with the mixed audio of an AudioRecorder or AudioTake.
+
+    video_input is a list of ffmpeg input arguments, e.g. ["-i", path] or a
+    concat demuxer input. With pipe_audio the mixer streams raw PCM into
+    ffmpeg's stdin, so mixing and AAC encoding overlap and no combined WAV is
+    written. Otherwise the mix is written to temp_dir first and read back.
+    video_gaps are closed on the fly with gap_bsf_args(); gain from
+    audio.mix_gain() saves the mixer's peak pass.
+    """
+    timings = {} if timings is None else timings
+    cmd = ["ffmpeg", "-y"] + video_input
+    bsf = gap_bsf_args(video_gaps)
+    start = time.perf_counter()
+    if not audio.has_audio():
+        supervisor.run(cmd + ["-c", "copy"] + bsf + [output], "mux")
+        timings['mux_s'] = time.perf_counter() - start
+        return check_output(output)
+
+    if not pipe_audio:
+        temp_a = audio.combine_audio_segments(os.path.join(temp_dir, "combined_a.wav"), sys_volume, mic_volume)
+        timings['mix_s'] = time.perf_counter() - start
+        start = time.perf_counter()
+        if temp_a and os.path.exists(temp_a):
+            cmd += ["-i", temp_a] + _audio_output_args()
+        else:
+            cmd += ["-c", "copy"]
+        supervisor.run(cmd + bsf + [output], "mux")
+        timings['mux_s'] = time.perf_counter() - start
+        return check_output(output)
+
+    _pipe_pcm(cmd + _pcm_input_args(audio.sample_rate) + _audio_output_args() + bsf + [output], "mux",
+              _mix_feed(audio, sys_volume, mic_volume, progress, gain))
+    timings['mux_s'] = time.perf_counter() - start
+    return check_output(output)
+
+def run_stages(stages, max_workers=4):
+    """Run stages {name: (fn, deps)} as a dependency graph on a thread pool.
+
+    Each stage starts as soon as its deps have finished; fn gets the dict of
+    results so far. Returns (results, spans) with spans[name] = (start, end)
+    in seconds from the start of the graph. The first failing stage's
+    exception is raised once the stages already running have finished.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    results, spans, running = {}, {}, {}
+    pending = dict(stages)
+    started = time.perf_counter()
+
+    def timed(name, fn):
+        begin = time.perf_counter() - started
+        try:
+            with trace.span(f"stage {name}"): return fn(results)
+        finally: spans[name] = (begin, time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name in [n for n, (_, deps) in pending.items() if all(d in results for d in deps)]:
+                # Each stage runs in a copy of this context, so supervisor.scope() sees its children
+                running[pool.submit(contextvars.copy_context().run, timed, name, pending.pop(name)[0])] = name
+            if not running:
+                raise ValueError(f"Unsatisfiable stage dependencies: {sorted(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results, spans
+
+def critical_path(stages, spans):
+    """The chain of stages, each waiting on the previous, that ends last."""
+    name = max(spans, key=lambda n: spans[n][1])
+    path = [name]
+    while stages[name][1]:
+        name = max(stages[name][1], key=lambda n: spans[n][1])
+        path.append(name)
+    return path[::-1]
+
+def finalize_stages(video_segments, output, audio, sys_volume, mic_volume, temp_dir, pipe_audio=True,
+                    video_gaps=None, progress=None, parallel_video=False, incremental=None):
+    """The finalize graph for this recording as {name: (fn, deps)}.
+
+    Default: the mixer's peak pass (audio_gain) runs next to writing the
+    concat list, then one ffmpeg pass (mux) reads the concat list as its
+    video input while the second mixer pass pipes PCM into it. With
+    parallel_video the video is concatenated to its own file concurrently
+    with mixing and AAC-encoding the audio, and a final stream-copy mux joins
+    them; that writes the video twice but takes the audio off the video's
+    path. Without pipe_audio the mix goes to combined_a.wav first. With an
+    IncrementalEncoder that followed the recording, only the last period is
+    encoded (audio_chunks) and the mux stream-copies everything.
+    """
+    list_file = os.path.join(temp_dir, "video_list.txt")
+    stages = {'concat_list': (lambda r: write_concat_list(video_segments, list_file), ())}
+    video_input = ["-f", "concat", "-safe", "0", "-i", list_file]
+    if not audio.has_audio():
+        stages['mux'] = (lambda r: mux(video_input, output, audio, sys_volume, mic_volume, temp_dir, video_gaps=video_gaps), ('concat_list',))
+    elif incremental is not None:
+        def mux_incremental(r):
+            if r['audio_chunks'] is None:
+                return mux(video_input, output, audio, sys_volume, mic_volume, temp_dir, video_gaps=video_gaps, progress=progress)
+            return mux_chunks(video_input, r['audio_chunks'], output, temp_dir, video_gaps, audio.sample_rate)
+        stages['audio_chunks'] = (lambda r: incremental.finish(audio, progress), ())
+        stages['mux'] = (mux_incremental, ('concat_list', 'audio_chunks'))
+    elif not pipe_audio:
+        stages['audio_mix'] = (lambda r: audio.combine_audio_segments(os.path.join(temp_dir, "combined_a.wav"), sys_volume, mic_volume), ())
+        stages['mux'] = (lambda r: mux(video_input, output, audio, sys_volume, mic_volume, temp_dir, False, video_gaps=video_gaps),
+                         ('concat_list', 'audio_mix'))
+    elif parallel_video:
+        combined_v, combined_a = os.path.join(temp_dir, "combined_v.mp4"), os.path.join(temp_dir, "combined_a.m4a")
+        stages['video_concat'] = (lambda r: concat_video(video_segments, list_file, combined_v, video_gaps), ('concat_list',))
+        stages['audio_gain'] = (lambda r: audio.mix_gain(sys_volume, mic_volume), ())
+        stages['audio_encode'] = (lambda r: encode_audio(audio, combined_a, sys_volume, mic_volume, progress, r['audio_gain']), ('audio_gain',))
+        stages['mux'] = (lambda r: mux_copy(combined_v, combined_a, output), ('video_concat', 'audio_encode'))
+    else:
+        stages['audio_gain'] = (lambda r: audio.mix_gain(sys_volume, mic_volume), ())
+        stages['mux'] = (lambda r: mux(video_input, output, audio, sys_volume, mic_volume, temp_dir, True,
+                                       video_gaps=video_gaps, progress=progress, gain=r['audio_gain']),
+                         ('concat_list', 'audio_gain'))
+    return stages
+
+@trace.traced()
+def finalize_recording(video_segments, output, audio, sys_volume, mic_volume, temp_dir, pipe_audio=True, video_gaps=None, progress=None,
+                       parallel_video=False, incremental=None):
+    """Run the finalize graph. Returns {'stages': {name: {start_s, duration_s}}, 'critical_path': [...], 'total_s'}."""
+    stages = finalize_stages(video_segments, output, audio, sys_volume, mic_volume, temp_dir, pipe_audio, video_gaps, progress,
+                             parallel_video, incremental)
+    _, spans = run_stages(stages)
+    path = critical_path(stages, spans)
+    timings = {
+        'stages': {n: {'start_s': round(b, 3), 'duration_s': round(e - b, 3)} for n, (b, e) in sorted(spans.items(), key=lambda kv: kv[1])},
+        'critical_path': path,
+        'total_s': round(max(e for _, e in spans.values()), 3),
+    }
+    print("[FINALIZE] " + ", ".join(f"{n} {t['start_s']:.2f}+{t['duration_s']:.2f}s" for n, t in timings['stages'].items())
+          + f"; critical path: {' > '.join(path)}; total {timings['total_s']:.2f}s")
+    return timings
+
+class FinalizeJob:
+    """Everything needed to finalize one recording, detached from the live recorder.
+
+    The job owns work_dir (the video segments) and the AudioTake's temp dir
+    and removes both once the output has been written.
+    """
+
+    def __init__(self, video_segments, audio, output, work_dir, sys_volume, mic_volume, pipe_audio=True, video_gaps=None, video_stats=None, extra_metrics=None,
+                 parallel_video=False, incremental=None, trace_since=None):
+        self.video_segments = list(video_segments)
+        self.audio = audio
+        self.output = output
+        self.work_dir = work_dir
+        self.sys_volume = sys_volume
+        self.mic_volume = mic_volume
+        self.pipe_audio = pipe_audio
+        self.parallel_video = parallel_video
+        self.incremental = incremental
+        # With tracing on: where this recording's trace starts (trace.now() value)
+        self.trace_since = trace_since
+        self.video_gaps = list(video_gaps or [])
+        self.video_stats = list(video_stats or [])
+        self.extra_metrics = dict(extra_metrics or {})
+        self.status = "queued"
+        self.progress = 0.0
+        self.timings = None
+        self.error = None
+        self.children = []
+
+    def run(self, progress=None):
+        try:
+            with trace.span("finalize job", output=os.path.basename(self.output)), supervisor.scope() as self.children:
+                self.timings = finalize_recording(
+                    self.video_segments, self.output, self.audio, self.sys_volume, self.mic_volume,
+                    self.work_dir, self.pipe_audio, self.video_gaps, progress, self.parallel_video, self.incremental
+                )
+            # Only a file that is really there counts as saved; otherwise the files stay for recovery
+            check_output(self.output)
+            self.write_metrics()
+            self.status = "done"
+        finally:
+            self.write_trace()
+
+    def write_metrics(self):
+        """Capture telemetry and finalize timings as a JSON sidecar next to the output."""
+        sections = dict(self.extra_metrics, finalize=self.timings)
+        if self.video_stats:
+            sections['video'] = self.video_stats
+        audio_metrics = self.audio.metrics_snapshot()
+        if audio_metrics:
+            sections['audio'] = audio_metrics
+        if self.incremental is not None:
+            inc = self.incremental
+            sections['incremental'] = {'chunks': len(inc.chunks), 'reencoded': inc.reencoded, 'failed': inc.failed}
+        if self.children:
+            sections['ffmpeg'] = [c.summary() for c in self.children]
+        try: write_sidecar(self.output, sections)
+        except OSError as e: print(f"[FINALIZE] Could not write metrics: {e}")
+
+    def write_trace(self):
+        """The recording's spans, from the input that started it to now, as recording_X.trace.json."""
+        if self.trace_since is None or not trace.enabled():
+            return
+        try: trace.export(trace.trace_path(self.output), self.trace_since)
+        except OSError as e: print(f"[FINALIZE] Could not write trace: {e}")
+
+    def cleanup(self):
+        self.audio.cleanup()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+class FinalizeWorker:
+    """Runs finalize jobs one after another on a background thread.
+
+    on_update(job) is called from the worker thread whenever a job changes
+    status or makes progress; UI callers should marshal it with root.after.
+    """
+
+    def __init__(self, on_update=None):
+        self.on_update = on_update
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, job):
+        self._notify(job)
+        self._queue.put(job)
+        return job
+
+    @property
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def wait(self):
+        """Block until every submitted job has finished."""
+        self._queue.join()
+
+    def _notify(self, job):
+        if self.on_update:
+            try: self.on_update(job)
+            except Exception as e: print(f"[FINALIZE] Update callback failed: {e}")
+
+    def _progress(self, job, fraction):
+        job.progress = fraction
+        self._notify(job)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.status = "running"
+                self._notify(job)
+                job.run(lambda fraction: self._progress(job, fraction))
+            except Exception as e:
+                print(f"Merge error: {e}")
+                job.status = "failed"; job.error = e
+            finally:
+                # A failed job keeps its files for python -m recorder.recover
+                if job.status == "done" and os.path.isfile(job.output): job.cleanup()
+                else: print(f"[FINALIZE] Kept {job.work_dir} for recovery")
+                self._notify(job)
+                self._queue.task_done()
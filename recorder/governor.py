@@ -0,0 +1,138 @@
+"""
+Adaptive capture governor: steps fps, encoder preset and scale to keep capture real-time.
+
+The governor walks a ladder of capture settings, from the requested quality
+down to the cheapest. It is ticked about once a second while recording and
+samples system CPU, the capture ffmpeg's CPU (psutil) and the encoder's
+speed. It steps down after a few slow samples and back up after a longer
+stretch of headroom. fps and preset changes take effect by restarting the
+capture at a segment boundary. Scale changes the frame size, which the
+stream-copy concat at finalize cannot mix, so they are deferred to the next
+recording. Every decision is printed and kept in decisions.
+"""
+
+import time
+
+from .video import ENCODER_PRESETS
+
+SLOW_SPEED = 0.95
+BUSY_CPU = 90
+IDLE_CPU = 60
+# Consecutive samples before stepping down / back up
+DOWN_AFTER = 3
+UP_AFTER = 15
+# Samples right after a (re)start are skipped while ffmpeg warms up
+SETTLE_S = 3
+SCALES = (0.75, 0.5)
+
+def build_ladder(fps, encoder, preset=None):
+    """Capture settings as (fps, preset, scale), from the requested quality to the cheapest.
+
+    preset is the starting (e.g. calibrated) preset; only faster ones follow it.
+    """
+    presets = ENCODER_PRESETS.get(encoder, ())
+    faster = presets[presets.index(preset) + 1:] if preset in presets else presets
+    ladder = [(fps, preset, 1.0)]
+    ladder += [(fps, p, 1.0) for p in faster]
+    preset = ladder[-1][1]
+    if fps > 30:
+        ladder.append((30, preset, 1.0))
+    ladder += [(min(fps, 30), preset, scale) for scale in SCALES]
+    return ladder
+
+class CaptureGovernor:
+    def __init__(self, fps, encoder, preset=None):
+        self.base = (fps, encoder, preset)
+        self.ladder = build_ladder(fps, encoder, preset)
+        self.level = 0
+        self.target = 0
+        self.decisions = []
+        self._take_scale = 1.0
+        self._slow = 0
+        self._calm = 0
+        self._settle_until = 0
+        self._proc = None
+        self._last = None
+
+    @property
+    def settings(self):
+        return self.ladder[self.level]
+
+    def start_take(self):
+        """Apply any deferred step (including scale) and reset the sampling state."""
+        self.decisions = []
+        if self.target != self.level:
+            self._log("apply", self.level, self.target, "deferred to the start of a recording")
+            self.level = self.target
+        self._take_scale = self.settings[2]
+        self.restarted()
+
+    def restarted(self):
+        """Forget the interval samples, e.g. after a restart or a resume."""
+        self._slow = self._calm = 0
+        self._settle_until = time.perf_counter() + SETTLE_S
+        self._proc = None
+        self._last = None
+
+    def sample(self, capture):
+        """(speed, system CPU %, ffmpeg CPU %) right now; speed is None until ffmpeg reports."""
+        import psutil
+        system = psutil.cpu_percent(None)
+        ffmpeg = None
+        if capture.process:
+            try:
+                if self._proc is None or self._proc.pid != capture.process.pid:
+                    self._proc = psutil.Process(capture.process.pid)
+                    self._proc.cpu_percent(None)
+                ffmpeg = self._proc.cpu_percent(None)
+            except psutil.Error:
+                self._proc = None
+        # Frames delivered over the last interval vs. the target rate; ffmpeg's own
+        # speed stays near 1.0x for wall-clock stamped captures
+        progress, now = capture.progress, time.perf_counter()
+        speed = None
+        if progress.get('frame'):
+            if self._last and now > self._last[0]:
+                speed = (progress['frame'] - self._last[1]) / (now - self._last[0]) / self.settings[0]
+            self._last = (now, progress['frame'])
+        return speed, system, ffmpeg
+
+    def tick(self, capture):
+        """Sample and maybe move on the ladder. Returns True if the capture must be restarted."""
+        speed, system, ffmpeg = self.sample(capture)
+        if speed is None or time.perf_counter() < self._settle_until:
+            return False
+        reason = {'speed': round(speed, 3), 'cpu': system, 'ffmpeg_cpu': ffmpeg}
+        # A pegged CPU only counts once the capture is at the edge of real time
+        busy = speed < SLOW_SPEED or (system > BUSY_CPU and speed < 1.0)
+        self._slow = self._slow + 1 if busy else 0
+        self._calm = self._calm + 1 if speed >= 1.0 and system < IDLE_CPU else 0
+        if self._slow >= DOWN_AFTER and self.target < len(self.ladder) - 1:
+            return self._move(self.target + 1, "step down", reason)
+        if self._calm >= UP_AFTER and self.target > 0:
+            return self._move(self.target - 1, "step up", reason)
+        return False
+
+    def _move(self, target, action, reason):
+        self._slow = self._calm = 0
+        previous, self.target = self.target, target
+        if target == self.level:
+            self._log(action, previous, target, "deferred step cancelled", reason)
+            return False
+        if self.ladder[target][2] != self._take_scale:
+            self._log(action, previous, target, "scale change deferred to the next recording", reason)
+            return False
+        self._log(action, self.level, target, "restart capture", reason)
+        self.level = target
+        return True
+
+    def _log(self, action, level, target, note, reason=None):
+        fps, preset, scale = self.ladder[target]
+        entry = {
+            'time': round(time.time(), 3), 'action': action, 'from': level, 'to': target,
+            'fps': fps, 'preset': preset, 'scale': scale, 'note': note,
+        }
+        if reason: entry.update(reason)
+        self.decisions.append(entry)
+        print(f"[GOVERNOR] {action}: level {level} -> {target} ({fps} fps, preset {preset or 'default'}, scale {scale}), "
+              f"{note}" + (f"; speed {reason['speed']}x, cpu {reason['cpu']}%, ffmpeg {reason['ffmpeg_cpu']}%" if reason else ""))
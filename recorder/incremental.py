@@ -0,0 +1,175 @@
+"""
+Incremental finalize: mix and AAC-encode the audio of each closed period while recording continues.
+
+Every pause closes a system/mic WAV pair that never changes again. A
+background thread mixes each closed pair and encodes it to an ADTS chunk,
+so at Stop only the last open period is left to encode and the mux
+stream-copies video and audio chunks (see finalize.mux_chunks).
+
+Chunks are cut on AAC frame boundaries of the whole recording's PCM, so
+joined they hold as many packets as one encode of the whole take, with
+no priming or padding at the joins. A chunk's encode starts a few frames
+before its first packet, on PCM carried over from the previous period,
+and drops the priming and warm-up packets; all but the last chunk stop a
+few packets short of the end of their PCM, and the PCM left over goes to
+the next chunk.
+
+The whole-recording mix is peak normalized with one gain, which is only
+known at the end. Each chunk is encoded with the gain of the loudest
+period so far, and chunks whose gain ends up more than GAIN_TOLERANCE_DB
+off the final gain are re-encoded at Stop, in parallel.
+"""
+
+import math
+import os
+import threading
+
+from . import trace
+
+POLL_S = 0.5
+GAIN_TOLERANCE_DB = 0.5
+REENCODE_WORKERS = 4
+# AAC frames encoded on each side of a chunk and dropped: the encoder picks
+# each frame's window from its neighbours, and a join only decodes cleanly
+# when both chunks picked the windows one encode of the whole take would
+OVERLAP_FRAMES = 2
+
+class _ChunkFeed:
+    """write() for one chunk's int16 PCM blocks: passes the first limit frames to out and keeps the last keep frames of all."""
+
+    def __init__(self, limit, keep):
+        import numpy as np
+        self.out = None
+        self.limit = limit
+        self.keep = keep
+        self.passed = 0
+        self.tail = np.zeros((0, 2), dtype=np.int16)
+
+    def __call__(self, block):
+        import numpy as np
+        take = min(len(block), self.limit - self.passed)
+        if take > 0:
+            self.out(block[:take])
+            self.passed += take
+        self.tail = np.concatenate((self.tail, block[-self.keep:]))[-self.keep:]
+
+class IncrementalEncoder:
+    """Follows an AudioRecorder's closed periods and encodes them in work_dir.
+
+    stop() ends the polling (before the recorder's take is detached);
+    finish(take) encodes the rest of the take and returns the chunk files.
+    """
+
+    def __init__(self, recorder, work_dir, sys_volume, mic_volume):
+        import numpy as np
+        from .finalize import AAC_FRAME
+        self.recorder = recorder
+        self.work_dir = work_dir
+        self.sys_volume = sys_volume
+        self.mic_volume = mic_volume
+        self.chunks = []
+        self.peak = 0.0
+        self.failed = False
+        self.reencoded = 0
+        # PCM the next chunk is encoded from, and the gain it was mixed at;
+        # before the first chunk silence, standing in for the priming
+        self._head = np.zeros(((1 + OVERLAP_FRAMES) * AAC_FRAME, 2), dtype=np.int16)
+        self._head_gain = 1.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(POLL_S) and not self.failed:
+            with self._lock:
+                if self._stopped.is_set():
+                    return
+                take = self.recorder.current_take()
+                periods = [take.slice(i, i + 1) for i in range(len(self.chunks), self.recorder.closed_periods())]
+            for period in periods:
+                try:
+                    self._encode_chunk(period)
+                except Exception as e:
+                    print(f"[INCREMENTAL] Chunk {len(self.chunks)} failed, finalize will mix everything at Stop: {e}")
+                    self.failed = True
+                    return
+
+    def _encode_chunk(self, take, peak=None, gain=None, progress=None, last=False):
+        from .mixer import normalization_gain
+        if peak is None:
+            peak = take.mix_peak(self.sys_volume, self.mic_volume)
+        self.peak = max(self.peak, peak)
+        gain = gain or normalization_gain(self.peak)
+        chunk = {'take': take, 'path': os.path.join(self.work_dir, f"audio_chunk_{len(self.chunks):04d}.aac"), 'peak': peak,
+                 'gain': gain, 'head': self._head, 'head_gain': self._head_gain, 'last': last}
+        self._head = self._encode(chunk, gain, progress)
+        self._head_gain = gain
+        self.chunks.append(chunk)
+        print(f"[INCREMENTAL] Encoded chunk {len(self.chunks) - 1} (gain {20 * math.log10(gain):+.1f} dB)")
+
+    def _encode(self, chunk, gain, progress=None):
+        """Encode chunk at gain into chunk['path']. Returns the PCM the next chunk starts from."""
+        import numpy as np
+        from .finalize import AAC_FRAME, encode_adts, trim_adts
+        take, head = chunk['take'], chunk['head']
+        if gain != chunk['head_gain']:
+            head = np.clip(np.rint(head * (gain / chunk['head_gain'])), -32768, 32767).astype(np.int16)
+        total = len(head) + take.mix_frames()
+        # The priming and warm-up packets are dropped. All but the last chunk
+        # stop at a whole frame and drop the packet the encoder pads and the
+        # look-ahead before it; that PCM is encoded again by the next chunk
+        limit = total if chunk['last'] else total // AAC_FRAME * AAC_FRAME
+        count = None if chunk['last'] else limit // AAC_FRAME - 1 - 2 * OVERLAP_FRAMES
+        pcm = _ChunkFeed(limit, (2 + 2 * OVERLAP_FRAMES) * AAC_FRAME)
+
+        def feed(write):
+            pcm.out = write
+            pcm(head)
+            take.stream_audio_segments(pcm, self.sys_volume, self.mic_volume, progress, gain)
+
+        encoded = chunk['path'] + ".full"
+        encode_adts(feed, encoded, take.sample_rate)
+        trim_adts(encoded, chunk['path'], 1 + OVERLAP_FRAMES, count)
+        os.remove(encoded)
+        if count is not None:
+            return pcm.tail[len(pcm.tail) - (total - max(count, 0) * AAC_FRAME):]
+
+    def stop(self):
+        """Stop following the recorder; safe to call from the Tk thread, does not wait for an encode."""
+        with self._lock:
+            self._stopped.set()
+
+    @trace.traced()
+    def finish(self, take, progress=None):
+        """Encode what take has beyond the encoded chunks and fix up off-gain chunks.
+
+        Returns the chunk files in order, or None if incremental encoding
+        failed and the caller should mix the whole take instead.
+        """
+        import contextvars
+        from concurrent.futures import ThreadPoolExecutor
+        from .mixer import normalization_gain
+        self.stop()
+        self._thread.join()
+        if self.failed:
+            return None
+        rest = take.slice(len(self.chunks))
+        rest_peak = rest.mix_peak(self.sys_volume, self.mic_volume) if rest.has_audio() else 0.0
+        gain = normalization_gain(max(self.peak, rest_peak))
+        stale = [c for c in self.chunks if abs(20 * math.log10(c['gain'] / gain)) > GAIN_TOLERANCE_DB]
+
+        def reencode(chunk):
+            self._encode(chunk, gain)
+            chunk['gain'] = gain
+
+        with ThreadPoolExecutor(max_workers=REENCODE_WORKERS) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, reencode, c) for c in stale]
+            # Always a last chunk: it ends the stream with the frames carried over
+            self._encode_chunk(rest, rest_peak, gain, progress, last=True)
+            for future in futures:
+                future.result()
+        self.reencoded = len(stale)
+        if stale:
+            print(f"[INCREMENTAL] Re-encoded {len(stale)} of {len(self.chunks)} chunks at the final gain")
+        return [c['path'] for c in self.chunks]
@@ -0,0 +1,117 @@
+"""
+Capture telemetry: per-stream counters, chunk duration histograms and clock drift.
+
+Counters are updated from the capture threads (including the PortAudio
+callback) without locking; snapshot() is safe to call from any thread and
+returns plain dicts ready for JSON.
+"""
+
+import bisect
+import json
+import os
+import time
+
+# Upper bounds of the duration histogram buckets, in milliseconds
+DURATION_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)
+
+class Histogram:
+    """Fixed-bucket histogram of durations in milliseconds."""
+
+    def __init__(self, bounds=DURATION_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max: self.max = ms
+
+    def snapshot(self):
+        buckets = {f"le_{b}ms": c for b, c in zip(self.bounds, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count, 3) if self.count else 0,
+            'max_ms': round(self.max, 3),
+            'buckets': buckets,
+        }
+
+class StreamMetrics:
+    """Telemetry for one capture stream.
+
+    Drift compares wall-clock time spent capturing (between active() and
+    idle()) with the time covered by the samples captured: a positive drift
+    means audio was lost or never delivered.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.sample_rate = 0
+        self.samples = 0
+        self.chunks = 0
+        self.overflows = 0
+        self.underflows = 0
+        self.errors = 0
+        self.queue_depth = 0
+        self.queue_high_water = 0
+        self.durations = Histogram()
+        self._active_s = 0.0
+        self._active_since = None
+
+    def active(self, sample_rate):
+        self.sample_rate = sample_rate
+        if self._active_since is None:
+            self._active_since = time.perf_counter()
+
+    def idle(self):
+        if self._active_since is not None:
+            self._active_s += time.perf_counter() - self._active_since
+            self._active_since = None
+
+    def chunk(self, frames, seconds, queue_depth=None):
+        """Count one captured chunk and how long its read or callback took."""
+        self.samples += frames
+        self.chunks += 1
+        self.durations.record(seconds * 1000)
+        if queue_depth is not None:
+            self.queue_depth = queue_depth
+            if queue_depth > self.queue_high_water: self.queue_high_water = queue_depth
+
+    def wall_seconds(self):
+        running = time.perf_counter() - self._active_since if self._active_since is not None else 0.0
+        return self._active_s + running
+
+    def drift_ms(self):
+        if not self.sample_rate:
+            return 0.0
+        return (self.wall_seconds() - self.samples / self.sample_rate) * 1000
+
+    def snapshot(self):
+        return {
+            'samples': self.samples,
+            'sample_rate': self.sample_rate,
+            'chunks': self.chunks,
+            'overflows': self.overflows,
+            'underflows': self.underflows,
+            'errors': self.errors,
+            'queue_depth': self.queue_depth,
+            'queue_high_water': self.queue_high_water,
+            'wall_s': round(self.wall_seconds(), 3),
+            'drift_ms': round(self.drift_ms(), 1),
+            'durations': self.durations.snapshot(),
+        }
+
+def sidecar_path(output):
+    """recording_X.mp4 -> recording_X.metrics.json"""
+    return os.path.splitext(output)[0] + ".metrics.json"
+
+def write_sidecar(output, sections):
+    """Write the telemetry sections (name -> dict) next to the recording. Returns the path."""
+    path = sidecar_path(output)
+    with open(path, "w") as f:
+        json.dump(dict(sections, recording=os.path.basename(output)), f, indent=2)
+    return path
@@ -0,0 +1,286 @@
+"""
+NumPy audio mixing engine used when finalizing a recording.
+
+Tracks are laid out in a preallocated float32 buffer (int16 scale) and every
+step - gain, delay padding, mixing and peak normalization - runs in place.
+For long sessions the streaming functions mix the same way one fixed-size
+window at a time, so memory use does not depend on recording length.
+"""
+
+import wave
+import numpy as np
+
+CHANNELS = 2
+NORMALIZE_HEADROOM_DB = 0.1
+WRITE_BLOCK_FRAMES = 65536
+STREAM_BLOCK_FRAMES = 48000 * 5
+
+class Track:
+    """A list of WAV segments played back to back with one gain.
+
+    lead_in_ms of silence is inserted before every segment.
+    """
+
+    def __init__(self, paths, gain=1.0, lead_in_ms=0):
+        self.paths = list(paths)
+        self.gain = gain
+        self.lead_in_ms = lead_in_ms
+
+def _resampled_length(frames, src_rate, dst_rate):
+    if src_rate == dst_rate:
+        return frames
+    return frames * dst_rate // src_rate
+
+def _pcm_to_float(raw, sample_width, channels):
+    if sample_width == 2:
+        samples = np.frombuffer(raw, dtype='<i2')
+    elif sample_width == 4:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 65536
+    elif sample_width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) * 256
+    else:
+        raise ValueError(f"Unsupported sample width: {sample_width}")
+    samples = samples.astype(np.float32, copy=False).reshape(-1, channels)
+    if channels == CHANNELS:
+        return samples
+    if channels == 1:
+        return np.repeat(samples, CHANNELS, axis=1)
+    return samples[:, :CHANNELS]
+
+def _resample(samples, src_rate, dst_rate):
+    """Linear-interpolation resample of a (frames, channels) array."""
+    if src_rate == dst_rate or not len(samples):
+        return samples
+    out_len = _resampled_length(len(samples), src_rate, dst_rate)
+    positions = np.arange(out_len, dtype=np.float64) * (src_rate / dst_rate)
+    source = np.arange(len(samples), dtype=np.float64)
+    out = np.empty((out_len, samples.shape[1]), dtype=np.float32)
+    for ch in range(samples.shape[1]):
+        out[:, ch] = np.interp(positions, source, samples[:, ch])
+    return out
+
+def wav_length(path, sample_rate):
+    """Number of frames a segment occupies once resampled to sample_rate."""
+    with wave.open(path, 'rb') as wf:
+        return _resampled_length(wf.getnframes(), wf.getframerate(), sample_rate)
+
+def read_wav(path, sample_rate):
+    """Load a WAV segment as float32 stereo frames at sample_rate."""
+    with wave.open(path, 'rb') as wf:
+        channels = wf.getnchannels()
+        sample_width = wf.getsampwidth()
+        rate = wf.getframerate()
+        raw = wf.readframes(wf.getnframes())
+    samples = _pcm_to_float(raw, sample_width, channels)
+    return _resample(samples, rate, sample_rate)
+
+def track_length(track, sample_rate):
+    lead_in = track.lead_in_ms * sample_rate // 1000
+    return sum(lead_in + wav_length(p, sample_rate) for p in track.paths)
+
+def mix_tracks(tracks, sample_rate):
+    """Mix tracks into one preallocated float32 (frames, 2) buffer."""
+    total = max((track_length(t, sample_rate) for t in tracks), default=0)
+    mixed = np.zeros((total, CHANNELS), dtype=np.float32)
+    for track in tracks:
+        lead_in = track.lead_in_ms * sample_rate // 1000
+        offset = 0
+        for path in track.paths:
+            offset += lead_in
+            samples = read_wav(path, sample_rate)
+            if track.gain != 1.0:
+                np.multiply(samples, track.gain, out=samples)
+            end = offset + len(samples)
+            mixed[offset:end] += samples
+            offset = end
+    return mixed
+
+def normalization_gain(peak, headroom_db=NORMALIZE_HEADROOM_DB):
+    """Gain that brings peak to full scale minus headroom (same as pydub's normalize)."""
+    if peak <= 0:
+        return 1.0
+    return 32768 * 10 ** (-headroom_db / 20) / peak
+
+def normalize(mixed, headroom_db=NORMALIZE_HEADROOM_DB):
+    """Peak-normalize the buffer in place."""
+    if not len(mixed):
+        return mixed
+    peak = max(float(mixed.max()), -float(mixed.min()))
+    np.multiply(mixed, normalization_gain(peak, headroom_db), out=mixed)
+    return mixed
+
+def _to_pcm(block, pcm, gain=1.0):
+    """Scale, clip and convert a float32 block into the int16 scratch buffer."""
+    if gain != 1.0:
+        np.multiply(block, gain, out=block)
+    np.clip(block, -32768, 32767, out=block)
+    out = pcm[:len(block)]
+    out[:] = block
+    return out
+
+def _open_output(path, sample_rate):
+    wf = wave.open(path, 'wb')
+    wf.setnchannels(CHANNELS)
+    wf.setsampwidth(2)
+    wf.setframerate(sample_rate)
+    return wf
+
+def write_wav(path, mixed, sample_rate):
+    """Write float32 frames as 16-bit PCM, converting one block at a time."""
+    pcm = np.empty((min(WRITE_BLOCK_FRAMES, len(mixed)), CHANNELS), dtype=np.int16)
+    with _open_output(path, sample_rate) as wf:
+        for start in range(0, len(mixed), WRITE_BLOCK_FRAMES):
+            wf.writeframesraw(_to_pcm(mixed[start:start + WRITE_BLOCK_FRAMES], pcm))
+    return path
+
+def mix_to_wav(output_path, tracks, sample_rate):
+    """Mix, normalize and write tracks. Returns output_path, or None if there is no audio."""
+    mixed = mix_tracks(tracks, sample_rate)
+    if not len(mixed):
+        return None
+    normalize(mixed)
+    return write_wav(output_path, mixed, sample_rate)
+
+class _SegmentReader:
+    """Block reader for one WAV segment, resampled to sample_rate on the fly."""
+
+    def __init__(self, path, sample_rate):
+        self._wf = wave.open(path, 'rb')
+        self._channels = self._wf.getnchannels()
+        self._sample_width = self._wf.getsampwidth()
+        self._src_rate = self._wf.getframerate()
+        self._src_frames = self._wf.getnframes()
+        self._step = self._src_rate / sample_rate
+        self._resampling = self._src_rate != sample_rate
+        self.length = _resampled_length(self._src_frames, self._src_rate, sample_rate)
+        self._pos = 0
+        # Source frames read but still needed for interpolation, starting at _src_start
+        self._src = np.zeros((0, CHANNELS), dtype=np.float32)
+        self._src_start = 0
+
+    def _read_source(self, frames):
+        raw = self._wf.readframes(frames)
+        return _pcm_to_float(raw, self._sample_width, self._channels)
+
+    def read(self, frames):
+        """Return up to frames float32 stereo frames; an empty array at the end."""
+        frames = min(frames, self.length - self._pos)
+        if frames <= 0:
+            return self._src[:0]
+        if not self._resampling:
+            self._pos += frames
+            return self._read_source(frames)
+
+        positions = (self._pos + np.arange(frames, dtype=np.float64)) * self._step
+        last = int(positions[-1])
+        needed = min(last + 2, self._src_frames)
+        have = self._src_start + len(self._src)
+        if needed > have:
+            self._src = np.concatenate((self._src, self._read_source(needed - have)))
+        positions -= self._src_start
+        source = np.arange(len(self._src), dtype=np.float64)
+        out = np.empty((frames, CHANNELS), dtype=np.float32)
+        for ch in range(CHANNELS):
+            out[:, ch] = np.interp(positions, source, self._src[:, ch])
+        drop = last - self._src_start
+        self._src = self._src[drop:]
+        self._src_start = last
+        self._pos += frames
+        return out
+
+    def close(self):
+        self._wf.close()
+
+class _TrackStream:
+    """Walks a track's lead-ins and segments, adding them into mix windows."""
+
+    def __init__(self, track, sample_rate):
+        self._paths = list(track.paths)
+        self._gain = track.gain
+        self._sample_rate = sample_rate
+        self._lead_in = track.lead_in_ms * sample_rate // 1000
+        self._next = 0
+        self._reader = None
+        self._silence = self._lead_in if self._paths else 0
+
+    def mix_into(self, window):
+        filled = 0
+        while filled < len(window):
+            if self._silence:
+                step = min(self._silence, len(window) - filled)
+                self._silence -= step
+                filled += step
+                continue
+            if self._reader is None:
+                if self._next >= len(self._paths):
+                    break
+                self._reader = _SegmentReader(self._paths[self._next], self._sample_rate)
+                self._next += 1
+            block = self._reader.read(len(window) - filled)
+            if not len(block):
+                self.close()
+                if self._next < len(self._paths):
+                    self._silence = self._lead_in
+                continue
+            if self._gain != 1.0:
+                np.multiply(block, self._gain, out=block)
+            window[filled:filled + len(block)] += block
+            filled += len(block)
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+def iter_mix_windows(tracks, sample_rate, block_frames=STREAM_BLOCK_FRAMES):
+    """Yield the mix as consecutive float32 windows that reuse one buffer."""
+    total = max((track_length(t, sample_rate) for t in tracks), default=0)
+    streams = [_TrackStream(t, sample_rate) for t in tracks]
+    buf = np.empty((block_frames, CHANNELS), dtype=np.float32)
+    try:
+        for start in range(0, total, block_frames):
+            window = buf[:min(block_frames, total - start)]
+            window.fill(0)
+            for stream in streams:
+                stream.mix_into(window)
+            yield window
+    finally:
+        for stream in streams:
+            stream.close()
+
+def stream_peak(tracks, sample_rate, block_frames=STREAM_BLOCK_FRAMES):
+    """First pass of the streaming finalize: peak of the mix, window by window."""
+    peak = 0.0
+    for window in iter_mix_windows(tracks, sample_rate, block_frames):
+        peak = max(peak, float(window.max()), -float(window.min()))
+    return peak
+
+def stream_gain(tracks, sample_rate, block_frames=STREAM_BLOCK_FRAMES):
+    """Normalization gain of the mix, from a streaming peak pass."""
+    return normalization_gain(stream_peak(tracks, sample_rate, block_frames))
+
+def stream_pcm(write, tracks, sample_rate, block_frames=STREAM_BLOCK_FRAMES, progress=None, gain=None):
+    """Normalize the mix and pass it to write() as raw s16le blocks. Returns frames written.
+
+    progress, if given, is called with the fraction of the mix written so far.
+    gain skips the peak pass when stream_gain() was already run.
+    """
+    total = max((track_length(t, sample_rate) for t in tracks), default=0)
+    if gain is None:
+        gain = stream_gain(tracks, sample_rate, block_frames)
+    pcm = np.empty((block_frames, CHANNELS), dtype=np.int16)
+    frames = 0
+    for window in iter_mix_windows(tracks, sample_rate, block_frames):
+        write(_to_pcm(window, pcm, gain))
+        frames += len(window)
+        if progress:
+            progress(frames / total)
+    return frames
+
+def mix_to_wav_streaming(output_path, tracks, sample_rate, block_frames=STREAM_BLOCK_FRAMES):
+    """Out-of-core mix_to_wav: a peak pass and a write pass over block-read segments."""
+    if not max((track_length(t, sample_rate) for t in tracks), default=0):
+        return None
+    with _open_output(output_path, sample_rate) as wf:
+        stream_pcm(wf.writeframesraw, tracks, sample_rate, block_frames)
+    return output_path
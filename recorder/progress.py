@@ -0,0 +1,121 @@
+"""
+Live ffmpeg progress: parses the key=value blocks ffmpeg writes with -progress.
+"""
+
+import threading
+import time
+
+from . import trace
+
+# The encoder has to stay below real time for this many consecutive reports
+# before on_slow fires, so the start-up ramp does not trigger it
+SLOW_REPORTS = 3
+
+def _number(value, suffix=""):
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try: return float(value)
+    except ValueError: return None
+
+def parse_block(fields):
+    """Convert one raw progress block into numbers (None where ffmpeg reports N/A)."""
+    out_time_us = _number(fields.get('out_time_us', ''))
+    return {
+        'frame': int(_number(fields.get('frame', '')) or 0),
+        'fps': _number(fields.get('fps', '')),
+        'bitrate_kbps': _number(fields.get('bitrate', ''), "kbits/s"),
+        'speed': _number(fields.get('speed', ''), "x"),
+        'drop_frames': int(_number(fields.get('drop_frames', '')) or 0),
+        'dup_frames': int(_number(fields.get('dup_frames', '')) or 0),
+        'out_time_s': out_time_us / 1e6 if out_time_us is not None else None,
+    }
+
+class ProgressReader:
+    """Reads an ffmpeg -progress pipe on a background thread.
+
+    latest holds the most recent report (received at time.perf_counter()
+    latest_at). first_frame_at is the time.perf_counter() of the output's
+    timeline zero: the time a report arrived less the out_time it covers,
+    lowest over the reports so far, as the encoder can lag behind the
+    capture. on_update(stats) is called for every
+    report and on_slow(stats) once each time speed drops below slow_speed,
+    both from the reader thread.
+
+    Captures stamped with wall-clock time (gdigrab) always report a speed
+    near 1.0x, because out_time follows the clock even when frames are lost.
+    With target_fps, speed is therefore the frame rate delivered since the
+    previous report divided by target_fps.
+    """
+
+    def __init__(self, pipe, on_update=None, on_slow=None, slow_speed=1.0, target_fps=None):
+        self.on_update = on_update
+        self.on_slow = on_slow
+        self.slow_speed = slow_speed
+        self.target_fps = target_fps
+        self.latest = {}
+        self.latest_at = None
+        self.first_frame_at = None
+        self._last = None
+        self.reports = 0
+        self.slow_alerts = 0
+        self.min_speed = None
+        self._slow_run = 0
+        self._started = time.time()
+        self._pipe = pipe
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        fields = {}
+        try:
+            for line in self._pipe:
+                key, _, value = line.decode(errors="replace").strip().partition("=")
+                if key != "progress":
+                    fields[key] = value
+                    continue
+                self._report(parse_block(fields))
+                fields = {}
+        except (OSError, ValueError):
+            pass
+
+    def _report(self, stats):
+        if self.target_fps:
+            now = time.perf_counter()
+            if self._last and stats['frame'] and now > self._last[0]:
+                stats['encoder_speed'] = stats['speed']
+                stats['speed'] = round((stats['frame'] - self._last[1]) / (now - self._last[0]) / self.target_fps, 3)
+            else:
+                stats['speed'] = None
+            self._last = (now, stats['frame'])
+        if stats['frame'] and stats['out_time_s'] is not None:
+            # Backdated by the timeline covered so far: about when the first
+            # frame was taken, later for a report the encoder is behind on
+            first_frame_at = time.perf_counter() - stats['out_time_s']
+            if self.first_frame_at is None:
+                trace.instant("first frame", trace.now() - int(stats['out_time_s'] * 1e9), frame=stats['frame'])
+            self.first_frame_at = min(first_frame_at, self.first_frame_at or first_frame_at)
+        self.latest = stats
+        self.latest_at = time.perf_counter()
+        self.reports += 1
+        speed = stats['speed']
+        if speed is not None and stats['frame']:
+            self.min_speed = speed if self.min_speed is None else min(self.min_speed, speed)
+            self._slow_run = self._slow_run + 1 if speed < self.slow_speed else 0
+            if self._slow_run == SLOW_REPORTS:
+                self.slow_alerts += 1
+                self._call(self.on_slow, stats)
+        self._call(self.on_update, stats)
+
+    def _call(self, callback, stats):
+        if callback:
+            try: callback(stats)
+            except Exception as e: print(f"[PROGRESS] Callback failed: {e}")
+
+    def join(self, timeout=2):
+        self._thread.join(timeout)
+
+    def summary(self):
+        """The final report plus the worst speed seen, for the per-segment record."""
+        return dict(self.latest, reports=self.reports, min_speed=self.min_speed,
+                    slow_alerts=self.slow_alerts, wall_s=round(time.time() - self._started, 3))
@@ -0,0 +1,151 @@
+"""
+Crash recovery: finalize recordings whose temp dirs were left behind.
+
+While recording, the app keeps a session manifest (session.json) in the
+video temp dir with everything finalize needs. After a crash, or a failed
+finalize, the dirs stay behind; recover() repairs the WAV headers the audio
+writers never patched, drops capture files ffmpeg left unreadable and runs
+the normal finalize on what is left. Rolling fragmented MP4 parts (see
+VideoCapture.segment_seconds) lose at most their last second.
+
+Usage:
+    python -m recorder.recover [--list] [--output-dir DIR] [--keep] [DIR ...]
+"""
+
+import argparse
+import glob
+import json
+import os
+import struct
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+MANIFEST = "session.json"
+VIDEO_DIR_PREFIX = "screen_recorder_video_"
+
+def write_manifest(work_dir, **fields):
+    """Atomically (re)write the session manifest, stamped with this process."""
+    import psutil
+    manifest = dict(fields, pid=os.getpid(), pid_started=psutil.Process().create_time(), updated=time.time())
+    path = os.path.join(work_dir, MANIFEST)
+    try:
+        with open(path + ".tmp", "w") as f: json.dump(manifest, f, indent=2)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"[RECOVER] Could not write {path}: {e}")
+
+def read_manifest(work_dir):
+    try:
+        with open(os.path.join(work_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_orphan(manifest):
+    """True unless the process that wrote the manifest is still running."""
+    import psutil
+    try:
+        return psutil.Process(manifest['pid']).create_time() != manifest['pid_started']
+    except (psutil.Error, KeyError):
+        return True
+
+def find_orphans(root=None):
+    """Video temp dirs under root (the system temp dir) whose recording process is gone."""
+    pattern = os.path.join(root or tempfile.gettempdir(), VIDEO_DIR_PREFIX + "*")
+    orphans = []
+    for work_dir in sorted(glob.glob(pattern)):
+        manifest = read_manifest(work_dir)
+        if manifest and is_orphan(manifest):
+            orphans.append(work_dir)
+    return orphans
+
+def repair_wav(path):
+    """Patch the RIFF and data sizes of a WAV whose writer was never closed. Returns True if patched."""
+    with open(path, "r+b") as f:
+        header = f.read(4096)
+        if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return False
+        pos = 12
+        while pos + 8 <= len(header):
+            chunk, size = header[pos:pos + 4], struct.unpack("<I", header[pos + 4:pos + 8])[0]
+            if chunk == b"data":
+                data = os.path.getsize(path) - pos - 8
+                if size == data:
+                    return False
+                f.seek(4); f.write(struct.pack("<I", pos + data))
+                f.seek(pos + 4); f.write(struct.pack("<I", data))
+                return True
+            pos += 8 + size + (size & 1)
+    return False
+
+def readable(path):
+    """True if ffmpeg can read at least one video frame from path."""
+    from .finalize import NO_WINDOW
+    try:
+        out = subprocess.run(["ffmpeg", "-v", "error", "-i", path, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"],
+                             capture_output=True, text=True, timeout=120, creationflags=NO_WINDOW).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return any(line and not line.startswith("#") for line in out.splitlines())
+
+def salvage_video(segments):
+    """Set aside capture files ffmpeg cannot read; only a capture's last file can be cut short."""
+    from .finalize import segment_parts
+    for segment in segments:
+        parts = segment_parts(segment)
+        if not parts:
+            continue
+        last = parts[-1][0]
+        if os.path.exists(last) and not readable(last):
+            print(f"[RECOVER] Unreadable, skipped: {os.path.basename(last)}")
+            os.replace(last, last + ".broken")
+
+def recover(work_dir, output_dir=None, keep=False):
+    """Finalize the recording left in work_dir. Returns the output path, or None."""
+    from .audio import AudioTake
+    from .finalize import FinalizeJob
+    manifest = read_manifest(work_dir)
+    if not manifest:
+        print(f"[RECOVER] No {MANIFEST} in {work_dir}")
+        return None
+    audio_dir = manifest.get('audio_dir') or ""
+    system = sorted(glob.glob(os.path.join(audio_dir, "system_audio_*.wav")))
+    mic = sorted(glob.glob(os.path.join(audio_dir, "mic_audio_*.wav")))
+    repaired = sum(repair_wav(p) for p in system + mic)
+    segments = manifest.get('video_segments', [])
+    salvage_video(segments)
+    output_dir = output_dir or manifest.get('save_dir') or os.getcwd()
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = datetime.fromtimestamp(manifest.get('created', time.time()))
+    output = os.path.join(output_dir, f"recording_{stamp:%Y%m%d_%H%M%S}_recovered.mp4")
+    take = AudioTake(audio_dir, system, mic, manifest.get('sample_rate', 48000))
+    job = FinalizeJob(segments, take, output, work_dir, manifest.get('sys_volume', 1.0), manifest.get('mic_volume', 1.0),
+                      video_gaps=[tuple(g) for g in manifest.get('gaps', [])],
+                      extra_metrics={'recovery': {'source': work_dir, 'repaired_wavs': repaired}})
+    try:
+        job.run()
+    except Exception as e:
+        print(f"[RECOVER] Finalize failed for {work_dir}, kept it: {e}")
+        return None
+    print(f"[RECOVER] {work_dir} -> {output} ({repaired} WAV headers repaired)")
+    if not keep:
+        job.cleanup()
+    return output
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m recorder.recover")
+    parser.add_argument("dirs", nargs="*", help="video temp dirs (default: every orphaned one)")
+    parser.add_argument("--list", action="store_true", help="only list orphaned temp dirs")
+    parser.add_argument("--output-dir", help="where to save (default: the recording's save folder)")
+    parser.add_argument("--keep", action="store_true", help="keep the temp dirs after recovering")
+    args = parser.parse_args(argv)
+    dirs = args.dirs or find_orphans()
+    if args.list:
+        print(json.dumps({d: read_manifest(d) for d in dirs}, indent=2))
+        return
+    print(json.dumps({d: recover(d, args.output_dir, args.keep) for d in dirs}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Instant replay: keep the last seconds of screen and audio, save them on a hotkey.
+
+The capture is written as rolling fragmented MP4 parts whose numbers wrap
+around (VideoCapture.segment_wrap), so ffmpeg overwrites the oldest part in
+place and the segment muxer's CSV lists only the finished parts still on
+disk. Audio goes to fixed-size PcmWindows in the AudioRecorder instead of
+WAV segments. Nothing grows while replay runs, however long that is.
+
+save() copies the newest parts (the open one is readable up to its last
+one-second fragment) and cuts the matching audio out of the windows, then
+hands them to a normal FinalizeJob, which stream-copies the video.
+"""
+
+import math
+import os
+import shutil
+import tempfile
+import time
+
+from .video import VideoCapture
+
+REPLAY_SECONDS = 30
+REPLAY_PART_S = 5
+
+class ReplayBuffer:
+    """A capture that only ever keeps the last seconds (at least) of video in its temp dir.
+
+    Parts are whole, so a save holds between seconds and about seconds +
+    part_seconds of video. One finished part more than needed is kept, so
+    the part ffmpeg overwrites next is never one being copied.
+    """
+
+    def __init__(self, seconds=REPLAY_SECONDS, part_seconds=REPLAY_PART_S, on_slow=None):
+        self.seconds = seconds
+        self.part_seconds = part_seconds
+        self.wrap = math.ceil((seconds + 1) / part_seconds) + 2
+        self.temp_dir = tempfile.mkdtemp(prefix="screen_recorder_replay_")
+        self.capture = VideoCapture(on_slow=on_slow, segment_seconds=part_seconds, segment_wrap=self.wrap)
+        self.pattern = None
+        self.saves = 0
+
+    @property
+    def window_seconds(self):
+        """Longest span a save can cover, for the audio windows (with a second to spare)."""
+        return self.seconds + self.part_seconds + 2
+
+    def start(self, input_args, fps, bitrate, preset=None, scale=None, encoder=None, extra_args=()):
+        self.capture.reset()
+        self.pattern = self.capture.start(input_args, os.path.join(self.temp_dir, "replay.mp4"), fps, bitrate,
+                                          preset, scale, encoder, extra_args)
+        return self.pattern
+
+    def parts(self):
+        """[(path, start_s)] of the parts on disk, oldest first, ending with the one being written."""
+        base = self.pattern.split("%")[0]
+        finished = []
+        try:
+            with open(base.rstrip("_") + ".csv") as f:
+                for line in f:
+                    name, start, end = line.strip().rsplit(",", 2)
+                    finished.append((float(start), float(end), name))
+        except (OSError, ValueError):
+            pass
+        finished.sort()
+        parts = [(os.path.join(self.temp_dir, name), start) for start, _, name in finished]
+        # The open part is the one after the newest finished part (the first one before any finished)
+        index = (int(finished[-1][2][-9:-4]) + 1) % self.wrap if finished else 0
+        current = self.pattern % index
+        if os.path.exists(current):
+            parts.append((current, finished[-1][1] if finished else 0.0))
+        return parts
+
+    def save(self, audio_recorder, output, sys_volume=1.0, mic_volume=1.0):
+        """Snapshot the window into a fresh temp dir. Returns the FinalizeJob that writes output, or None."""
+        from .finalize import FinalizeJob
+        now = time.perf_counter()
+        parts = self.parts()
+        out_time = self.capture.progress.get('out_time_s')
+        if not parts or out_time is None:
+            return None
+        # Where the capture timeline is now; the CSV start times are on it
+        position = out_time + now - self.capture.reader.latest_at
+        # Newest parts back to the one covering the start of the window, which
+        # ends a fragment (up to a second) short of position
+        since = position - self.seconds - 1
+        keep = next((i for i in range(len(parts) - 1, -1, -1) if parts[i][1] <= since), 0)
+        parts = parts[keep:]
+        work_dir = tempfile.mkdtemp(prefix="screen_recorder_replay_save_")
+        base = os.path.join(work_dir, "replay_")
+        with open(base.rstrip("_") + ".csv", "w") as f:
+            for i, (path, start) in enumerate(parts):
+                shutil.copyfile(path, f"{base}{i:05d}.mp4")
+                f.write(f"replay_{i:05d}.mp4,{start:.6f},{start:.6f}\n")
+        take = audio_recorder.replay_take(now - (position - parts[0][1]), now, work_dir)
+        self.saves += 1
+        print(f"[REPLAY] Saving {position - parts[0][1]:.1f}s from {len(parts)} parts")
+        return FinalizeJob([base + "%05d.mp4"], take, output, work_dir, sys_volume, mic_volume,
+                           extra_metrics={'replay': {'seconds': self.seconds, 'parts': len(parts)}})
+
+    def stop(self):
+        self.capture.stop()
+
+    def cleanup(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
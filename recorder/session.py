@@ -0,0 +1,354 @@
+"""
+Recording engine: the state and flow of recording, without any UI.
+
+RecordingSession owns the capture ffmpeg, the AudioRecorder, the finalize
+worker and the optional governor, incremental encoder and instant replay.
+Its options are a plain dict (see DEFAULT_OPTIONS), so they can come from
+Tk variables, command-line flags or a JSON file. The Tk app and the
+python -m recorder CLI are both clients of it.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from . import finalize, trace
+from .audio import AudioRecorder
+from .calibrate import cached_calibration, calibrate, tune_args
+from .governor import CaptureGovernor
+from .incremental import IncrementalEncoder
+from .recover import write_manifest
+from .replay import REPLAY_SECONDS, ReplayBuffer
+from .video import ROLLING_SEGMENT_S, VideoCapture, capture_input_args, get_encoder, testsrc_input_args
+
+# Quality name: (fps, video bitrate)
+QUALITY_PRESETS = {"Low": ("30", "1500k"), "Medium": ("60", "4500k"), "High": ("60", "8000k"), "Very High": ("60", "12000k")}
+
+DEFAULT_OPTIONS = {
+    'quality': "Medium",
+    # (x, y, w, h) to capture, or None for the whole desktop
+    'region': None,
+    # "desktop" (gdigrab) or "testsrc", a lavfi test pattern of test_size for headless runs
+    'source': "desktop",
+    'test_size': "1280x720",
+    # Desktop size as WxH, only used to look up the calibration; detected on Windows if None
+    'screen_size': None,
+    'system_audio': False,
+    'mic_audio': False,
+    # Sine-tone audio backends (recorder.synthetic); read when the session is created
+    'synthetic_audio': False,
+    'sys_volume': 1.0,
+    'mic_volume': 1.0,
+    # Let the governor step fps/preset/scale down under load
+    'adaptive': False,
+    # Stream mixed PCM into the mux ffmpeg instead of writing combined_a.wav
+    'pipe_audio': True,
+    # Encode each closed period's audio while recording, so stop only encodes the last one
+    'incremental': True,
+    'replay_seconds': REPLAY_SECONDS,
+    # Record tracing spans and write recording_X.trace.json next to each recording (see recorder.trace)
+    'trace': False,
+    'save_dir': os.path.join(os.path.expanduser("~"), "Videos", "Screen Recordings"),
+}
+
+def desktop_size():
+    """Primary screen size as WxH, or None where it cannot be read without a UI toolkit."""
+    if os.name != 'nt':
+        return None
+    import ctypes
+    user32 = ctypes.windll.user32
+    return f"{user32.GetSystemMetrics(0)}x{user32.GetSystemMetrics(1)}"
+
+class RecordingSession:
+    """Start/pause/resume/stop recordings one after another; each stop queues a finalize job.
+
+    Call it from one thread (the Tk thread in the app). on_slow(stats) is
+    called from the capture's progress thread when the encoder falls behind,
+    on_finalize(job) from the finalize worker whenever a job changes, and
+    on_crash() from the supervisor's thread when the capture dies; the owner
+    should then call tick() on its own thread without waiting for the next
+    second, since the audio keeps recording until tick() holds it.
+    """
+
+    def __init__(self, options=None, on_slow=None, on_finalize=None, on_crash=None):
+        self.options = dict(DEFAULT_OPTIONS, **(options or {}))
+        if self.options['trace']: trace.enable()
+        self.on_slow = on_slow
+        # Rolling fragmented MP4 parts keep a crashed capture recoverable (python -m recorder.recover)
+        self.capture = VideoCapture(on_slow=on_slow, segment_seconds=ROLLING_SEGMENT_S, on_crash=on_crash)
+        if self.options['synthetic_audio']:
+            from .synthetic import SyntheticPyAudio, SyntheticSoundDevice
+            self.audio_recorder = AudioRecorder(pyaudio_backend=SyntheticPyAudio(), sounddevice_backend=SyntheticSoundDevice())
+        else:
+            self.audio_recorder = AudioRecorder()
+        self.finalizer = finalize.FinalizeWorker(on_update=on_finalize)
+        self.temp_dir = tempfile.mkdtemp(prefix="screen_recorder_video_")
+        self.video_segments = []
+        self.recording = False
+        self.paused = False
+        self.started = None
+        self.governor = None
+        # Encoder config (from calibration) is fixed for a take so its segments concat cleanly
+        self.take_config = {}
+        self.incremental = None
+        # Instant replay: a ReplayBuffer keeps the last seconds while no recording runs
+        self.replay = None
+        self.calibration_cancel = None
+        self.calibrating = False
+        self.restarts = 0
+        self.trace_since = None
+        self._active_s = 0.0
+        self._active_since = None
+
+    def quality_settings(self):
+        return QUALITY_PRESETS[self.options['quality']]
+
+    def capture_size(self):
+        region = self.options['region']
+        if region:
+            return f"{region[2]}x{region[3]}"
+        if self.options['source'] == "testsrc":
+            return self.options['test_size']
+        return self.options['screen_size'] or desktop_size()
+
+    def input_args(self, fps):
+        if self.options['source'] == "testsrc":
+            return testsrc_input_args(fps, self.capture_size())
+        return capture_input_args(fps, self.options['region'])
+
+    def elapsed(self):
+        """Seconds recorded so far, without pauses."""
+        return self._active_s + (time.time() - self._active_since if self._active_since else 0.0)
+
+    def ensure_calibration(self):
+        """Calibrate the current size/fps in the background while idle, if nothing is cached yet."""
+        fps, bitrate = self.quality_settings()
+        size = self.capture_size()
+        if not size or self.recording or self.replay or self.calibrating or cached_calibration(size, fps):
+            return
+        self.calibrating = True
+        self.calibration_cancel = cancel = threading.Event()
+
+        def run():
+            try: calibrate(size, fps, bitrate, cancel=cancel)
+            except Exception as e: print(f"[CALIBRATE] Failed: {e}")
+            finally: self.calibrating = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _take_config(self):
+        # A calibration still running would compete with the capture for CPU
+        if self.calibration_cancel: self.calibration_cancel.set()
+        size = self.capture_size()
+        return (cached_calibration(size, self.quality_settings()[0]) if size else None) or {}
+
+    @trace.traced()
+    def start(self):
+        """Start a recording, taking the streams over from instant replay. Returns False if the capture did not start."""
+        if self.recording:
+            return False
+        if self.options['trace']: trace.enable()
+        self.trace_since = trace.window_start() if trace.enabled() else None
+        self.stop_replay()
+        self.video_segments = []; self.capture.reset(); self.restarts = 0
+        self.started = self._active_since = time.time(); self._active_s = 0.0; self.paused = False
+        self.take_config = self._take_config()
+        self.start_governor()
+        o = self.options
+        self.audio_recorder.start_recording(o['system_audio'], o['mic_audio'])
+        if o['pipe_audio'] and o['incremental'] and (o['system_audio'] or o['mic_audio']):
+            self.incremental = IncrementalEncoder(self.audio_recorder, self.temp_dir, o['sys_volume'], o['mic_volume'])
+        sf = self.start_video_segment()
+        if not sf:
+            print("[SESSION] Could not start the capture")
+            if self.incremental: self.incremental.stop()
+            self.incremental = None; self._active_since = None
+            self.audio_recorder.stop()
+            self.audio_recorder.detach_take().cleanup()
+            return False
+        self.video_segments.append(sf)
+        self.recording = True
+        self.save_manifest()
+        return True
+
+    @trace.traced()
+    def pause(self):
+        if not self.recording or self.paused:
+            return False
+        self._active_s = self.elapsed(); self._active_since = None
+        self.paused = True; self.audio_recorder.pause()
+        if not self.capture.pause(): self.stop_video_segment()
+        self.save_manifest()
+        return True
+
+    @trace.traced()
+    def resume(self):
+        if not self.paused:
+            return False
+        self.paused = False; self._active_since = time.time()
+        self.audio_recorder.resume()
+        if not self.capture.resume():
+            sf = self.start_video_segment()
+            if sf: self.video_segments.append(sf)
+        if self.governor: self.governor.restarted()
+        self.save_manifest()
+        return True
+
+    @trace.traced()
+    def stop(self, output=None):
+        """End the recording and queue its finalize. Returns the FinalizeJob, or None."""
+        if not self.recording:
+            return None
+        self._active_s = self.elapsed(); self._active_since = None
+        self.recording = False
+        self.stop_video_segment()
+        self.audio_recorder.stop()
+        job = self.finalize(output)
+        self.video_segments = []; self.paused = False
+        return job
+
+    def tick(self):
+        """Call about once a second while recording, and soon after on_crash: restarts a crashed capture,
+        and lets the governor restart it with new settings."""
+        if not self.recording or self.paused:
+            return
+        if self.capture.crashed:
+            self.restart_crashed_capture()
+        elif self.governor and self.governor.tick(self.capture):
+            self.restart_video_segment()
+
+    @trace.traced()
+    def restart_crashed_capture(self):
+        """Continue a take whose capture died in a new segment; audio resumes with it. Retried next tick on failure."""
+        if self.capture.process:
+            # Hold the audio until the capture is back, so it stays aligned with the video
+            self.audio_recorder.pause()
+            self.stop_video_segment()
+        sf = self.start_video_segment()
+        if not sf:
+            return False
+        self.video_segments.append(sf)
+        self.restarts += 1
+        print(f"[SESSION] Capture restarted into segment {len(self.video_segments)}")
+        self.audio_recorder.resume()
+        if self.governor: self.governor.restarted()
+        self.save_manifest()
+        return True
+
+    def default_output(self, prefix="recording"):
+        os.makedirs(self.options['save_dir'], exist_ok=True)
+        return os.path.join(self.options['save_dir'], f"{prefix}_{datetime.now():%Y%m%d_%H%M%S}.mp4")
+
+    def start_video_segment(self):
+        fps, bitrate = self.quality_settings()
+        config = self.take_config
+        preset, scale = config.get('preset'), None
+        if self.governor:
+            fps, preset, scale = self.governor.settings
+            fps = str(fps)
+        segment_file = os.path.join(self.temp_dir, f"video_segment_{len(self.video_segments):04d}.mp4")
+        return self.capture.start(self.input_args(fps), segment_file, fps, bitrate, preset, scale,
+                                  config.get('encoder'), tune_args(config.get('encoder'), config.get('tune')))
+
+    def start_governor(self):
+        """Keep the governor (and the level it settled on) while quality and encoder stay the same."""
+        if not self.options['adaptive']:
+            self.governor = None
+            return
+        base = (int(self.quality_settings()[0]), self.take_config.get('encoder') or get_encoder()[0], self.take_config.get('preset'))
+        if not self.governor or self.governor.base != base:
+            self.governor = CaptureGovernor(*base)
+        self.governor.start_take()
+
+    @trace.traced()
+    def restart_video_segment(self):
+        """Governor step: end the segment and start the next one with the new settings, keeping audio aligned."""
+        self.audio_recorder.pause()
+        self.stop_video_segment()
+        sf = self.start_video_segment()
+        if sf: self.video_segments.append(sf)
+        self.audio_recorder.resume()
+        self.governor.restarted()
+        self.save_manifest()
+
+    def save_manifest(self):
+        """Keep the session manifest in the video temp dir current, so a crash stays recoverable."""
+        write_manifest(self.temp_dir, created=self.started, audio_dir=self.audio_recorder.temp_dir,
+                       sample_rate=self.audio_recorder.sample_rate, sys_volume=self.options['sys_volume'],
+                       mic_volume=self.options['mic_volume'], save_dir=self.options['save_dir'],
+                       video_segments=self.video_segments, gaps=self.capture.gaps)
+
+    def stop_video_segment(self):
+        self.capture.stop()
+
+    @trace.traced()
+    def finalize(self, output=None):
+        """Hand the finished take to the finalize worker and start fresh temp dirs."""
+        incremental, self.incremental = self.incremental, None
+        if incremental: incremental.stop()
+        if not self.video_segments: return None
+        job = finalize.FinalizeJob(
+            self.video_segments, self.audio_recorder.detach_take(), output or self.default_output(), self.temp_dir,
+            self.options['sys_volume'], self.options['mic_volume'],
+            pipe_audio=self.options['pipe_audio'], video_gaps=self.capture.gaps, video_stats=self.capture.segment_stats,
+            extra_metrics={'governor': self.governor.decisions} if self.governor else None,
+            incremental=incremental, trace_since=self.trace_since
+        )
+        self.temp_dir = tempfile.mkdtemp(prefix="screen_recorder_video_")
+        return self.finalizer.submit(job)
+
+    @trace.traced()
+    def start_replay(self):
+        """Run the capture and audio into the replay window until a recording starts or stop_replay()."""
+        if self.replay or self.recording:
+            return False
+        fps, bitrate = self.quality_settings()
+        config = self._take_config()
+        o = self.options
+        self.replay = ReplayBuffer(o['replay_seconds'], on_slow=self.on_slow)
+        self.audio_recorder.start_recording(o['system_audio'], o['mic_audio'], replay_seconds=self.replay.window_seconds)
+        if not self.replay.start(self.input_args(fps), fps, bitrate, config.get('preset'), None,
+                                 config.get('encoder'), tune_args(config.get('encoder'), config.get('tune'))):
+            print("[REPLAY] Could not start the capture")
+            self.stop_replay()
+            return False
+        return True
+
+    def stop_replay(self):
+        if not self.replay: return
+        replay, self.replay = self.replay, None
+        replay.stop()
+        self.audio_recorder.stop()
+        replay.cleanup()
+
+    @trace.traced()
+    def save_replay(self, output=None):
+        """Save the replay window as its own recording. Returns the FinalizeJob, or None."""
+        if not self.replay: return None
+        if self.options['trace']: trace.enable()
+        since = trace.window_start() if trace.enabled() else None
+        job = self.replay.save(self.audio_recorder, output or self.default_output("replay"),
+                               self.options['sys_volume'], self.options['mic_volume'])
+        if not job: return None
+        job.trace_since = since
+        return self.finalizer.submit(job)
+
+    def wait(self):
+        """Block until every queued finalize job is done."""
+        self.finalizer.wait()
+
+    def cleanup_temp_files(self):
+        self.audio_recorder.cleanup()
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = tempfile.mkdtemp(prefix="screen_recorder_video_")
+
+    def close(self):
+        """Stop whatever runs, wait for finalize and remove the temp dirs."""
+        self.stop()
+        self.stop_replay()
+        self.wait()
+        self.cleanup_temp_files()
@@ -0,0 +1,249 @@
+"""
+FFmpeg child supervisor: one owner for every long-running ffmpeg the app starts.
+
+The capture, concat, mux and audio encode processes are spawned through
+supervisor (the module-level FFmpegSupervisor). Each becomes a Child that
+records its pid, start/exit time, exit code and the last lines of its
+stderr; a monitor thread samples CPU, RSS and I/O bytes through psutil once
+a second. A child that exits with an error prints its stderr tail, and
+on_exit lets the owner react (VideoCapture uses it to notice a crashed
+capture). shutdown() stops every child within one bounded deadline and runs
+at exit. Short probes with their own timeouts (encoder detection,
+calibration) still run ffmpeg directly, outside the supervisor.
+
+Children spawned inside a scope() are also collected into that scope's
+list, so a finalize job can report the processes it ran.
+
+While tracing, each child's lifetime is a span on a track of its own.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import io
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+
+from . import trace
+
+NO_WINDOW = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+STDERR_TAIL = 20
+SAMPLE_S = 1.0
+SHUTDOWN_S = 5.0
+# Finished children kept for supervisor.history
+HISTORY = 100
+
+_scope = contextvars.ContextVar("ffmpeg_scope", default=None)
+
+class FFmpegError(subprocess.CalledProcessError):
+    """A supervised child exited with an error; stderr is the tail of what it printed."""
+
+    def __init__(self, child):
+        super().__init__(child.returncode, child.process.args, stderr="\n".join(child.stderr_tail))
+        self.role = child.role
+
+    def __str__(self):
+        last = self.stderr.splitlines()[-1:] if self.stderr else []
+        return f"ffmpeg {self.role} exited with {self.returncode}" + "".join(f": {line}" for line in last)
+
+class Child:
+    """One supervised process and its accounting."""
+
+    def __init__(self, process, role, on_exit=None):
+        self.process = process
+        self.pid = process.pid
+        self.role = role
+        self.on_exit = on_exit
+        self.started = time.time()
+        self.started_ns = trace.now()
+        self.ended = None
+        self.returncode = None
+        self.stopping = False
+        self.stderr_tail = deque(maxlen=STDERR_TAIL)
+        self.drainer = None
+        self.cpu_percent = None
+        self.cpu_s = 0.0
+        self.peak_rss = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self._ps = None
+
+    @property
+    def running(self):
+        return self.ended is None
+
+    def sample(self):
+        """Refresh CPU, memory and I/O counters; False once the process is gone."""
+        import psutil
+        try:
+            if self._ps is None:
+                self._ps = psutil.Process(self.pid)
+            with self._ps.oneshot():
+                self.cpu_percent = self._ps.cpu_percent(None)
+                times = self._ps.cpu_times()
+                self.cpu_s = times.user + times.system
+                self.peak_rss = max(self.peak_rss, self._ps.memory_info().rss)
+                if hasattr(self._ps, "io_counters"):
+                    io_counters = self._ps.io_counters()
+                    self.read_bytes, self.write_bytes = io_counters.read_bytes, io_counters.write_bytes
+            return True
+        except psutil.Error:
+            return False
+
+    def summary(self):
+        return {
+            'role': self.role, 'pid': self.pid,
+            'started': round(self.started, 3), 'ended': self.ended and round(self.ended, 3),
+            'runtime_s': round((self.ended or time.time()) - self.started, 3),
+            'exit_code': self.returncode,
+            'cpu_s': round(self.cpu_s, 3), 'peak_rss_mb': round(self.peak_rss / 2**20, 1),
+            'read_mb': round(self.read_bytes / 2**20, 2), 'write_mb': round(self.write_bytes / 2**20, 2),
+            'stderr_tail': list(self.stderr_tail) if self.returncode else [],
+        }
+
+class FFmpegSupervisor:
+    def __init__(self, sample_interval=SAMPLE_S):
+        self.sample_interval = sample_interval
+        self.children = {}
+        self.history = deque(maxlen=HISTORY)
+        self._lock = threading.Lock()
+        self._monitor = None
+        atexit.register(self.shutdown)
+
+    def spawn(self, cmd, role, stdin=None, stdout=subprocess.DEVNULL, on_exit=None, **popen_args):
+        """Start cmd as a supervised child. Raises OSError if it cannot be started.
+
+        on_exit(child) runs on the child's stderr thread once it has exited.
+        """
+        popen_args.setdefault("creationflags", NO_WINDOW)
+        with trace.span("spawn", role=role):
+            process = subprocess.Popen(cmd, stdin=stdin, stdout=stdout, stderr=subprocess.PIPE, **popen_args)
+        child = Child(process, role, on_exit)
+        trace.process(child.pid, f"ffmpeg {role}")
+        with self._lock:
+            self.children[child.pid] = child
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._sample_loop, daemon=True)
+                self._monitor.start()
+        collected = _scope.get()
+        if collected is not None:
+            collected.append(child)
+        child.drainer = threading.Thread(target=self._drain, args=(child,), daemon=True)
+        child.drainer.start()
+        return child
+
+    def run(self, cmd, role, check=True, **popen_args):
+        """spawn() and wait for the child to exit. Returns the Child.
+
+        Like subprocess.run(check=True), a non-zero exit raises FFmpegError
+        carrying the child's stderr tail unless check is False.
+        """
+        child = self.spawn(cmd, role, **popen_args)
+        self.wait(child)
+        if check: self.check(child)
+        return child
+
+    def check(self, child):
+        """Raise FFmpegError if the (exited) child failed."""
+        if child.returncode:
+            raise FFmpegError(child)
+
+    def wait(self, child, timeout=None):
+        """Wait for the child to exit and its stderr to be read. Returns the exit code."""
+        child.drainer.join(timeout)
+        child.process.wait(timeout)
+        self._reap(child)
+        return child.returncode
+
+    def _drain(self, child):
+        # Universal newlines split ffmpeg's \r-terminated stats lines too
+        for line in io.TextIOWrapper(child.process.stderr, errors="replace", newline=None):
+            line = line.rstrip()
+            if line: child.stderr_tail.append(line)
+        # stderr closes as the process exits; sampled before it is waited for,
+        # its final CPU time and I/O are still readable
+        child.sample()
+        child.process.wait()
+        self._reap(child)
+
+    def _reap(self, child):
+        with self._lock:
+            if child.ended is not None:
+                return
+            child.ended = time.time()
+            child.returncode = child.process.returncode
+            self.children.pop(child.pid, None)
+            self.history.append(child)
+        trace.complete(f"ffmpeg {child.role}", child.started_ns, pid=child.pid, exit_code=child.returncode, cpu_s=round(child.cpu_s, 3))
+        if child.returncode and not child.stopping:
+            print(f"[FFMPEG] {child.role} (pid {child.pid}) exited with {child.returncode}:")
+            for line in list(child.stderr_tail)[-5:]:
+                print(f"[FFMPEG]   {line}")
+        if child.on_exit:
+            try: child.on_exit(child)
+            except Exception as e: print(f"[FFMPEG] Exit callback failed: {e}")
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.sample_interval)
+            with self._lock:
+                running = list(self.children.values())
+            for child in running:
+                child.sample()
+
+    def stop(self, child, timeout=3.0):
+        """Ask the child to quit (q on stdin), then terminate, then kill, all within timeout."""
+        child.stopping = True
+        deadline = time.perf_counter() + timeout
+        process = child.process
+        steps = (process.terminate, process.kill)
+        if process.poll() is None and process.stdin:
+            try:
+                process.stdin.write(b"q"); process.stdin.flush()
+                steps = (None,) + steps
+            except (OSError, ValueError):
+                pass
+        for escalate in steps:
+            if escalate:
+                try: escalate()
+                except OSError: pass
+            try:
+                process.wait(max(0.05, (deadline - time.perf_counter()) / 2))
+                break
+            except subprocess.TimeoutExpired:
+                pass
+        child.drainer.join(max(0, deadline - time.perf_counter()))
+        self._reap(child)
+        return child.returncode
+
+    def shutdown(self, timeout=SHUTDOWN_S):
+        """Stop every running child; returns once all have exited or timeout has passed."""
+        with self._lock:
+            running = list(self.children.values())
+        if not running:
+            return
+        print(f"[FFMPEG] Stopping {len(running)} running process(es)")
+        deadline = time.perf_counter() + timeout
+        threads = [threading.Thread(target=self.stop, args=(c, timeout), daemon=True) for c in running]
+        for t in threads: t.start()
+        for t in threads: t.join(max(0, deadline - time.perf_counter()))
+
+    @contextlib.contextmanager
+    def scope(self):
+        """Collect the children spawned in this context (and in contexts copied from it) into a list."""
+        collected = []
+        token = _scope.set(collected)
+        try:
+            yield collected
+        finally:
+            _scope.reset(token)
+
+    def snapshot(self):
+        """Running children's accounting, for live display."""
+        with self._lock:
+            return [c.summary() for c in self.children.values()]
+
+supervisor = FFmpegSupervisor()
@@ -0,0 +1,190 @@
+"""
+Synthetic audio backends for running the recorder headless (benchmarks, Linux).
+
+SyntheticPyAudio stands in for the pyaudiowpatch module and
+SyntheticSoundDevice for sounddevice: pass instances as
+AudioRecorder(pyaudio_backend=..., sounddevice_backend=...). Streams produce a
+sine tone paced in real time, and the backends count setups and callbacks so
+caching and idle behaviour can be checked.
+"""
+
+import math
+import struct
+import threading
+import time
+
+def sine_table(rate, freq, channels):
+    """One second of interleaved int16 sine; loops seamlessly for integer freq."""
+    samples = []
+    for i in range(rate):
+        samples.extend([int(8000 * math.sin(2 * math.pi * freq * i / rate))] * channels)
+    return struct.pack(f"<{len(samples)}h", *samples)
+
+class _SineStream:
+    def __init__(self, backend, channels, rate, freq):
+        self._backend = backend
+        self._frame_size = 2 * channels
+        self._rate = rate
+        self._table = sine_table(rate, freq, channels)
+        self._pos = 0
+        self._active = True
+        self._next_deadline = time.perf_counter()
+
+    def is_active(self):
+        return self._active
+
+    def get_input_latency(self):
+        return 0.05
+
+    def start_stream(self):
+        self._active = True
+        self._next_deadline = time.perf_counter()
+
+    def stop_stream(self):
+        self._active = False
+
+    def close(self):
+        self._active = False
+
+    def read(self, frames, exception_on_overflow=True):
+        if self._backend.fail_reads:
+            self._backend.fail_reads -= 1
+            raise OSError(-9999, "Unanticipated host error (synthetic device change)")
+        # Block like a real device until the chunk's worth of time has passed
+        self._next_deadline += frames / self._rate
+        delay = self._next_deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        start = self._pos * self._frame_size
+        end = start + frames * self._frame_size
+        data = self._table[start:end]
+        while len(data) < frames * self._frame_size:
+            data += self._table[:frames * self._frame_size - len(data)]
+        self._pos = (self._pos + frames) % self._rate
+        return data
+
+class SyntheticPyAudio:
+    """Module-like fake of pyaudiowpatch with one loopback device."""
+
+    paInt16 = 8
+
+    def __init__(self, rate=48000, freq=440.0, host_latency=0.0, open_latency=0.0):
+        self.rate = rate
+        self.freq = freq
+        self.host_latency = host_latency
+        self.open_latency = open_latency
+        self.hosts_created = 0
+        self.device_lookups = 0
+        self.streams_opened = 0
+        self.fail_reads = 0
+        backend = self
+
+        class PyAudio:
+            def __init__(self):
+                time.sleep(backend.host_latency)
+                backend.hosts_created += 1
+
+            def get_default_wasapi_loopback(self):
+                backend.device_lookups += 1
+                return backend.device_info()
+
+            def get_device_count(self):
+                return 1
+
+            def get_device_info_by_index(self, index):
+                return backend.device_info()
+
+            def get_sample_size(self, fmt):
+                return 2
+
+            def open(self, format, channels, rate, input=True, input_device_index=None, frames_per_buffer=1024):
+                time.sleep(backend.open_latency)
+                backend.streams_opened += 1
+                return _SineStream(backend, channels, rate, backend.freq)
+
+            def terminate(self):
+                pass
+
+        self.PyAudio = PyAudio
+
+    def device_info(self):
+        return {
+            'index': 0,
+            'name': "Synthetic loopback",
+            'defaultSampleRate': float(self.rate),
+            'maxInputChannels': 2,
+            'isLoopback': True,
+        }
+
+class _CallbackFlags:
+    input_overflow = False
+    def __bool__(self): return False
+
+class _CallbackStream:
+    def __init__(self, backend, channels, samplerate, callback, blocksize):
+        import numpy as np
+        self._backend = backend
+        self._callback = callback
+        self._rate = samplerate
+        self._blocksize = blocksize or samplerate // 100
+        t = np.arange(samplerate) / samplerate
+        tone = (0.25 * np.sin(2 * np.pi * backend.freq * t)).astype(np.float32)
+        self._table = np.repeat(tone[:, None], channels, axis=1)
+        self._block = np.empty((self._blocksize, channels), dtype=np.float32)
+        self._pos = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.active = False
+
+    def _run(self):
+        deadline = time.perf_counter()
+        flags = _CallbackFlags()
+        while not self._stop.is_set():
+            deadline += self._blocksize / self._rate
+            delay = deadline - time.perf_counter()
+            if delay > 0 and self._stop.wait(delay):
+                break
+            end = self._pos + self._blocksize
+            if end <= self._rate:
+                self._block[:] = self._table[self._pos:end]
+            else:
+                split = self._rate - self._pos
+                self._block[:split] = self._table[self._pos:]
+                self._block[split:] = self._table[:end - self._rate]
+            self._pos = end % self._rate
+            self._backend.callbacks += 1
+            self._callback(self._block, self._blocksize, None, flags)
+
+    def start(self):
+        if self.active:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.active = True
+
+    def stop(self):
+        if not self.active:
+            return
+        self._stop.set()
+        self._thread.join()
+        self.active = False
+
+    def close(self):
+        self.stop()
+
+class SyntheticSoundDevice:
+    """Module-like fake of sounddevice whose InputStream calls back from its own thread."""
+
+    def __init__(self, freq=330.0, blocksize=0):
+        self.freq = freq
+        self.blocksize = blocksize
+        self.streams_opened = 0
+        self.callbacks = 0
+        backend = self
+
+        def InputStream(channels, samplerate, callback, blocksize=None):
+            backend.streams_opened += 1
+            return _CallbackStream(backend, channels, samplerate, callback, blocksize or backend.blocksize)
+
+        self.InputStream = InputStream
@@ -0,0 +1,135 @@
+"""
+Tracing: timed spans on one timeline, exported as Chrome trace JSON.
+
+Off unless SCREEN_RECORDER_TRACE=1 is set or a RecordingSession is created
+with the 'trace' option. While off, span() hands back a shared no-op context
+and a @traced function costs one flag check per call, so the hooks stay in
+place on the hot paths.
+
+Spans ("X" events) carry the thread they ran on; instants ("i") mark points
+such as a hotkey press or the capture's first frame; supervised ffmpeg
+children appear as processes of their own. export() writes the events of a
+time window (one recording: from the input that started it until its file
+is written) as recording_X.trace.json, which opens in ui.perfetto.dev or
+chrome://tracing.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Oldest events are dropped beyond this; a recording makes a few hundred
+MAX_EVENTS = 100000
+# A hotkey press this close before a start is counted as part of that recording
+INPUT_LOOKBACK_S = 2.0
+
+_enabled = os.environ.get("SCREEN_RECORDER_TRACE", "") not in ("", "0")
+_events = deque(maxlen=MAX_EVENTS)
+_threads = {}
+_processes = {}
+_last_input = None
+_pid = os.getpid()
+_null = contextlib.nullcontext()
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+def enabled():
+    return _enabled
+
+def now():
+    """Trace timestamp: time.perf_counter_ns()."""
+    return time.perf_counter_ns()
+
+def _tid():
+    thread = threading.current_thread()
+    if thread.ident not in _threads:
+        _threads[thread.ident] = thread.name
+    return thread.ident
+
+def complete(name, start, end=None, pid=None, **args):
+    """Record a span that has already ended (start/end are now() values)."""
+    if not _enabled: return
+    end = end or now()
+    _events.append({'name': name, 'ph': "X", 'ts': start / 1000, 'dur': (end - start) / 1000,
+                    'pid': pid or _pid, 'tid': pid or _tid(), 'args': args})
+
+def instant(name, ts=None, **args):
+    if not _enabled: return
+    _events.append({'name': name, 'ph': "i", 's': "t", 'ts': (ts or now()) / 1000, 'pid': _pid, 'tid': _tid(), 'args': args})
+
+def input_event(name, **args):
+    """A user action (hotkey press); a recording started right after it begins its trace here."""
+    global _last_input
+    if not _enabled: return
+    _last_input = now()
+    instant(name, _last_input, **args)
+
+def process(pid, name):
+    """Name the track of a child process."""
+    if _enabled: _processes[pid] = name
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type: self.args['error'] = exc_type.__name__
+        complete(self.name, self.start, **self.args)
+        return False
+
+def span(name, **args):
+    """Context manager timing its block as one span."""
+    return _Span(name, args) if _enabled else _null
+
+def traced(name=None):
+    """Decorator: each call of the function is a span (named after it by default)."""
+    def wrap(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(label, {}):
+                return fn(*args, **kwargs)
+        return call
+    return wrap
+
+def window_start():
+    """Where the trace of a recording starting now begins: the input that triggered it, if recent."""
+    t = now()
+    return _last_input if _last_input and t - _last_input < INPUT_LOOKBACK_S * 1e9 else t
+
+def events(since=None, until=None):
+    """Events overlapping [since, until] (now() values), oldest first."""
+    lo = since / 1000 if since else float("-inf")
+    hi = until / 1000 if until else float("inf")
+    return [e for e in list(_events) if e['ts'] <= hi and e['ts'] + e.get('dur', 0) >= lo]
+
+def trace_path(output):
+    """recording_X.mp4 -> recording_X.trace.json"""
+    return os.path.splitext(output)[0] + ".trace.json"
+
+def export(path, since=None, until=None):
+    """Write the events of the window as a Chrome trace. Returns the path."""
+    selected = events(since, until)
+    meta = [{'name': "process_name", 'ph': "M", 'pid': _pid, 'args': {'name': "Screen Recorder"}}]
+    meta += [{'name': "thread_name", 'ph': "M", 'pid': _pid, 'tid': tid, 'args': {'name': name}} for tid, name in list(_threads.items())]
+    meta += [{'name': "process_name", 'ph': "M", 'pid': pid, 'args': {'name': name}} for pid, name in list(_processes.items())
+             if any(e['pid'] == pid for e in selected)]
+    with open(path, "w") as f:
+        json.dump({'traceEvents': meta + selected, 'displayTimeUnit': "ms"}, f)
+    return path
@@ -8,8 +8,9 @@ def setup_tray(app):
     draw = ImageDraw.Draw(img)
     draw.rectangle((16, 16, 48, 48), fill="red")
     menu = pystray.Menu(
-        pystray.MenuItem("Show", app.show_window, default=True),
-        pystray.MenuItem("Exit", app.exit_app)
+        # Menu callbacks run on the tray thread; the dispatcher moves them to the Tk thread
+        pystray.MenuItem("Show", lambda: app.commands.press("show", source="tray"), default=True),
+        pystray.MenuItem("Exit", lambda: app.commands.press("exit", source="tray"))
     )
     tray_icon = pystray.Icon("recorder", img, "Screen Recorder", menu)
     threading.Thread(target=tray_icon.run, daemon=True).start()
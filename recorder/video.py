@@ -1,89 +1,326 @@
 import subprocess
-import tempfile
+import json
 import os
-import tkinter as tk
+import shutil
+import threading
+import time
 
+from . import trace
+from .progress import ProgressReader
+from .supervisor import supervisor
+
+NO_WINDOW = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+HW_ENCODERS = [("h264_nvenc", "NVIDIA"), ("h264_qsv", "INTEL"), ("h264_amf", "AMD")]
+CPU_ENCODER = ("libx264", "CPU")
+# Faster presets per encoder, least to most aggressive; the encoder default is used otherwise
+ENCODER_PRESETS = {
+    "libx264": ("veryfast", "superfast", "ultrafast"),
+    "h264_nvenc": ("p3", "p2", "p1"),
+    "h264_qsv": ("faster", "veryfast"),
+    "h264_amf": ("balanced", "speed"),
+}
+# Length of the rolling fragmented MP4 parts a capture is split into (segment_seconds)
+ROLLING_SEGMENT_S = 10
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+def cache_dir():
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "ScreenRecorder")
+
+def ffmpeg_fingerprint():
+    """Identify the ffmpeg binary on PATH by path, size and mtime, or None if missing."""
+    path = shutil.which("ffmpeg")
+    if not path:
+        return None
+    st = os.stat(path)
+    return {"path": path, "size": st.st_size, "mtime": st.st_mtime}
+
+def load_cache(name, fingerprint):
+    """Return the cached value for name if it was stored for this ffmpeg binary."""
+    try:
+        with open(os.path.join(cache_dir(), "cache.json")) as f:
+            entry = json.load(f).get(name)
+    except (OSError, ValueError):
+        return None
+    if entry and entry.get("ffmpeg") == fingerprint:
+        return entry.get("value")
+    return None
+
+def save_cache(name, fingerprint, value):
+    path = os.path.join(cache_dir(), "cache.json")
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        try:
+            with open(path) as f: cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        cache[name] = {"ffmpeg": fingerprint, "value": value}
+        with open(path + ".tmp", "w") as f: json.dump(cache, f, indent=2)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"[CACHE] Could not write {path}: {e}")
+
+@trace.traced()
+def probe_encoder(encoder, timeout=15):
+    """Run a short real encode of a lavfi test source; True if the encoder works."""
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=256x256:rate=30",
+           "-t", "0.5", "-c:v", encoder, "-pix_fmt", "yuv420p", "-f", "null", "-"]
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=timeout, creationflags=NO_WINDOW).returncode == 0
+    except Exception:
+        return False
+
+@trace.traced()
 def detect_encoder():
-    """Detect available hardware encoder."""
+    """Detect a working hardware encoder, falling back to libx264."""
     try:
         out = subprocess.run(
             ["ffmpeg", "-encoders"],
             capture_output=True,
             text=True,
-            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+            creationflags=NO_WINDOW
         ).stdout.lower()
     except Exception:
-        return "libx264", "CPU"
-
-    if "h264_nvenc" in out:
-        return "h264_nvenc", "NVIDIA"
-    if "h264_qsv" in out:
-        return "h264_qsv", "INTEL"
-    if "h264_amf" in out:
-        return "h264_amf", "AMD"
-
-    return "libx264", "CPU"
-
-VIDEO_ENCODER, ENCODER_LABEL = detect_encoder()
-
-class HotkeyHelpDialog:
-    _instance = None
-    
-    @classmethod
-    def toggle(cls, parent):
-        if cls._instance is None or not cls._instance.dialog.winfo_exists():
-            cls._instance = cls(parent)
-        else:
-            cls._instance.dialog.destroy()
-            cls._instance = None
-    
-    def __init__(self, parent):
-        from tkinter import ttk
-        self.dialog = tk.Toplevel(parent)
-        self.dialog.title("Keyboard Shortcuts")
-        self.dialog.geometry("400x250")
-        self.dialog.resizable(False, False)
-        self.dialog.transient(parent)
-        self.dialog.grab_set()
-        
-        self.dialog.update_idletasks()
-        x = parent.winfo_x() + (parent.winfo_width() // 2) - (400 // 2)
-        y = parent.winfo_y() + (parent.winfo_height() // 2) - (250 // 2)
-        self.dialog.geometry(f"+{x}+{y}")
-        
-        self.create_widgets()
-        
-        self.dialog.bind("<Escape>", lambda e: self.on_close())
-        self.dialog.protocol("WM_DELETE_WINDOW", self.on_close)
-        self.dialog.focus_set()
-        
-    def create_widgets(self):
-        from tkinter import ttk
-        main_frame = ttk.Frame(self.dialog, padding=20)
-        main_frame.pack(fill=tk.BOTH, expand=True)
-        
-        ttk.Label(main_frame, text="📋 Keyboard Shortcuts", font=("Arial", 12, "bold")).pack(pady=(0, 15))
-        
-        shortcuts_frame = ttk.Frame(main_frame)
-        shortcuts_frame.pack(fill=tk.BOTH, expand=True)
-        
-        shortcuts = [
-            ("Alt + S", "Start/Stop recording"),
-            ("Alt + P", "Pause/Resume recording"),
-            ("F1", "Show/Hide this help dialog")
-        ]
-        
-        for key, description in shortcuts:
-            row = ttk.Frame(shortcuts_frame)
-            row.pack(fill=tk.X, pady=5)
-            
-            ttk.Label(row, text=key, font=("Courier", 10, "bold"), width=12, anchor="w").pack(side=tk.LEFT)
-            ttk.Label(row, text=description, anchor="w").pack(side=tk.LEFT, padx=(10, 0))
-        
-        ttk.Separator(main_frame, orient=tk.HORIZONTAL).pack(fill=tk.X, pady=15)
-        
-        ttk.Button(main_frame, text="Close (or press Esc)", command=self.on_close, width=20).pack()
-        
-    def on_close(self):
-        HotkeyHelpDialog._instance = None
-        self.dialog.destroy()
+        return CPU_ENCODER
+
+    for encoder, label in HW_ENCODERS:
+        if encoder in out:
+            if probe_encoder(encoder):
+                return encoder, label
+            print(f"[ENCODER] {encoder} is listed but failed a test encode, skipping")
+
+    return CPU_ENCODER
+
+def cached_encoder():
+    """The encoder if it is already known (in memory or on disk), without running ffmpeg."""
+    if _encoder is not None:
+        return _encoder
+    fingerprint = ffmpeg_fingerprint()
+    cached = load_cache("encoder", fingerprint) if fingerprint else None
+    return tuple(cached) if cached else None
+
+def get_encoder():
+    """(encoder, label), detected on first use and cached per ffmpeg binary."""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = cached_encoder()
+        if _encoder is None:
+            _encoder = detect_encoder()
+            fingerprint = ffmpeg_fingerprint()
+            if fingerprint:
+                save_cache("encoder", fingerprint, list(_encoder))
+        return _encoder
+
+def preset_args(encoder, preset):
+    if not preset:
+        return []
+    return ["-quality" if encoder == "h264_amf" else "-preset", preset]
+
+def capture_input_args(fps, region=None):
+    """gdigrab input arguments for the whole desktop or a region (x, y, w, h)."""
+    args = ["-f", "gdigrab", "-framerate", fps]
+    if region:
+        x, y, w, h = region
+        args += ["-offset_x", str(x), "-offset_y", str(y), "-video_size", f"{w}x{h}"]
+    return args + ["-i", "desktop"]
+
+def testsrc_input_args(fps, size="1280x720"):
+    """lavfi test pattern paced and stamped like gdigrab (headless runs, benchmarks).
+
+    realtime releases frames at the frame rate, and after a lag longer than
+    its limit (a suspended capture) carries on from now instead of catching
+    up; setpts stamps each frame with the wall-clock time it left, so a
+    pause leaves a gap in the timeline as it does with gdigrab.
+    """
+    return ["-f", "lavfi", "-i", f"testsrc=size={size}:rate={fps},realtime=limit=0.1,settb=AVTB,setpts=RTCTIME"]
+
+class VideoCapture:
+    """Owns the capture ffmpeg process.
+
+    In persistent mode pause/resume suspend and resume the running process
+    instead of ending the segment, so a take is a single file. gdigrab stamps
+    frames with wall-clock time, so every pause leaves a gap in the timeline;
+    gaps lists them as (offset_s, duration_s) from the start of the take and
+    finalize closes them with the setts bitstream filter. The timeline starts
+    at the first frame, which ffmpeg's progress reports place, not when the
+    process was spawned; gaps reads them each time, so offsets recorded
+    before the first report are corrected later.
+
+    ffmpeg reports progress on its stdout; progress holds the latest report
+    and segment_stats a summary per finished segment. on_progress and
+    on_slow are passed to ProgressReader and run on its thread.
+
+    With segment_seconds the capture is written as rolling fragmented MP4
+    parts of that length: segment_file becomes a %05d pattern, and the
+    segment muxer lists each finished part with its start time in a CSV next
+    to it (see finalize.segment_parts). Parts are flushed a fragment per
+    second, so a killed or crashed ffmpeg loses at most the last second,
+    and finalize joins the parts by stream copy. With segment_wrap as well,
+    part numbers wrap around after that many parts, so the oldest part is
+    overwritten and the CSV keeps only the finished parts still on disk
+    (see replay.ReplayBuffer).
+
+    The ffmpeg runs under the supervisor. If it exits without being asked
+    to, crashed is set and on_crash() runs on the supervisor's thread; the
+    owner starts a new segment (see RecordingSession.tick).
+    """
+
+    def __init__(self, persistent=True, on_progress=None, on_slow=None, segment_seconds=None, segment_wrap=None, on_crash=None):
+        self.persistent = persistent
+        self.segment_seconds = segment_seconds
+        self.segment_wrap = segment_wrap
+        self.on_progress = on_progress
+        self.on_slow = on_slow
+        self.on_crash = on_crash
+        self.process = None
+        self.child = None
+        self.crashed = False
+        self.reader = None
+        self.segment_file = None
+        self.segment_stats = []
+        self.suspended = False
+        self._segmented = not persistent
+        # Gaps of the take's finished segments, and the timeline they cover
+        self._gaps = []
+        self._timeline_s = 0.0
+        # (paused_at, duration_s) of the running segment, in time.perf_counter()
+        self._pauses = []
+        self._spawned_at = None
+        self._paused_at = None
+
+    def reset(self):
+        """Start a new take: forget gaps and re-enable persistent mode."""
+        self.segment_stats = []
+        self.reader = None
+        self._segmented = not self.persistent
+        self._gaps = []
+        self._timeline_s = 0.0
+        self._pauses = []
+
+    @property
+    def progress(self):
+        return self.reader.latest if self.reader else {}
+
+    @property
+    def gaps(self):
+        """(offset_s, duration_s) of every pause of the take, on its timeline."""
+        origin = self._origin()
+        return self._gaps + [(self._timeline_s + paused_at - origin, duration) for paused_at, duration in self._pauses]
+
+    def _origin(self):
+        """time.perf_counter() of the running segment's first frame, from ffmpeg's progress; never before the spawn."""
+        if self.reader and self.reader.first_frame_at is not None:
+            return max(self.reader.first_frame_at, self._spawned_at)
+        return self._spawned_at
+
+    @trace.traced()
+    def start(self, input_args, segment_file, fps, bitrate, preset=None, scale=None, encoder=None, extra_args=()):
+        """Spawn the capture ffmpeg writing to segment_file. Returns the file (or part pattern) or None.
+
+        encoder defaults to get_encoder(); preset picks an encoder preset,
+        scale (< 1) shrinks the frame and extra_args go to the encoder as-is.
+        """
+        encoder = encoder or get_encoder()[0]
+        cmd = ["ffmpeg", "-y", "-nostats", "-progress", "pipe:1"] + input_args + ["-an", "-c:v", encoder, "-b:v", bitrate, "-pix_fmt", "yuv420p"]
+        cmd += preset_args(encoder, preset) + list(extra_args)
+        filters = [f"scale=trunc(iw*{scale}/2)*2:-2"] if scale and scale < 1 else []
+        if not self._segmented:
+            # No B-frames keeps pts == dts so setts can shift both; frames that
+            # land on the same 1/fps tick (catch-up after a resume) are dropped
+            cmd += ["-bf", "0", "-fps_mode", "vfr"]
+            filters.append(f"settb=1/{fps}")
+        if filters:
+            cmd += ["-vf", ",".join(filters)]
+        if self.segment_seconds:
+            # Keyframes on the part boundaries so every part is cut on time
+            base = os.path.splitext(segment_file)[0]
+            segment_file = base + "_%05d.mp4"
+            cmd += ["-force_key_frames", f"expr:gte(t,n_forced*{self.segment_seconds})", "-f", "segment",
+                    "-segment_time", str(self.segment_seconds), "-segment_list", base + ".csv", "-segment_list_type", "csv",
+                    "-segment_format", "mp4", "-segment_format_options", "movflags=+empty_moov+default_base_moof:frag_duration=1000000:flush_packets=1"]
+            if self.segment_wrap:
+                cmd += ["-segment_wrap", str(self.segment_wrap), "-segment_list_size", str(self.segment_wrap - 1)]
+        cmd.append(segment_file)
+        startupinfo = None
+        if os.name == 'nt':
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            startupinfo.wShowWindow = subprocess.SW_HIDE
+        try:
+            self.child = supervisor.spawn(cmd, "capture", stdin=subprocess.PIPE, stdout=subprocess.PIPE, on_exit=self._exited,
+                                          creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0, startupinfo=startupinfo)
+        except OSError as e:
+            print(f"[VIDEO] Could not start ffmpeg: {e}")
+            return None
+        self.process = self.child.process
+        self.crashed = False
+        self.reader = ProgressReader(self.process.stdout, self.on_progress, self.on_slow, target_fps=float(fps))
+        self.segment_file = segment_file
+        self._spawned_at = time.perf_counter()
+        return segment_file
+
+    def _exited(self, child):
+        if child.stopping or child is not self.child:
+            return
+        print(f"[VIDEO] Capture ffmpeg exited unexpectedly ({child.returncode})")
+        self.crashed = True
+        if self.on_crash: self.on_crash()
+
+    @trace.traced()
+    def pause(self):
+        """Suspend the capture. Returns False if the caller has to end the segment instead."""
+        if self._segmented or not self.process or self.process.poll() is not None:
+            return False
+        import psutil
+        try:
+            psutil.Process(self.process.pid).suspend()
+        except psutil.Error as e:
+            print(f"[VIDEO] Could not suspend capture, falling back to segments: {e}")
+            self._segmented = True
+            return False
+        self.suspended = True
+        self._paused_at = time.perf_counter()
+        return True
+
+    @trace.traced()
+    def resume(self):
+        """Resume a suspended capture. Returns False if the caller has to start a new segment."""
+        if not self.suspended:
+            return False
+        import psutil
+        try:
+            psutil.Process(self.process.pid).resume()
+        except psutil.Error as e:
+            print(f"[VIDEO] Could not resume capture: {e}")
+            self.suspended = False
+            self._segmented = True
+            self.stop()
+            return False
+        self._pauses.append((self._paused_at, time.perf_counter() - self._paused_at))
+        self.suspended = False
+        return True
+
+    @trace.traced()
+    def stop(self):
+        if self.process:
+            child = self.child
+            if self.suspended:
+                import psutil
+                try: psutil.Process(self.process.pid).resume()
+                except psutil.Error: pass
+                self.suspended = False
+            supervisor.stop(child)
+            self.process = None
+            # A crashed capture's timeline ended when it died, not now
+            stopped_at = time.perf_counter() - (time.time() - child.ended if self.crashed else 0.0)
+            if self.reader:
+                self.reader.join()
+                self.segment_stats.append(dict(self.reader.summary(), segment=os.path.basename(self.segment_file),
+                                               process=child.summary()))
+            # The next segment's timeline continues where this one's ends in the concatenation
+            self._gaps = self.gaps
+            self._timeline_s += stopped_at - self._origin()
+            self._pauses = []